@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+#
+# Applies a saved text categorizer model to unseen documents in bulk, using a pool of
+# worker processes. The documents can come from files or standard input (one per line,
+# or id<TAB>text with INPUT_TSV), or from directories (one document per file). The output
+# is id<TAB>label (plus the top scores with SHOW_SCORES), in the same order as the input.
+# Without INPUT_TSV, the id is the line number, prefixed by the file name (i.e., file:line)
+# when there are multiple inputs.
+#
+# Notes:
+# - The model is loaded once before the workers are started, so that they share it
+#   (i.e., via copy-on-write under fork); otherwise, each worker loads it.
+# - Only a limited number of chunks are in process at a time, so memory usage is
+#   bounded regardless of the input size.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Bulk categorization of documents using a saved model"""
+
+# Standard packages
+from collections import deque
+import multiprocessing
+import os
+import sys
+
+# Installed packages
+import numpy
+
+# Local packages
+import debug
+import system
+from text_categorizer import TextCategorizer, get_class_scores, iterate_chunks
+
+APPLY_WORKERS = system.getenv_int("APPLY_WORKERS", multiprocessing.cpu_count())
+APPLY_CHUNK_SIZE = system.getenv_int("APPLY_CHUNK_SIZE", 1000)
+APPLY_MAX_PENDING = system.getenv_int("APPLY_MAX_PENDING", (2 * APPLY_WORKERS))
+INPUT_TSV = system.getenv_bool("INPUT_TSV", False)
+SHOW_SCORES = system.getenv_bool("SHOW_SCORES", False)
+APPLY_TOP_K = system.getenv_int("APPLY_TOP_K", 3)
+
+# Model shared by the worker processes
+text_cat = None
+
+
+def load_model(model_filename):
+    """Load the shared model from MODEL_FILENAME unless already loaded (e.g., inherited from parent)"""
+    global text_cat
+    if text_cat is None:
+        text_cat = TextCategorizer()
+        text_cat.load(model_filename)
+    return
+
+
+def categorize_chunk(chunk):
+    """Worker function returning output lines for CHUNK of (id, text) tuples"""
+    texts = [text for (_id, text) in chunk]
+    lines = []
+    if SHOW_SCORES:
+        # note: the texts are featurized once, with the labels taken from the scores
+        classifier = text_cat.classifier.steps[-1][1]
+        scores = get_class_scores(classifier, text_cat.get_features(texts))
+        classes = classifier.classes_
+        labels = [text_cat.keys[i] for i in classes[numpy.argmax(scores, axis=1)]]
+        for (i, (doc_id, _text)) in enumerate(chunk):
+            top = numpy.argsort(-scores[i])[:APPLY_TOP_K]
+            score_spec = ",".join("{l}:{s}".format(l=text_cat.keys[classes[j]],
+                                                   s=system.round_num(float(scores[i][j])))
+                                  for j in top)
+            lines.append(u"{id}\t{l}\t{s}".format(id=doc_id, l=labels[i], s=score_spec))
+    else:
+        labels = text_cat.categorize_batch(texts)
+        for (i, (doc_id, _text)) in enumerate(chunk):
+            lines.append(u"{id}\t{l}".format(id=doc_id, l=labels[i]))
+    return lines
+
+
+def iterate_documents(inputs):
+    """Yields (id, text) tuples for documents from INPUTS (files, directories or - for stdin)"""
+    for source in inputs:
+        if os.path.isdir(source):
+            for (dir_path, dir_names, file_names) in os.walk(source):
+                dir_names.sort()
+                for name in sorted(file_names):
+                    path = os.path.join(dir_path, name)
+                    yield (path, system.read_entire_file(path))
+            continue
+        # note: files are decompressed if needed (see system.iterate_file_lines)
+        input_file = sys.stdin if (source == "-") else system.iterate_file_lines(source)
+        line_num = 0
+        try:
+            for line in input_file:
+                line_num += 1
+                line = system.from_utf8(line).rstrip("\n")
+                if INPUT_TSV:
+                    items = line.split("\t", 1)
+                    if (len(items) != 2):
+                        debug.trace_fmtd(2, "Warning: Ignoring item w/ unexpected format at line {num} of {f}",
+                                         num=line_num, f=source)
+                        continue
+                    yield (items[0], items[1])
+                elif (len(inputs) > 1):
+                    yield ("{f}:{n}".format(f=source, n=line_num), line)
+                else:
+                    yield (line_num, line)
+        finally:
+            if (input_file != sys.stdin):
+                input_file.close()
+    return
+
+
+def apply_text_categorizer(model_filename, inputs, output=sys.stdout, num_workers=APPLY_WORKERS):
+    """Categorize documents from INPUTS using model in MODEL_FILENAME, writing results to OUTPUT in input order"""
+    debug.trace_fmtd(4, "apply_text_categorizer({m}, {i}, _, {w})", m=model_filename, i=inputs, w=num_workers)
+    load_model(model_filename)
+    chunks = iterate_chunks(iterate_documents(inputs), APPLY_CHUNK_SIZE)
+    num_docs = 0
+    if (num_workers <= 1):
+        for chunk in chunks:
+            for line in categorize_chunk(chunk):
+                output.write(system.to_utf8(line) + "\n")
+            num_docs += len(chunk)
+        return num_docs
+
+    # Submit chunks to the pool, outputting the oldest result once too many are pending
+    # note: Pool.imap would read ahead over the entire input
+    pool = multiprocessing.Pool(num_workers, load_model, (model_filename,))
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(categorize_chunk, (chunk,)))
+            num_docs += len(chunk)
+            while (len(pending) >= APPLY_MAX_PENDING):
+                for line in pending.popleft().get():
+                    output.write(system.to_utf8(line) + "\n")
+        while pending:
+            for line in pending.popleft().get():
+                output.write(system.to_utf8(line) + "\n")
+    finally:
+        pool.close()
+        pool.join()
+    return num_docs
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} model-file [input ...]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- Each input is a file or - for stdin (one document per line) or a directory (one per file).")
+        system.print_stderr("- Standard input is used if no inputs given.")
+        system.print_stderr("- Use INPUT_TSV=1 for lines with id<TAB>text (otherwise line number used as id, as file:line if multiple inputs).")
+        system.print_stderr("- Use SHOW_SCORES=1 to include top scores in output.")
+        system.print_stderr("- APPLY_WORKERS gives number of worker processes ({n} by default).".
+                            format(n=APPLY_WORKERS))
+        return
+    inputs = args[2:] or ["-"]
+    num_docs = apply_text_categorizer(args[1], inputs)
+    debug.trace_fmtd(3, "{n} documents categorized", n=num_docs)
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+#
+# Bake-off over the classifiers supported by the text categorizer (i.e., NB, SVM and SGD)
+# using the same data. The training and testing data are featurized once (i.e., word
+# counts with TF/IDF weighting), and the classifiers are then trained over the shared
+# feature matrix, one at a time by default. A single table compares accuracy, macro-averaged
+# F1, fit time, prediction throughput, 99th percentile latency for single documents, and
+# model size.
+#
+# Usage:
+#    BAKEOFF_CLASSIFIERS=nb,sgd bakeoff_text_categorizer.py train.tsv test.tsv
+#
+# Notes:
+# - The classifier parameters are the usual SVM_xyz and SGD_xyz options (see text_categorizer.py).
+# - With BAKEOFF_WORKERS above 1, the classifiers are trained concurrently via threads,
+#   so the feature matrices are not copied; much of the fitting is done in compiled code
+#   (e.g., libsvm), allowing for overlap. However, the fit times then include contention
+#   from the other fits, so they are labeled as wall-clock times under concurrency.
+# - Single-document latency is measured over the full pipeline (i.e., from raw text),
+#   after all training is done.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Multi-classifier bake-off with shared features"""
+
+# Standard packages
+from multiprocessing.pool import ThreadPool
+import sys
+import time
+
+# Installed packages
+import numpy
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.pipeline import Pipeline
+from sklearn import metrics
+
+# Local packages
+import debug
+import system
+from text_categorizer import TextCategorizer, create_classifier, create_vectorizer, read_categorization_data
+
+BAKEOFF_CLASSIFIERS = system.getenv_text("BAKEOFF_CLASSIFIERS", "nb,sgd,svm")
+# note: 1 for sequential training (i.e., reliable fit times) or 0 for a thread per classifier
+BAKEOFF_WORKERS = system.getenv_int("BAKEOFF_WORKERS", 1)
+BAKEOFF_LATENCY_DOCS = system.getenv_int("BAKEOFF_LATENCY_DOCS", 200)
+# note: if non-empty, each model is saved as <prefix><classifier>.pkl
+BAKEOFF_MODEL_PREFIX = system.getenv_text("BAKEOFF_MODEL_PREFIX", "")
+
+
+def featurize(training_filename, testing_filename):
+    """Return (keys, vectorizer, tfidf, train_matrix, train_labels, test_matrix, test_labels, test_values)
+    Note: test instances with labels not in the training data are ignored"""
+    debug.trace_fmtd(4, "featurize({tr}, {te})", tr=training_filename, te=testing_filename)
+    (labels, values) = read_categorization_data(training_filename)
+    keys = sorted(numpy.unique(labels))
+    key_index = dict((key, i) for (i, key) in enumerate(keys))
+    train_labels = [key_index[l] for l in labels]
+    vectorizer = create_vectorizer()
+    tfidf = TfidfTransformer()
+    train_matrix = tfidf.fit_transform(vectorizer.fit_transform(values))
+    (labels, values) = read_categorization_data(testing_filename)
+    test_values = [v for (l, v) in zip(labels, values) if l in key_index]
+    test_labels = [key_index[l] for l in labels if l in key_index]
+    test_matrix = tfidf.transform(vectorizer.transform(test_values))
+    return (keys, vectorizer, tfidf, train_matrix, train_labels, test_matrix, test_labels, test_values)
+
+
+def fit_classifier(args):
+    """Worker function returning (kind, fitted classifier, fit seconds) for ARGS (kind, matrix, labels)"""
+    (kind, matrix, labels) = args
+    debug.trace_fmtd(4, "fit_classifier({k})", k=kind)
+    classifier = create_classifier(kind)
+    start = time.time()
+    classifier.fit(matrix, labels)
+    return (kind, classifier, (time.time() - start))
+
+
+def run_bakeoff(training_filename, testing_filename, kinds, stream=sys.stdout):
+    """Train classifiers of given KINDS over TRAINING_FILENAME and output comparison over TESTING_FILENAME to STREAM.
+    Returns list of result dicts (one per kind)."""
+    debug.trace_fmtd(4, "run_bakeoff({tr}, {te}, {k})", tr=training_filename, te=testing_filename, k=kinds)
+    start = time.time()
+    (keys, vectorizer, tfidf, train_matrix, train_labels,
+     test_matrix, test_labels, test_values) = featurize(training_filename, testing_filename)
+    feature_seconds = time.time() - start
+    debug.trace_fmtd(3, "Featurized {n} training and {m} test docs in {t} seconds",
+                     n=train_matrix.shape[0], m=test_matrix.shape[0], t=feature_seconds)
+
+    # Train the classifiers over the shared matrix, optionally concurrently
+    num_workers = min((BAKEOFF_WORKERS or len(kinds)), len(kinds))
+    fit_args = [(kind, train_matrix, train_labels) for kind in kinds]
+    if (num_workers > 1):
+        pool = ThreadPool(num_workers)
+        try:
+            fitted = pool.map(fit_classifier, fit_args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fitted = [fit_classifier(a) for a in fit_args]
+
+    # Evaluate each classifier
+    results = []
+    latency_values = test_values[:BAKEOFF_LATENCY_DOCS]
+    for (kind, classifier, fit_seconds) in fitted:
+        start = time.time()
+        predicted = classifier.predict(test_matrix)
+        predict_seconds = time.time() - start
+        text_cat = TextCategorizer()
+        text_cat.keys = keys
+        text_cat.classifier = Pipeline([('vect', vectorizer), ('tfidf', tfidf), ('clf', classifier)])
+        latencies = []
+        for value in latency_values:
+            start = time.time()
+            text_cat.classifier.predict([value])
+            latencies.append(1000.0 * (time.time() - start))
+        if BAKEOFF_MODEL_PREFIX:
+            text_cat.save(BAKEOFF_MODEL_PREFIX + kind + ".pkl")
+        results.append({
+            "classifier": kind,
+            "accuracy": metrics.accuracy_score(test_labels, predicted),
+            "macro_f1": metrics.f1_score(test_labels, predicted, average="macro"),
+            "fit_seconds": fit_seconds,
+            "docs_per_second": (len(test_labels) / max(predict_seconds, 1e-6)),
+            "p99_msec": (numpy.percentile(latencies, 99) if latencies else 0.0),
+            "size": text_cat.get_model_size(),
+        })
+
+    # Output the comparison table
+    # note: concurrent fit times are wall-clock times including contention from the other fits
+    fit_label = "Fit (wall sec, {n} concurrent)".format(n=num_workers) if (num_workers > 1) else "Fit (sec)"
+    stream.write("Classifier\tAccuracy\tMacro-F1\t{f}\tDocs/sec\tP99 (msec)\tSize (bytes)\n".format(f=fit_label))
+    for result in results:
+        stream.write("{c}\t{a}\t{f}\t{t}\t{d}\t{p}\t{s}\n".format(
+            c=result["classifier"], a=system.round_num(result["accuracy"], 4),
+            f=system.round_num(result["macro_f1"], 4), t=system.round_num(result["fit_seconds"], 3),
+            d=system.round_num(result["docs_per_second"], 1), p=system.round_num(result["p99_msec"], 3),
+            s=result["size"]))
+    stream.write("\nFeaturization (shared): {t} seconds\n".format(t=system.round_num(feature_seconds, 3)))
+    return results
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} training-file testing-file".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- BAKEOFF_CLASSIFIERS gives comma-separated classifiers ({c} by default).".
+                            format(c=BAKEOFF_CLASSIFIERS))
+        system.print_stderr("- BAKEOFF_WORKERS gives number of classifiers trained at once ({n} by default; 0 for all).".
+                            format(n=BAKEOFF_WORKERS))
+        system.print_stderr("  With more than one, the fit times are wall-clock times including contention.")
+        system.print_stderr("- BAKEOFF_LATENCY_DOCS gives number of test docs for single-doc latency.")
+        system.print_stderr("- BAKEOFF_MODEL_PREFIX saves each model as <prefix><classifier>.pkl.")
+        return
+    kinds = [k.strip() for k in BAKEOFF_CLASSIFIERS.split(",") if k.strip()]
+    run_bakeoff(args[1], args[2], kinds)
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -9,6 +9,15 @@
 # - So that other local packages can use tracing freely, this only
 #   imports standard packages. In particular, system.py is not imported,
 #   so functionality must be reproduced here (e.g., _to_utf8).
+# - With ASYNC_TRACE, the trace output is added to a bounded ring buffer that is written
+#   by a background thread to TRACE_FILE (or stderr), so that tracing doesn't block on the
+#   writes (e.g., for the CherryPy worker threads). If the buffer fills up, the oldest
+#   records are dropped, and a count is included in the output. Each record includes the
+#   thread name and request ID (see set_request_id). The output from trace_object is
+#   written directly, so it might be out of order with respect to the other traces.
+# - The writer thread is not carried over to forked processes (e.g., pool workers), so
+#   tracing there is synchronous to the same output (via os.register_at_fork, which
+#   requires Python 3.7+).
 #
 # TODO:
 # - Rename as debug_utils so clear that non-standard package.
@@ -26,12 +35,15 @@ import sys_version_info_hack
 
 # Standard packages
 import atexit
+from collections import deque
 from datetime import datetime
 import inspect
 import os
 from pprint import pprint
 import re
 import sys
+import threading
+import time
 
 ALWAYS = 0
 ERROR = 1
@@ -46,12 +58,21 @@ if __debug__:
     DEBUG_LEVEL_LABEL = "DEBUG_LEVEL"
     trace_level = 1
     output_timestamps = False
+    # note: options for asynchronous tracing (see above)
+    ASYNC_TRACE = (str(os.environ.get("ASYNC_TRACE", False)).upper() in ["1", "TRUE"])
+    TRACE_FILE = os.environ.get("TRACE_FILE", "")
+    TRACE_BUFFER_SIZE = 10000
+    TRACE_FLUSH_SECONDS = 0.1
     #
     try:
         trace_level = int(os.environ.get(DEBUG_LEVEL_LABEL, trace_level))
     except:
         sys.stderr.write("Warning: Unable to set tracing level from {v}: {exc}\n".
                          format(v=DEBUG_LEVEL_LABEL, exc=sys.exc_info()))
+    try:
+        TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", TRACE_BUFFER_SIZE))
+    except:
+        sys.stderr.write("Warning: Unable to set trace buffer size: {exc}\n".format(exc=sys.exc_info()))
 
 
     def set_level(level):
@@ -87,15 +108,196 @@ if __debug__:
         return result
 
 
+    # note: (second, text) for the last time formatted by get_time_text
+    last_time_text = (None, "")
+    # note: per-thread request ID (see set_request_id)
+    request_info = threading.local()
+    async_sink = None
+
+
+    def get_time_text(when=None):
+        """Return time-of-day for WHEN (seconds since epoch) as HH:MM:SS.ffffff
+        Note: the formatting of the seconds proper is cached"""
+        global last_time_text
+        if when is None:
+            when = time.time()
+        second = int(when)
+        (cached_second, text) = last_time_text
+        if (second != cached_second):
+            text = time.strftime("%H:%M:%S", time.localtime(second))
+            last_time_text = (second, text)
+        return "%s.%06d" % (text, int((when - second) * 1000000))
+
+
+    def set_request_id(request_id):
+        """Set REQUEST_ID for traces by the current thread (e.g., for web server requests)"""
+        request_info.request_id = request_id
+        return
+
+
+    def get_request_id():
+        """Return request ID for the current thread, or None if not set"""
+        return getattr(request_info, "request_id", None)
+
+
+    class AsyncTraceSink(object):
+        """Bounded ring buffer of trace records, written to a file (or stderr) by a background thread"""
+
+        def __init__(self, filename=None, max_records=TRACE_BUFFER_SIZE):
+            """Class constructor: records up to MAX_RECORDS pending traces for output to FILENAME"""
+            self.stream = open(filename, "a") if filename else sys.stderr
+            self.records = deque(maxlen=max_records)
+            self.lock = threading.Lock()
+            # note: serializes the writes from the background thread and from close
+            self.write_lock = threading.Lock()
+            self.ready = threading.Event()
+            self.done = False
+            # note: set in forked processes, which lack the writer thread
+            self.synchronous = False
+            self.num_dropped = 0
+            self.num_dropped_written = 0
+            self.writer = threading.Thread(target=self.write_records, name="trace-writer")
+            self.writer.daemon = True
+            self.writer.start()
+            return
+
+        def add(self, text):
+            """Add record for trace TEXT, dropping the oldest if full"""
+            record = (time.time(), threading.current_thread().name, get_request_id(), text)
+            if self.synchronous:
+                with self.write_lock:
+                    self.write_lines([self.format_record(record)])
+                return
+            with self.lock:
+                if (len(self.records) == self.records.maxlen):
+                    self.num_dropped += 1
+                self.records.append(record)
+            if not self.ready.is_set():
+                self.ready.set()
+            return
+
+        def flush(self):
+            """Write out the pending records"""
+            with self.write_lock:
+                with self.lock:
+                    records = list(self.records)
+                    self.records.clear()
+                    num_dropped = (self.num_dropped - self.num_dropped_written)
+                    self.num_dropped_written = self.num_dropped
+                lines = []
+                if num_dropped:
+                    lines.append("[trace: {n} records dropped]".format(n=num_dropped))
+                lines += [self.format_record(record) for record in records]
+                self.write_lines(lines)
+            return
+
+        def format_record(self, record):
+            """Return output line for RECORD (i.e., time, thread name, request ID and text)"""
+            (when, thread_name, request_id, text) = record
+            prefix = ("[" + get_time_text(when) + "]: ") if output_timestamps else ""
+            context = thread_name if (request_id is None) else ("%s req=%s" % (thread_name, request_id))
+            return (prefix + "[" + context + "] " + _to_utf8(text))
+
+        def write_lines(self, lines):
+            """Write LINES to the output (n.b., write_lock must be held)"""
+            if lines:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            return
+
+        def reset_after_fork(self):
+            """Switch to synchronous output in a forked process, with new locks and the parent's records discarded"""
+            self.lock = threading.Lock()
+            self.write_lock = threading.Lock()
+            self.ready = threading.Event()
+            self.records.clear()
+            self.num_dropped_written = self.num_dropped
+            self.done = True
+            self.synchronous = True
+            return
+
+        def write_records(self):
+            """Thread function writing the records as added until closed"""
+            while not self.done:
+                self.ready.wait(TRACE_FLUSH_SECONDS)
+                self.ready.clear()
+                self.flush()
+            return
+
+        def close(self):
+            """Stop the background thread and write out any pending records"""
+            self.done = True
+            self.ready.set()
+            self.writer.join(1.0)
+            self.flush()
+            if (self.stream != sys.stderr):
+                self.stream.close()
+            return
+
+
+    def start_async_trace(filename=None, max_records=TRACE_BUFFER_SIZE):
+        """Output traces asynchronously via ring buffer of MAX_RECORDS to FILENAME (or stderr)"""
+        global async_sink
+        if not async_sink:
+            async_sink = AsyncTraceSink(filename, max_records)
+        return
+
+
+    def stop_async_trace():
+        """Write out any pending asynchronous traces and revert to direct output"""
+        global async_sink
+        sink = async_sink
+        async_sink = None
+        if sink:
+            sink.close()
+        return
+
+
+    # note: sink whose locks are held during fork (see prepare_fork)
+    forking_sink = None
+
+
+    def prepare_fork():
+        """Hold the asynchronous trace locks during fork, so that they aren't copied while in use"""
+        global forking_sink
+        forking_sink = async_sink
+        if forking_sink:
+            forking_sink.write_lock.acquire()
+            forking_sink.lock.acquire()
+        return
+
+
+    def resume_after_fork():
+        """Release the asynchronous trace locks in the parent after fork"""
+        if forking_sink:
+            forking_sink.lock.release()
+            forking_sink.write_lock.release()
+        return
+
+
+    def reset_after_fork():
+        """Use synchronous tracing in the forked child, as the writer thread isn't copied"""
+        if forking_sink:
+            forking_sink.reset_after_fork()
+        return
+
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(before=prepare_fork, after_in_parent=resume_after_fork,
+                            after_in_child=reset_after_fork)
+
+
     def trace(level, text):
         """Print TEXT if at trace LEVEL or higher, including newline"""
         if (trace_level >= level):
+            # Queue trace for background output if asynchronous
+            sink = async_sink
+            if sink:
+                sink.add(text)
+                return
             # Prefix trace with timestamp
             if output_timestamps:
-                # Get time-proper from timestamp (TODO: find standard way to do this)
-                timestamp = re.sub(r"^\d+-\d+-\d+\s*", "", timestamp())
-
-                print("[" + timestamp + "]", end=": ", file=sys.stderr)
+                print("[" + get_time_text() + "]", end=": ", file=sys.stderr)
             # Print trace, converted to UTF8 if necessary (Python2 only)
             print(_to_utf8(text), file=sys.stderr)
         return
@@ -232,11 +434,20 @@ if __debug__:
 
     # Show startup time and tracing info
     MODULE_FILE = __file__
+    if ASYNC_TRACE:
+        start_async_trace(TRACE_FILE)
     trace_fmtd(3, "[{f}] loaded at {t}", f=MODULE_FILE, t=timestamp())
-    trace_fmtd(4, "trace_level={l}; output_timestamps={ots}", l=trace_level, ots=output_timestamps)
+    trace_fmtd(4, "trace_level={l}; output_timestamps={ots}; async={a}",
+               l=trace_level, ots=output_timestamps, a=ASYNC_TRACE)
+
+    # Register to show shuttdown time (and to flush asynchronous traces)
+    def at_exit():
+        """Trace shutdown time and write out any pending asynchronous traces"""
+        trace_fmtd(3, "[{f}] unloaded at {t}", f=MODULE_FILE, t=timestamp())
+        stop_async_trace()
+        return
 
-    # Register to show shuttdown time
-    atexit.register(lambda: trace_fmtd(3, "[{f}] unloaded at {t}", f=MODULE_FILE, t=timestamp()))
+    atexit.register(at_exit)
     
 else:
 
@@ -270,6 +481,18 @@ else:
     timestamp = non_debug_stub
 
 
+    set_request_id = non_debug_stub
+
+
+    get_request_id = non_debug_stub
+
+
+    start_async_trace = non_debug_stub
+
+
+    stop_async_trace = non_debug_stub
+
+
     raise_exception = non_debug_stub
 
 
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+#
+# Removes near-duplicate articles from tabular categorization data (i.e., label<TAB>text
+# as used by read_categorization_data). This uses MinHash signatures over word shingles,
+# computed in a single streaming pass, with locality sensitive hashing (LSH) via banding
+# to find candidate duplicates among the articles kept so far. Candidates are confirmed
+# by checking the estimated Jaccard similarity against the threshold.
+#
+# Notes:
+# - With B bands of R rows, the chance of a candidate match is 1 - (1 - s^R)^B for
+#   similarity s, so the default 8 x 8 split gets most pairs above 0.8.
+# - Memory usage is proportional to the number of articles kept (i.e., signature plus
+#   band keys) and not to the text size.
+# - Each bucket lists all of the articles kept with that band key (up to LSH_BUCKET_MAX),
+#   so that clusters of similar articles (e.g., list articles) are fully checked.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Near-duplicate elimination for categorization data"""
+
+# Standard packages
+import sys
+import zlib
+
+# Installed packages
+import numpy
+
+# Local packages
+import debug
+import system
+
+DEDUP_THRESHOLD = system.getenv_float("DEDUP_THRESHOLD", 0.8)
+MINHASH_SIZE = system.getenv_int("MINHASH_SIZE", 64)
+LSH_BANDS = system.getenv_int("LSH_BANDS", 8)
+SHINGLE_SIZE = system.getenv_int("SHINGLE_SIZE", 3)
+MINHASH_SEED = system.getenv_int("MINHASH_SEED", 1)
+SNIPPET_LEN = system.getenv_int("SNIPPET_LEN", 64)
+LSH_BUCKET_MAX = system.getenv_int("LSH_BUCKET_MAX", 100)
+
+# Universal hashing parameters (as with the datasketch package)
+MERSENNE_PRIME = numpy.uint64((1 << 61) - 1)
+MAX_HASH = numpy.uint64((1 << 32) - 1)
+
+
+class MinHashDeduplicator(object):
+    """Detects near-duplicate texts via MinHash signatures and LSH banding"""
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_hashes=MINHASH_SIZE, num_bands=LSH_BANDS,
+                 shingle_size=SHINGLE_SIZE, seed=MINHASH_SEED, bucket_max=LSH_BUCKET_MAX):
+        """Class constructor: texts with estimated similarity of THRESHOLD or more are duplicates.
+        Note: BUCKET_MAX limits the number of texts listed per LSH bucket"""
+        debug.trace_fmtd(5, "MinHashDeduplicator.__init__(t={t}, h={h}, b={b}, s={s})",
+                         t=threshold, h=num_hashes, b=num_bands, s=shingle_size)
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = max(1, num_hashes // num_bands)
+        self.num_hashes = self.rows_per_band * num_bands
+        self.shingle_size = shingle_size
+        random = numpy.random.RandomState(seed)
+        self.hash_a = random.randint(1, (1 << 31), size=self.num_hashes).astype(numpy.uint64)
+        self.hash_b = random.randint(0, (1 << 31), size=self.num_hashes).astype(numpy.uint64)
+        self.bucket_max = bucket_max
+        self.signatures = []
+        # note: maps band keys to lists of indices for the texts kept
+        self.buckets = {}
+        return
+
+    def get_signature(self, text):
+        """Return MinHash signature for TEXT (over lowercase word shingles)"""
+        words = text.lower().split()
+        size = self.shingle_size
+        shingles = set(" ".join(words[i:(i + size)]) for i in range(max(1, len(words) - size + 1)))
+        values = numpy.array([(zlib.crc32(s.encode("UTF-8")) & 0xffffffff) for s in shingles],
+                             dtype=numpy.uint64)
+        hashes = (numpy.outer(values, self.hash_a) + self.hash_b) % MERSENNE_PRIME & MAX_HASH
+        return hashes.min(axis=0).astype(numpy.uint32)
+
+    def band_keys(self, signature):
+        """Return bucket keys for each band of SIGNATURE"""
+        rows = self.rows_per_band
+        return [hash((b, signature[(b * rows):((b + 1) * rows)].tobytes()))
+                for b in range(self.num_bands)]
+
+    def add(self, text):
+        """Check TEXT against texts added so far: returns (index, similarity) of the most similar duplicate or (None, None) if new (in which case it is added)"""
+        signature = self.get_signature(text)
+        keys = self.band_keys(signature)
+        candidates = set()
+        for key in keys:
+            candidates.update(self.buckets.get(key, []))
+        if candidates:
+            candidates = sorted(candidates)
+            similarities = numpy.mean((numpy.array([self.signatures[i] for i in candidates]) == signature), axis=1)
+            best = int(numpy.argmax(similarities))
+            if (similarities[best] >= self.threshold):
+                return (candidates[best], similarities[best])
+        # Register new text
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        for key in keys:
+            bucket = self.buckets.setdefault(key, [])
+            if (len(bucket) < self.bucket_max):
+                bucket.append(index)
+            else:
+                debug.trace_fmtd(6, "Bucket full for text {n}", n=index)
+        return (None, None)
+
+
+def dedup_categorization_data(input_filename, output_filename, report_filename):
+    """Copy INPUT_FILENAME to OUTPUT_FILENAME omitting near duplicates, which are listed in REPORT_FILENAME"""
+    debug.trace_fmtd(4, "dedup_categorization_data({i}, {o}, {r})",
+                     i=input_filename, o=output_filename, r=report_filename)
+    dedup = MinHashDeduplicator()
+    kept_lines = []
+    num_kept = 0
+    num_dropped = 0
+    with open(input_filename) as input_file, open(output_filename, "w") as output_file, \
+            open(report_filename, "w") as report_file:
+        report_file.write("Line\tKeptLine\tSimilarity\tLabel\tKeptLabel\tText\n")
+        for (i, line) in enumerate(input_file):
+            line = system.from_utf8(line)
+            items = line.split("\t")
+            if len(items) != 2:
+                debug.trace_fmtd(4, "Warning: Passing through item w/ unexpected format at line {num}",
+                                 num=(i + 1))
+                output_file.write(system.to_utf8(line))
+                continue
+            (label, text) = items
+            (index, similarity) = dedup.add(text)
+            if index is None:
+                kept_lines.append((i + 1, label))
+                output_file.write(system.to_utf8(line))
+                num_kept += 1
+            else:
+                (kept_line, kept_label) = kept_lines[index]
+                snippet = text[:SNIPPET_LEN].strip()
+                report_file.write(system.to_utf8(u"{n}\t{k}\t{s}\t{l}\t{kl}\t{t}\n".format(
+                    n=(i + 1), k=kept_line, s=system.round_num(similarity, 3),
+                    l=label, kl=kept_label, t=snippet)))
+                num_dropped += 1
+    debug.trace_fmtd(3, "{k} articles kept and {d} dropped", k=num_kept, d=num_dropped)
+    return (num_kept, num_dropped)
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} input-file output-file [report-file]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- The report defaults to the output file plus .dropped.")
+        system.print_stderr("- DEDUP_THRESHOLD gives minimum similarity for duplicates ({t} by default).".
+                            format(t=DEDUP_THRESHOLD))
+        return
+    report_filename = args[3] if (len(args) > 3) else (args[2] + ".dropped")
+    (num_kept, num_dropped) = dedup_categorization_data(args[1], args[2], report_filename)
+    print("Kept {k} articles; dropped {d} near duplicates (see {r})".
+          format(k=num_kept, d=num_dropped, r=report_filename))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -8,6 +8,7 @@
 #------------------------------------------------------------------------
 # Library packages
 
+import os
 import sys
 import re
 import sys_version_info_hack
@@ -23,6 +24,7 @@ import time
 import debug
 from debug import debug_print
 from system import getenv_boolean, getenv_integer, getenv_text, print_stderr
+from wiki_category_page import parse_category_page
 
 #------------------------------------------------------------------------
 # Globals
@@ -35,30 +37,11 @@ SKIP_SUBCATS = getenv_boolean("SKIP_SUBCATS", False)
 SKIP_PAGES = getenv_boolean("SKIP_PAGES", False)
 MAKE_SUBDIRS = getenv_boolean("MAKE_SUBDIRS", False)
 URL_SLEEP = getenv_integer("URL_SLEEP", 1)
-PAGES_START = getenv_text("PAGES_START", "Pages in category")
-PAGES_END = getenv_text("PAGES_END", "Media in category")
+# note: PAGES_START and PAGES_END are now in wiki_category_page.py
 
 #------------------------------------------------------------------------
 # Classes
 
-class my_re:
-    """Class implementing regex search that saves match results (for use in conditions)"""
-    match = None
-
-    @staticmethod
-    def search(regex, text, flags=0):
-        """Search for REGEX in TEXT with optional FLAGS"""
-        my_re.match = re.search(regex, text, flags)
-        if my_re.match:
-            # TODO: while my_re.match.group(i): print my_re.match.group(i)
-            debug_print("match: %s" % my_re.match.group(), 6)
-        return (my_re.match)
-
-    @staticmethod
-    def get_match():
-        """Return MatchObject for last search"""
-        return (my_re.match)
-
 class MyURLOpener(FancyURLopener):
     """URLOpener with personal version (for user-agent): see http://wolfprojects.altervista.org/changeua.php"""
     # TODO-CUSTOMIZE: replace initials and email adress with your own
@@ -148,7 +131,7 @@ def write_file(filename, text):
 def download_category_articles(url, depth=0):
     """Downloads all wikipedia articles subsumed by category at URL"""
     if url in processed:
-        debug_print("URL %s already processed" % URL, 5)
+        debug_print("URL %s already processed" % url, 5)
         return
     processed[url] = True
 
@@ -162,66 +145,36 @@ def download_category_articles(url, depth=0):
     category_name = re.sub(r'[ :&;]', "_", category_name)
     write_file(category_name + ".html", category_source)
 
-    # Scan through the category definition
-    in_subcats_section = False
-    in_pages_section = False
-    line_num = 0
-    for line in category_source.split("\n"):
-        debug_print("%sl%d: %s" % (("\t"*depth), line_num, line), 9)
-        line_num += 1
-        # Update state indicator
-        if re.search(r"Subcategories", line):
-            in_subcats_section = True
-            debug_print("Start of subcategories section at line %d" % line_num, 4)
-        elif re.search(PAGES_START, line):
-            ## OLD: elif re.search(r"Pages in category", line):
-            # TODO: use '<div id="mw-pages">' instead for flagging pages ???
-            in_subcats_section = False
-            in_pages_section = True
-            debug_print("Start of pages section at line %d" % line_num, 4)
-        elif re.search(PAGES_END, line):
-            ## OLD: elif re.search(r"Media in category", line):
-            debug_print("End of pages section at line %d" % line_num, 4)
-            in_pages_section = False
-        elif my_re.search(r'</table>.*href="([^"]+)".*>.*next (\d+).*</a>', line):
-            # note: above use of </table> avoids matching next link prior to pages group
-            in_pages_section = False
-            continuation_url = base_url + my_re.match.group(1)
-            next_num = my_re.match.group(2)
-            debug_print("Recursing over URL with next %s entries: %s" % (next_num, continuation_url), 4)
-            if not SKIP_SUBCATS:
-                download_category_articles(continuation_url, depth=(1+depth))
-
-        # Extract subcategory hyperlink
-        if in_subcats_section:
-            match = re.search(r'href="(/wiki/Category:[^"]+)"', line)
-            if match:
-                subcat_name = match.group(1)
-                subcat_url = base_url + subcat_name
-                debug_print("Recursing over subcat URL: %s" % subcat_url, 4)
-                if not SKIP_SUBCATS:
-                    if MAKE_SUBDIRS:
-                        # Optionally creates new directory for storing pages
-                        make_directory(subcat_name)
-                        change_directory(subcat_name)
-                    download_category_articles(subcat_url, depth=(1+depth))
-            else:
-                debug_print("Ignoring category-section line: %s" % line, 6)
-        # Extract page hyperlinks
-        elif in_pages_section:
-            match = re.search(r'<li>.*href="(/wiki/([^"]+))"', line)
-            if match:
-                page_url = base_url + match.group(1)
-                article_name = match.group(2)
-                debug_print("Downloading article URL: %s" % page_url, 4)
-                if not SKIP_PAGES:
-                    page_source = get_url_source(page_url)
-                    article_name = re.sub(r'[ :]', "_", article_name)
-                    write_file(article_name + ".html", page_source)
-            else:
-                debug_print("Ignoring pages-section line: %s" % line, 6)
-        else:
-            debug_print("Ignoring misc. line: %s" % line, 6)
+    # Extract the subcategory, page and continuation links
+    (subcat_names, page_names, continuation_names) = parse_category_page(category_source)
+
+    # Recurse over subcategories
+    for subcat_name in subcat_names:
+        subcat_url = base_url + subcat_name
+        debug_print("Recursing over subcat URL: %s" % subcat_url, 4)
+        if not SKIP_SUBCATS:
+            if MAKE_SUBDIRS:
+                # Optionally creates new directory for storing pages
+                make_directory(subcat_name)
+                change_directory(subcat_name)
+            download_category_articles(subcat_url, depth=(1+depth))
+
+    # Download articles
+    for page_name in page_names:
+        page_url = base_url + page_name
+        article_name = re.sub(r'^/wiki/', "", page_name)
+        debug_print("Downloading article URL: %s" % page_url, 4)
+        if not SKIP_PAGES:
+            page_source = get_url_source(page_url)
+            article_name = re.sub(r'[ :]', "_", article_name)
+            write_file(article_name + ".html", page_source)
+
+    # Recurse over continuation pages (e.g., next 200)
+    for continuation_name in continuation_names:
+        continuation_url = base_url + continuation_name
+        debug_print("Recursing over continuation URL: %s" % continuation_url, 4)
+        if not SKIP_SUBCATS:
+            download_category_articles(continuation_url, depth=(1+depth))
 
 def main():
     """
@@ -0,0 +1,346 @@
+#! /usr/bin/env python
+#
+# Builds the article to category mapping and the training data for the text categorizer
+# directly from a local Wikipedia dump (i.e., pages-articles.xml or .xml.bz2), rather than
+# crawling the category pages as with download_wiki_category.py.
+#
+# For multistream dumps (i.e., pages-articles-multistream.xml.bz2, which consist of
+# independent bzip2 streams of about 100 pages each), the work is split over ranges of the
+# compressed streams, with each worker process doing the decompression, XML parsing and
+# per-article processing (i.e., category extraction and markup removal) for its ranges.
+# The stream offsets are found by scanning for the bzip2 stream header.
+#
+# Other dumps (i.e., uncompressed or a single bzip2 stream) can't be split that way, because
+# the bzip2 blocks within a stream aren't byte-aligned. So these are decompressed and parsed
+# incrementally in the main process, with constant memory usage, and only the per-article
+# processing is done by the workers over batches of pages.
+#
+# The category links in the article source are extracted via regex patterns (as
+# mentioned in the README), and the mapping file has regex<TAB>user-category entries
+# used to select the representative category, with the first matching entry used:
+#    ^Living people$     people
+#    films?$             movie
+#
+# Notes:
+# - CATEGORY_NAMESPACE needs to be changed for other languages (e.g., Spanish).
+# - Without a mapping file, the first category for the article is used.
+# - Redirects and pages outside of the main namespace are skipped.
+# - The output is in dump order in either case.
+# - With --self-test, the synthetic dumps in FIXTURE_DIR (pages-articles.xml and the
+#   multistream version) are checked against the expected output files there.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Offline corpus builder from Wikipedia XML dumps"""
+
+# Standard packages
+import bz2
+from collections import deque
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+# Local packages
+import debug
+import system
+
+CATEGORY_NAMESPACE = system.getenv_text("CATEGORY_NAMESPACE", "Category")
+DUMP_WORKERS = system.getenv_int("DUMP_WORKERS", multiprocessing.cpu_count())
+DUMP_BATCH_SIZE = system.getenv_int("DUMP_BATCH_SIZE", 500)
+DUMP_MAX_PENDING = system.getenv_int("DUMP_MAX_PENDING", (2 * DUMP_WORKERS))
+MIN_TEXT_LEN = system.getenv_int("MIN_TEXT_LEN", 100)
+MAX_TEXT_LEN = system.getenv_int("MAX_TEXT_LEN", 0)
+# note: minimum compressed bytes of multistream dump per worker task
+DUMP_RANGE_BYTES = system.getenv_int("DUMP_RANGE_BYTES", (1024 * 1024))
+DUMP_SCAN_BYTES = system.getenv_int("DUMP_SCAN_BYTES", (16 * 1024 * 1024))
+FIXTURE_DIR = system.getenv_text("FIXTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "fixtures"))
+FIXTURE_NAME = "pages-articles"
+
+CATEGORY_LINK_REGEX = re.compile(r"\[\[\s*" + CATEGORY_NAMESPACE + r"\s*:\s*([^\]\|]+)[^\]]*\]\]",
+                                 re.IGNORECASE)
+TEMPLATE_REGEX = re.compile(r"\{\{[^\{\}]*\}\}")
+TABLE_REGEX = re.compile(r"\{\|.*?\|\}", re.DOTALL)
+REF_REGEX = re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE)
+COMMENT_REGEX = re.compile(r"<!--.*?-->", re.DOTALL)
+FILE_LINK_REGEX = re.compile(r"\[\[(?:[^\]\[:|]+):[^\]\[]*(?:\[\[[^\]]*\]\][^\]\[]*)*\]\]")
+LINK_REGEX = re.compile(r"\[\[(?:[^\]\|]*\|)?([^\]]*)\]\]")
+EXTERNAL_LINK_REGEX = re.compile(r"\[https?://[^\s\]]+\s*([^\]]*)\]")
+TAG_REGEX = re.compile(r"<[^>]+>")
+MARKUP_REGEX = re.compile(r"'{2,}|^[=*#:;]+|=+\s*$", re.MULTILINE)
+WHITESPACE_REGEX = re.compile(r"\s+")
+# note: bzip2 stream header (e.g., BZh9) followed by the block magic number (pi in BCD)
+BZ2_STREAM_REGEX = re.compile(b"BZh[1-9]\x31\x41\x59\x26\x53\x59")
+BZ2_STREAM_HEADER_LEN = 10
+PAGE_REGEX = re.compile(b"<page>.*?</page>", re.DOTALL)
+
+
+def read_category_mapping(filename):
+    """Returns list of (compiled regex, user category) from FILENAME with regex<TAB>category entries"""
+    # note: entries kept in file order, because the first match is used
+    mapping = []
+    if filename:
+        with open(filename) as f:
+            for line in f:
+                items = system.from_utf8(line).rstrip("\n").split("\t")
+                if (len(items) == 2):
+                    mapping.append((re.compile(items[0], re.IGNORECASE), items[1].strip()))
+    return mapping
+
+
+def clean_wiki_text(source):
+    """Return plain text for wiki markup SOURCE (approximate)"""
+    text = COMMENT_REGEX.sub(" ", source)
+    text = REF_REGEX.sub(" ", text)
+    # note: templates can be nested, so removed from the inside out
+    previous = None
+    while (previous != text):
+        previous = text
+        text = TEMPLATE_REGEX.sub(" ", text)
+    text = TABLE_REGEX.sub(" ", text)
+    text = FILE_LINK_REGEX.sub(" ", text)
+    text = LINK_REGEX.sub(r"\1", text)
+    text = EXTERNAL_LINK_REGEX.sub(r"\1", text)
+    text = TAG_REGEX.sub(" ", text)
+    text = MARKUP_REGEX.sub(" ", text)
+    return WHITESPACE_REGEX.sub(" ", text).strip()
+
+
+def process_pages(args):
+    """Worker function returning (article, category, text) tuples for the pages in ARGS (mapping, pages)"""
+    (mapping, pages) = args
+    results = []
+    for (title, source) in pages:
+        categories = [c.strip() for c in CATEGORY_LINK_REGEX.findall(source)]
+        category = None
+        if not mapping:
+            category = categories[0] if categories else None
+        for (regex, user_category) in mapping:
+            if any(regex.search(c) for c in categories):
+                category = user_category
+                break
+        if category is None:
+            continue
+        text = clean_wiki_text(CATEGORY_LINK_REGEX.sub(" ", source))
+        if (len(text) < MIN_TEXT_LEN):
+            continue
+        if (MAX_TEXT_LEN > 0):
+            text = text[:MAX_TEXT_LEN]
+        article = re.sub(r"\s", "_", title.strip().lower())
+        results.append((article, category, text))
+    return results
+
+
+def parse_page(element):
+    """Return (title, source) for article in <page> ELEMENT, or None if not applicable (e.g., redirect)"""
+    title = namespace = text = None
+    is_redirect = False
+    for child in element.iter():
+        tag = re.sub("^{.*}", "", child.tag)
+        if (tag == "title"):
+            title = child.text
+        elif (tag == "ns"):
+            namespace = child.text
+        elif (tag == "redirect"):
+            is_redirect = True
+        elif (tag == "text"):
+            text = child.text
+    if (namespace not in [None, "0"]) or is_redirect or (not title) or (not text):
+        debug.trace_fmtd(6, "Skipping page {t}", t=title)
+        return None
+    return (title, text)
+
+
+def iterate_dump_pages(dump_filename):
+    """Yields (title, source) for articles in DUMP_FILENAME (optionally bzip2-compressed)"""
+    dump_file = bz2.BZ2File(dump_filename) if dump_filename.endswith(".bz2") else open(dump_filename, "rb")
+    try:
+        root = None
+        for (event, element) in ElementTree.iterparse(dump_file, events=("start", "end")):
+            if (event == "start"):
+                if root is None:
+                    root = element
+                continue
+            if (re.sub("^{.*}", "", element.tag) != "page"):
+                continue
+            page = parse_page(element)
+            # Free the memory for the page (including reference from root)
+            element.clear()
+            root.clear()
+            if page:
+                yield page
+    finally:
+        dump_file.close()
+    return
+
+
+def iterate_page_batches(dump_filename, batch_size=DUMP_BATCH_SIZE):
+    """Yields lists of up to BATCH_SIZE (title, source) tuples for articles in DUMP_FILENAME"""
+    batch = []
+    for page in iterate_dump_pages(dump_filename):
+        batch.append(page)
+        if (len(batch) >= batch_size):
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+    return
+
+
+def get_dump_ranges(dump_filename, range_bytes=DUMP_RANGE_BYTES):
+    """Return list of (start, end) byte ranges of at least RANGE_BYTES over the bzip2 streams
+    in DUMP_FILENAME, each covering whole streams (e.g., just one range unless multistream)"""
+    offsets = []
+    position = 0
+    overlap = b""
+    with open(dump_filename, "rb") as f:
+        while True:
+            chunk = f.read(DUMP_SCAN_BYTES)
+            if not chunk:
+                break
+            data = overlap + chunk
+            # note: the overlap is shorter than the header, so matches aren't repeated
+            offsets += [(position - len(overlap) + m.start()) for m in BZ2_STREAM_REGEX.finditer(data)]
+            overlap = data[-(BZ2_STREAM_HEADER_LEN - 1):]
+            position += len(chunk)
+    ranges = []
+    start = 0
+    for offset in offsets[1:]:
+        if ((offset - start) >= range_bytes):
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, position))
+    debug.trace_fmtd(4, "{n} streams in {r} ranges for {f}", n=len(offsets), r=len(ranges), f=dump_filename)
+    return ranges
+
+
+def decompress_streams(data):
+    """Return DATA with one or more concatenated bzip2 streams decompressed"""
+    # note: bz2.decompress only handles the first stream under Python 2
+    chunks = []
+    while data:
+        decompressor = bz2.BZ2Decompressor()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+def process_dump_range(args):
+    """Worker function returning (article, category, text) tuples for the pages in the byte range
+    of the multistream dump given by ARGS (mapping, dump_filename, start, end)"""
+    (mapping, dump_filename, start, end) = args
+    with open(dump_filename, "rb") as f:
+        f.seek(start)
+        data = decompress_streams(f.read(end - start))
+    # note: the pages don't span streams, although the first and last have the <mediawiki> tags
+    pages = [parse_page(ElementTree.fromstring(m.group(0))) for m in PAGE_REGEX.finditer(data)]
+    return process_pages((mapping, [p for p in pages if p]))
+
+
+def extract_wiki_dump(dump_filename, output_prefix, mapping_filename=None, num_workers=DUMP_WORKERS,
+                      range_bytes=DUMP_RANGE_BYTES):
+    """Extract article mapping (OUTPUT_PREFIX.mapping.tsv) and training data (OUTPUT_PREFIX.tsv) from DUMP_FILENAME
+    using optional regex category mapping in MAPPING_FILENAME. Returns number of articles.
+    Note: multistream dumps are split into ranges of RANGE_BYTES or more for the NUM_WORKERS processes."""
+    debug.trace_fmtd(4, "extract_wiki_dump({d}, {o}, {m}, {w}, {r})",
+                     d=dump_filename, o=output_prefix, m=mapping_filename, w=num_workers, r=range_bytes)
+    mapping = read_category_mapping(mapping_filename)
+    num_articles = 0
+    pool = multiprocessing.Pool(num_workers) if (num_workers > 1) else None
+    ranges = get_dump_ranges(dump_filename, range_bytes) if (pool and dump_filename.endswith(".bz2")) else []
+    if (len(ranges) > 1):
+        tasks = ((process_dump_range, (mapping, dump_filename, start, end)) for (start, end) in ranges)
+    else:
+        # note: the dump is parsed in this process while the workers process the batches
+        tasks = ((process_pages, (mapping, batch)) for batch in iterate_page_batches(dump_filename))
+    pending = deque()
+    with open(output_prefix + ".mapping.tsv", "w") as mapping_file, \
+            open(output_prefix + ".tsv", "w") as data_file:
+
+        def output_results(results):
+            """Write RESULTS to mapping and data files, returning number of articles"""
+            for (article, category, text) in results:
+                mapping_file.write(system.to_utf8(u"{a}\t{c}\n".format(a=article, c=category)))
+                data_file.write(system.to_utf8(u"{c}\t{t}\n".format(c=category, t=text)))
+            return len(results)
+
+        try:
+            for (function, task_args) in tasks:
+                if pool:
+                    pending.append(pool.apply_async(function, (task_args,)))
+                else:
+                    num_articles += output_results(function(task_args))
+                # Output oldest results once too many pending, keeping the dump order
+                while (len(pending) >= DUMP_MAX_PENDING):
+                    num_articles += output_results(pending.popleft().get())
+            while pending:
+                num_articles += output_results(pending.popleft().get())
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+    debug.trace_fmtd(3, "{n} articles extracted", n=num_articles)
+    return num_articles
+
+
+def check_fixtures(directory=FIXTURE_DIR, stream=sys.stdout):
+    """Check extract_wiki_dump over the synthetic dumps in DIRECTORY (plain and multistream) against
+    the expected output files there (e.g., pages-articles.expected.tsv), using the .categories.tsv mapping.
+    Returns number of failed dumps."""
+    num_failed = 0
+    base = os.path.join(directory, FIXTURE_NAME)
+    output_dir = tempfile.mkdtemp()
+    try:
+        # note: the multistream dump is split into a range per stream, so that its workers are exercised
+        for (dump_filename, num_workers) in [(base + ".xml", 1), (base + "-multistream.xml.bz2", 2)]:
+            output_prefix = os.path.join(output_dir, os.path.basename(dump_filename))
+            extract_wiki_dump(dump_filename, output_prefix, base + ".categories.tsv", num_workers, range_bytes=1)
+            problems = []
+            for suffix in [".mapping.tsv", ".tsv"]:
+                expected = system.read_entire_file(base + ".expected" + suffix)
+                actual = system.read_entire_file(output_prefix + suffix)
+                if (expected != actual):
+                    problems.append(suffix)
+                    stream.write("{f}: {s} output differs: expected\n{e}got\n{a}".format(
+                        f=dump_filename, s=suffix, e=expected, a=actual))
+            stream.write("{f}: {r}\n".format(f=os.path.basename(dump_filename),
+                                             r=("FAILED" if problems else "ok")))
+            num_failed += (1 if problems else 0)
+    finally:
+        shutil.rmtree(output_dir)
+    return num_failed
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if ((len(args) > 1) and (args[1] == "--self-test")):
+        sys.exit(1 if check_fixtures() else 0)
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} [--self-test | dump-file output-prefix [category-mapping]]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- The dump file is pages-articles.xml (or .xml.bz2).")
+        system.print_stderr("- Multistream dumps (pages-articles-multistream.xml.bz2) are split over the workers;")
+        system.print_stderr("  otherwise, the decompression and parsing are done serially.")
+        system.print_stderr("- Output goes to prefix.mapping.tsv (article<TAB>category) and prefix.tsv (category<TAB>text).")
+        system.print_stderr("- The category mapping has regex<TAB>user-category entries.")
+        system.print_stderr("- DUMP_WORKERS gives number of worker processes ({n} by default).".
+                            format(n=DUMP_WORKERS))
+        system.print_stderr("- --self-test checks the synthetic dumps in FIXTURE_DIR ({d} by default).".
+                            format(d=FIXTURE_DIR))
+        return
+    mapping_filename = args[3] if (len(args) > 3) else None
+    num_articles = extract_wiki_dump(args[1], args[2], mapping_filename)
+    print("{n} articles extracted".format(n=num_articles))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+#
+# Reports on the memory footprint of a saved text categorizer model, giving the size of
+# each component (e.g., vocabulary, IDF vector, and classifier coefficients), along with
+# the size on disk and the time to load the model.
+#
+# Note:
+# - The sizes are estimates of the in-memory usage of the arrays and collections
+#   (see text_categorizer.get_object_size), not the process RSS.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Model memory footprint report"""
+
+# Standard packages
+import sys
+
+# Local packages
+import debug
+import system
+from text_categorizer import TextCategorizer
+
+MIN_COMPONENT_PCT = system.getenv_float("MIN_COMPONENT_PCT", 0.0)
+
+
+def format_bytes(num_bytes):
+    """Return NUM_BYTES formatted with units (e.g., 2.5M)"""
+    # EX: format_bytes(2621440) => "2.5M"
+    value = float(num_bytes)
+    for unit in ["", "K", "M"]:
+        if (value < 1024):
+            return "{v}{u}".format(v=system.round_num(value, 1), u=unit)
+        value /= 1024
+    return "{v}G".format(v=system.round_num(value, 1))
+
+
+def inspect_model(model_filename, stream=sys.stdout):
+    """Output size breakdown for model in MODEL_FILENAME to STREAM, returning the TextCategorizer"""
+    debug.trace_fmtd(4, "inspect_model({f})", f=model_filename)
+    text_cat = TextCategorizer()
+    text_cat.load(model_filename)
+    breakdown = sorted(text_cat.get_size_breakdown(), key=lambda item: -item[1])
+    total = max(1, sum(size for (_component, size) in breakdown))
+    stream.write("Component\tBytes\tSize\tPct\n")
+    for (component, size) in breakdown:
+        pct = 100.0 * size / total
+        if (pct >= MIN_COMPONENT_PCT):
+            stream.write("{c}\t{b}\t{s}\t{p}\n".format(c=component, b=size, s=format_bytes(size),
+                                                      p=system.round_num(pct, 1)))
+    disk_size = system.get_file_size(model_filename)
+    stream.write("\n")
+    stream.write("In-memory size: {s} ({b} bytes)\n".format(s=format_bytes(total), b=total))
+    stream.write("On-disk size: {s} ({b} bytes)\n".format(s=format_bytes(disk_size), b=disk_size))
+    stream.write("Load time: {t} seconds\n".format(t=system.round_num(text_cat.load_seconds, 3)))
+    return text_cat
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} model-file".format(p=args[0]))
+        system.print_stderr("Note: MIN_COMPONENT_PCT omits components below given percent of total")
+        return
+    inspect_model(args[1])
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
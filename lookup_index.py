@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+#
+# Disk-backed version of the hash lookup from system.read_lookup_table, using an
+# SQLite database file as the index (e.g., for the article to category mapping over
+# all of Wikipedia). Lookups are done via the primary-key B-tree, so the table is not
+# read into memory, and startup is immediate.
+#
+# Usage:
+#    lookup_index.py build article-categories.tsv article-categories.db
+#    lookup_index.py lookup article-categories.db andy_dick amy_heckerling
+#
+#    from lookup_index import read_lookup_index
+#    article_category = read_lookup_index("article-categories.db")
+#    category = article_category.get("andy_dick")
+#
+# Notes:
+# - The values are the same as with read_lookup_table (e.g., including newline).
+# - The database is memory-mapped by SQLite (see LOOKUP_MMAP_SIZE), so repeated lookups
+#   are served from the page cache.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Disk-backed hash lookup tables"""
+
+from __future__ import print_function
+
+# Standard packages
+import sqlite3
+import sys
+import threading
+
+# Local packages
+import debug
+import system
+
+LOOKUP_BATCH_SIZE = system.getenv_int("LOOKUP_BATCH_SIZE", 500)
+LOOKUP_MMAP_SIZE = system.getenv_int("LOOKUP_MMAP_SIZE", (1024 * 1024 * 1024))
+
+
+def build_lookup_index(table_filename, index_filename):
+    """Create INDEX_FILENAME with key<TAB>value entries from TABLE_FILENAME, returning number of entries"""
+    # Note: as with read_lookup_table, later entries for a key replace earlier ones
+    debug.trace_fmtd(4, "build_lookup_index({t}, {i})", t=table_filename, i=index_filename)
+    connection = sqlite3.connect(index_filename)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("DROP TABLE IF EXISTS lookup")
+        connection.execute("CREATE TABLE lookup (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID")
+        batch = []
+        with open(table_filename) as f:
+            for (i, line) in enumerate(f):
+                line = system.from_utf8(line)
+                try:
+                    (key, value) = line.split("\t", 1)
+                except ValueError:
+                    debug.trace_fmtd(2, "Warning: Ignoring entry w/o tab at line {n}", n=(i + 1))
+                    continue
+                batch.append((key, value))
+                if (len(batch) >= LOOKUP_BATCH_SIZE):
+                    connection.executemany("INSERT OR REPLACE INTO lookup VALUES (?, ?)", batch)
+                    batch = []
+        connection.executemany("INSERT OR REPLACE INTO lookup VALUES (?, ?)", batch)
+        connection.commit()
+        # note: counts unique keys (i.e., not rows read), given the replacement of duplicates
+        num_entries = connection.execute("SELECT COUNT(*) FROM lookup").fetchone()[0]
+    finally:
+        connection.close()
+    debug.trace_fmtd(4, "build_lookup_index() => {n}", n=num_entries)
+    return num_entries
+
+
+class LookupIndex(object):
+    """Read-only hash lookup backed by index file from build_lookup_index"""
+
+    def __init__(self, filename):
+        """Class constructor: opens index in FILENAME"""
+        debug.trace_fmtd(5, "LookupIndex.__init__({f})", f=filename)
+        self.filename = filename
+        # note: the connection is shared by threads (e.g., CherryPy workers), so access is serialized
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA mmap_size = {n}".format(n=LOOKUP_MMAP_SIZE))
+        self.lock = threading.Lock()
+        return
+
+    def query(self, sql, parameters=()):
+        """Run SQL query with PARAMETERS and return all resulting rows"""
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get(self, key, default=None):
+        """Return value for KEY or DEFAULT if not found"""
+        rows = self.query("SELECT value FROM lookup WHERE key = ?", (key,))
+        value = rows[0][0] if rows else default
+        debug.trace_fmtd(7, "LookupIndex.get({k}) => {v}", k=key, v=value)
+        return value
+
+    def __getitem__(self, key):
+        """Return value for KEY, raising KeyError if not found"""
+        rows = self.query("SELECT value FROM lookup WHERE key = ?", (key,))
+        if not rows:
+            raise KeyError(key)
+        return rows[0][0]
+
+    def __contains__(self, key):
+        """Whether KEY is in the index"""
+        return bool(self.query("SELECT 1 FROM lookup WHERE key = ?", (key,)))
+
+    def __len__(self):
+        """Return number of entries"""
+        return self.query("SELECT COUNT(*) FROM lookup")[0][0]
+
+    def lookup_batch(self, keys):
+        """Return hash with values for the KEYS that are found (e.g., for bulk lookups during extraction)"""
+        result = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:(start + LOOKUP_BATCH_SIZE)]
+            sql = "SELECT key, value FROM lookup WHERE key IN ({p})".format(p=", ".join(["?"] * len(batch)))
+            result.update(self.query(sql, batch))
+        debug.trace_fmtd(7, "lookup_batch({n} keys) => {m} found", n=len(keys), m=len(result))
+        return result
+
+    def close(self):
+        """Close the index file"""
+        self.connection.close()
+        return
+
+
+def read_lookup_index(filename):
+    """Returns LookupIndex for FILENAME, which supports hash-style lookups as with system.read_lookup_table"""
+    return LookupIndex(filename)
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if ((len(args) < 4) or (args[1] not in ["build", "lookup"])):
+        system.print_stderr("Usage: {p} build table-file index-file".format(p=args[0]))
+        system.print_stderr("       {p} lookup index-file key ...".format(p=args[0]))
+        return
+    if (args[1] == "build"):
+        num_entries = build_lookup_index(args[2], args[3])
+        print("{n} entries indexed in {f}".format(n=num_entries, f=args[3]))
+    else:
+        index = read_lookup_index(args[2])
+        found = index.lookup_batch(args[3:])
+        for key in args[3:]:
+            print(system.to_utf8(u"{k}\t{v}".format(k=key, v=found.get(key, "n/a\n"))), end="")
+        index.close()
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
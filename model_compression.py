@@ -0,0 +1,193 @@
+#! /usr/bin/env python
+#
+# Post-training compression for linear text categorizer models (i.e., SGD and NB), which
+# store dense float64 matrices of shape categories x vocabulary. The weights are converted
+# to float32 or to int8 with per-class scales, and near-zero weights can optionally be
+# dropped in favor of a sparse representation. The compressed classifier replaces the
+# final step of the pipeline, so it is used directly for inference.
+#
+# Notes:
+# - NB is handled as a linear model: the joint log likelihood is the dot product of the
+#   features and feature_log_prob_, plus class_log_prior_.
+# - For multi-class models, the per-feature mean over the classes is subtracted from the
+#   weights, which doesn't affect the predictions but makes most weights near zero.
+#   Therefore, the decision values differ from the original ones by a per-document offset.
+# - SVC models are not supported (e.g., RBF kernel not linear).
+# - Models with the compressed classifier refer to this module when pickled, so nothing here
+#   imports text_categorizer at the module level (i.e., unpickling from the web server would
+#   otherwise be circular). Likewise, the script runs via the module import (see end).
+# - The classifier parameter is an unfitted copy of the original (i.e., just the settings),
+#   so that the compressed model can be refit or cloned without keeping the full weights.
+#
+# Usage:
+#    COMPRESS_PRECISION=int8 COMPRESS_THRESHOLD=0.01 model_compression.py model.pkl model-small.pkl test.tsv
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Reduced-precision and sparsified model coefficients"""
+
+# Standard packages
+import sys
+import time
+
+# Installed packages
+import numpy
+from scipy import sparse
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+from sklearn.pipeline import Pipeline
+
+# Local packages
+import debug
+import system
+
+COMPRESS_PRECISION = system.getenv_text("COMPRESS_PRECISION", "float32")
+COMPRESS_THRESHOLD = system.getenv_float("COMPRESS_THRESHOLD", 0.0)
+INT8_MAX = 127
+
+
+class CompressedLinearClassifier(BaseEstimator, ClassifierMixin):
+    """Linear classifier using compressed weights (e.g., int8 with per-class scales)"""
+
+    def __init__(self, classifier=None, precision=COMPRESS_PRECISION, threshold=COMPRESS_THRESHOLD):
+        """Class constructor: weights from CLASSIFIER (unfitted, as with sklearn.clone) get compressed
+        using PRECISION (float32 or int8), dropping weights with magnitude below THRESHOLD times the
+        largest for the class (see fit and compress)"""
+        debug.trace_fmtd(5, "CompressedLinearClassifier.__init__({c}, {p}, {t})",
+                         c=type(classifier).__name__, p=precision, t=threshold)
+        self.classifier = classifier
+        self.precision = precision
+        self.threshold = threshold
+        return
+
+    def fit(self, X, y):
+        """Fit copy of the classifier over feature matrix X with labels Y and then compress it"""
+        return self.compress(clone(self.classifier).fit(X, y))
+
+    def compress(self, classifier):
+        """Set the weights from fitted CLASSIFIER in compressed form, returning self"""
+        precision = self.precision
+        threshold = self.threshold
+        if hasattr(classifier, "support_vectors_"):
+            raise ValueError("SVC models are not supported for compression")
+        if hasattr(classifier, "coef_"):
+            weights = numpy.asarray(classifier.coef_, dtype=numpy.float64)
+            intercept = numpy.asarray(classifier.intercept_, dtype=numpy.float64)
+        elif hasattr(classifier, "feature_log_prob_"):
+            weights = numpy.asarray(classifier.feature_log_prob_, dtype=numpy.float64)
+            intercept = numpy.asarray(classifier.class_log_prior_, dtype=numpy.float64)
+        else:
+            raise ValueError("Unsupported classifier for compression: {c}".format(c=type(classifier).__name__))
+        if (precision not in ["float32", "int8"]):
+            raise ValueError("Unsupported precision: {p}".format(p=precision))
+        self.classes_ = classifier.classes_
+        if (weights.shape[0] > 1):
+            weights = weights - weights.mean(axis=0)
+
+        # Drop near-zero weights
+        max_weights = numpy.abs(weights).max(axis=1)
+        if (threshold > 0):
+            weights = numpy.where((numpy.abs(weights) < (threshold * max_weights[:, numpy.newaxis])), 0.0, weights)
+
+        # Quantize the weights
+        self.scales_ = None
+        if (precision == "int8"):
+            self.scales_ = (numpy.maximum(max_weights, 1e-12) / INT8_MAX).astype(numpy.float32)
+            weights = numpy.round(weights / self.scales_[:, numpy.newaxis]).astype(numpy.int8)
+        else:
+            weights = weights.astype(numpy.float32)
+        self.weights_ = sparse.csr_matrix(weights) if (threshold > 0) else weights
+        self.intercept_ = intercept.astype(numpy.float32)
+        return self
+
+    def decision_function(self, X):
+        """Return decision values for feature matrix X (e.g., TF/IDF weights)"""
+        scores = X.dot(self.weights_.T)
+        scores = scores.toarray() if sparse.issparse(scores) else numpy.asarray(scores)
+        if self.scales_ is not None:
+            scores = scores * self.scales_
+        scores = scores + self.intercept_
+        if (scores.shape[1] == 1):
+            scores = scores.ravel()
+        return scores
+
+    def predict(self, X):
+        """Return predicted classes for feature matrix X"""
+        scores = self.decision_function(X)
+        if (len(scores.shape) == 1):
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[numpy.argmax(scores, axis=1)]
+
+
+def compress_text_categorizer(text_cat, precision=COMPRESS_PRECISION, threshold=COMPRESS_THRESHOLD):
+    """Replace classifier in TEXT_CAT pipeline with compressed version (see CompressedLinearClassifier)"""
+    steps = text_cat.classifier.steps
+    classifier = steps[-1][1]
+    compressed = CompressedLinearClassifier(clone(classifier), precision, threshold).compress(classifier)
+    text_cat.classifier = Pipeline(steps[:-1] + [(steps[-1][0], compressed)])
+    return text_cat
+
+
+def time_predictions(text_cat, values):
+    """Return milliseconds per document for categorizing VALUES"""
+    start = time.time()
+    text_cat.classifier.predict(values)
+    return (1000.0 * (time.time() - start) / max(1, len(values)))
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    # note: imported here rather than at the top (see header comments)
+    from text_categorizer import TextCategorizer, read_categorization_data
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} model-file output-model-file [testing-file]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- COMPRESS_PRECISION gives weight type: float32 or int8 ({p} by default).".
+                            format(p=COMPRESS_PRECISION))
+        system.print_stderr("- COMPRESS_THRESHOLD drops weights below fraction of the maximum per class (e.g., 0.01).")
+        system.print_stderr("- With the testing file, the accuracy, size and latency changes are reported.")
+        return
+    (model_filename, output_filename) = args[1:3]
+    testing_filename = args[3] if (len(args) > 3) else None
+    text_cat = TextCategorizer()
+    text_cat.load(model_filename)
+
+    # Get statistics for the original model
+    values = None
+    old_accuracy = old_latency = None
+    old_size = text_cat.get_model_size()
+    if testing_filename:
+        (labels, values) = read_categorization_data(testing_filename)
+        values = [v for (l, v) in zip(labels, values) if l in text_cat.keys]
+        old_accuracy = text_cat.test(testing_filename)
+        old_latency = time_predictions(text_cat, values)
+
+    # Compress the model and compare
+    compress_text_categorizer(text_cat)
+    text_cat.save(output_filename)
+    new_size = text_cat.get_model_size()
+    print("Measure\tOriginal\tCompressed\tChange")
+    print("Size (bytes)\t{o}\t{n}\t{c}".format(o=old_size, n=new_size, c=(new_size - old_size)))
+    print("Disk (bytes)\t{o}\t{n}\t{c}".format(o=system.get_file_size(model_filename),
+                                               n=system.get_file_size(output_filename),
+                                               c=(system.get_file_size(output_filename)
+                                                  - system.get_file_size(model_filename))))
+    if testing_filename:
+        new_accuracy = text_cat.test(testing_filename)
+        new_latency = time_predictions(text_cat, values)
+        print("Accuracy\t{o}\t{n}\t{c}".format(o=system.round_num(old_accuracy, 4),
+                                               n=system.round_num(new_accuracy, 4),
+                                               c=system.round_num(new_accuracy - old_accuracy, 4)))
+        print("Latency (ms/doc)\t{o}\t{n}\t{c}".format(o=system.round_num(old_latency, 4),
+                                                       n=system.round_num(new_latency, 4),
+                                                       c=system.round_num(new_latency - old_latency, 4)))
+    return
+
+
+if __name__ == '__main__':
+    # note: the classifier class must be pickled as model_compression's rather than __main__'s
+    import model_compression
+    model_compression.main(sys.argv)
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+#
+# Parallel version of Scikit-Learn's CountVectorizer, which shards the documents
+# over a pool of worker processes (i.e., map-reduce style featurization):
+# - map: each worker tokenizes its shard, producing a local vocabulary and counts;
+# - reduce: the local vocabularies are merged into a sorted global one, with the
+#   counts remapped into a single CSR matrix.
+# The result is the same as with CountVectorizer.fit_transform, so the TF/IDF
+# transformer and classifier in the pipeline can use it as is.
+#
+# Notes:
+# - Only the default document-frequency settings are handled in parallel (e.g., no
+#   max_df or max_features); otherwise, this falls back to the inherited version.
+# - When run as a script, this benchmarks the speedup by number of workers.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Parallel featurization via CountVectorizer"""
+
+# Standard packages
+import multiprocessing
+import sys
+import time
+
+# Installed packages
+import numpy
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+# Local packages
+import debug
+import system
+
+FEATURE_WORKERS = system.getenv_int("FEATURE_WORKERS", 1)
+SHARDS_PER_WORKER = system.getenv_int("SHARDS_PER_WORKER", 4)
+
+
+def count_shard(args):
+    """Worker function returning local vocabulary and CSR components for the shard in ARGS (vectorizer, documents)"""
+    (vectorizer, documents) = args
+    analyze = vectorizer.build_analyzer()
+    vocabulary = {}
+    indices = []
+    values = []
+    indptr = [0]
+    for document in documents:
+        counts = {}
+        for feature in analyze(document):
+            index = vocabulary.setdefault(feature, len(vocabulary))
+            counts[index] = counts.get(index, 0) + 1
+        indices.extend(counts.keys())
+        values.extend(counts.values())
+        indptr.append(len(indices))
+    return (vocabulary,
+            numpy.array(indices, dtype=numpy.int64),
+            numpy.array(values, dtype=numpy.int64),
+            numpy.array(indptr, dtype=numpy.int64))
+
+
+def merge_shards(shards, dtype):
+    """Merge SHARDS from count_shard into (vocabulary, CSR matrix) with features sorted as in CountVectorizer"""
+    terms = set()
+    for (vocabulary, _indices, _values, _indptr) in shards:
+        terms.update(vocabulary.keys())
+    vocabulary = dict((term, i) for (i, term) in enumerate(sorted(terms)))
+    all_indices = []
+    all_values = []
+    all_indptr = [numpy.zeros(1, dtype=numpy.int64)]
+    offset = 0
+    for (shard_vocabulary, indices, values, indptr) in shards:
+        # Map local feature indices into global ones
+        index_map = numpy.zeros(len(shard_vocabulary), dtype=numpy.int64)
+        for (term, local_index) in shard_vocabulary.items():
+            index_map[local_index] = vocabulary[term]
+        all_indices.append(index_map[indices] if len(indices) else indices)
+        all_values.append(values)
+        all_indptr.append(indptr[1:] + offset)
+        offset += len(indices)
+    indptr = numpy.concatenate(all_indptr)
+    matrix = sparse.csr_matrix((numpy.concatenate(all_values), numpy.concatenate(all_indices), indptr),
+                               shape=((len(indptr) - 1), len(vocabulary)), dtype=dtype)
+    matrix.sort_indices()
+    return (vocabulary, matrix)
+
+
+class ParallelCountVectorizer(CountVectorizer):
+    """CountVectorizer with fitting done in parallel over document shards"""
+    # Note: other constructor parameters are handled by the base class (e.g., via set_params)
+
+    def __init__(self, num_workers=FEATURE_WORKERS, **kwargs):
+        """Class constructor: NUM_WORKERS processes are used for fitting (with KWARGS for CountVectorizer)"""
+        debug.trace_fmtd(5, "ParallelCountVectorizer.__init__({n}, {kw})", n=num_workers, kw=kwargs)
+        super(ParallelCountVectorizer, self).__init__(**kwargs)
+        self.num_workers = num_workers
+        return
+
+    def get_params(self, deep=True):
+        """Return parameters for CountVectorizer along with num_workers"""
+        params = CountVectorizer().get_params(deep)
+        params = dict((k, getattr(self, k)) for k in params)
+        params["num_workers"] = self.num_workers
+        return params
+
+    def supports_parallel_fit(self):
+        """Whether the parameters allow for fitting in parallel"""
+        return ((self.num_workers > 1) and (self.vocabulary is None)
+                and (self.max_df in [1.0, None]) and (self.min_df in [1, None])
+                and (self.max_features is None))
+
+    def fit(self, raw_documents, y=None):
+        """Learn vocabulary from RAW_DOCUMENTS"""
+        self.fit_transform(raw_documents)
+        return self
+
+    def fit_transform(self, raw_documents, y=None):
+        """Learn vocabulary from RAW_DOCUMENTS and return document-term matrix"""
+        if not self.supports_parallel_fit():
+            debug.trace_fmtd(4, "Using serial fit_transform")
+            return super(ParallelCountVectorizer, self).fit_transform(raw_documents, y)
+        documents = list(raw_documents)
+        num_shards = max(1, min(len(documents), (self.num_workers * SHARDS_PER_WORKER)))
+        shard_size = (len(documents) + num_shards - 1) // num_shards
+        shards = [documents[i:(i + shard_size)] for i in range(0, len(documents), shard_size)]
+        debug.trace_fmtd(4, "Counting {n} documents in {s} shards using {w} workers",
+                         n=len(documents), s=len(shards), w=self.num_workers)
+        pool = multiprocessing.Pool(self.num_workers)
+        try:
+            results = pool.map(count_shard, [(self, shard) for shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+        (self.vocabulary_, matrix) = merge_shards(results, self.dtype)
+        if not self.vocabulary_:
+            raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+        if self.binary:
+            matrix.data.fill(1)
+        self.fixed_vocabulary_ = False
+        # note: as with CountVectorizer, these are the terms dropped via max_df, min_df or
+        # max_features, so none of the merged shard terms (see supports_parallel_fit)
+        self.stop_words_ = set()
+        return matrix
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing: benchmark over tabular file"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} training-file [max-workers]".format(p=args[0]))
+        system.print_stderr("Note: benchmarks featurization time by number of worker processes")
+        return
+    # note: imported here to avoid circularity (e.g., text_categorizer uses this module)
+    from text_categorizer import read_categorization_data
+    (_labels, values) = read_categorization_data(args[1])
+    max_workers = int(args[2]) if (len(args) > 2) else multiprocessing.cpu_count()
+
+    start = time.time()
+    expected = CountVectorizer().fit_transform(values)
+    base_time = time.time() - start
+    print("Workers\tSeconds\tSpeedup\tSame")
+    print("serial\t{t}\t1.0\tTrue".format(t=system.round_num(base_time, 3)))
+    num_workers = 2
+    while (num_workers <= max_workers):
+        vectorizer = ParallelCountVectorizer(num_workers=num_workers)
+        start = time.time()
+        matrix = vectorizer.fit_transform(values)
+        elapsed = time.time() - start
+        same = ((matrix.shape == expected.shape) and ((matrix != expected).nnz == 0))
+        print("{n}\t{t}\t{s}\t{ok}".format(n=num_workers, t=system.round_num(elapsed, 3),
+                                           s=system.round_num(base_time / max(elapsed, 1e-6), 2),
+                                           ok=same))
+        num_workers *= 2
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+#
+# Load tester that replays requests captured by the text categorizer server (see
+# CAPTURE_LOG in text_categorizer.py) against a locally started server. The requests are
+# sent at the recorded times (optionally sped up by REPLAY_SPEED) or at a fixed open-loop
+# rate (REPLAY_RATE), using a pool of threads for the concurrent connections.
+#
+# The latency is measured from the scheduled send time rather than the actual send time,
+# so delays due to a backlog of requests are included (i.e., open-loop measurement).
+#
+# Usage:
+#    CAPTURE_LOG=capture.jsonl text_categorizer.py model.pkl
+#    REPLAY_SPEED=10 replay_traffic.py capture.jsonl http://localhost:9440
+#
+# Notes:
+# - Only local servers are allowed (e.g., localhost or 127.0.0.1).
+# - For entries captured with hashes rather than raw text, text of the same length is
+#   synthesized from REPLAY_TEXT_FILE (categorization data) or from filler words.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Replay captured traffic against local categorizer server"""
+
+# Standard packages
+import json
+import sys
+import threading
+import time
+if sys.version_info.major < 3:
+    from Queue import Queue
+    from urllib import urlencode
+    from urllib2 import urlopen
+    from urlparse import urlparse
+else:
+    from queue import Queue
+    from urllib.parse import urlencode, urlparse
+    from urllib.request import urlopen
+
+# Installed packages
+import numpy
+
+# Local packages
+import debug
+import system
+
+SERVER_PORT = system.getenv_integer("SERVER_PORT", 9440)
+REPLAY_SPEED = system.getenv_float("REPLAY_SPEED", 1.0)
+REPLAY_RATE = system.getenv_float("REPLAY_RATE", 0.0)
+REPLAY_THREADS = system.getenv_int("REPLAY_THREADS", 32)
+REPLAY_TIMEOUT = system.getenv_float("REPLAY_TIMEOUT", 30.0)
+REPLAY_LIMIT = system.getenv_int("REPLAY_LIMIT", 0)
+REPLAY_TEXT_FILE = system.getenv_text("REPLAY_TEXT_FILE", "")
+LOCAL_HOSTS = ["localhost", "127.0.0.1", "::1"]
+FILLER_TEXT = "the quick brown fox jumps over the lazy dog "
+
+
+def read_capture_log(filename, limit=REPLAY_LIMIT):
+    """Return list of entries (dicts) from capture log FILENAME, up to LIMIT if positive"""
+    entries = []
+    with open(filename) as f:
+        for (i, line) in enumerate(f):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                debug.trace_fmtd(2, "Warning: Ignoring bad entry at line {n}", n=(i + 1))
+            if (limit > 0) and (len(entries) >= limit):
+                break
+    return entries
+
+
+def make_text(length, source_text):
+    """Return text of LENGTH characters taken from SOURCE_TEXT (repeated as needed)"""
+    if not source_text:
+        source_text = FILLER_TEXT
+    repeats = 1 + (length // len(source_text))
+    return (source_text * repeats)[:length]
+
+
+def get_schedule(entries, speed=REPLAY_SPEED, rate=REPLAY_RATE):
+    """Return list of send offsets in seconds for ENTRIES, either at RATE per second (if positive)
+    or at the recorded times divided by SPEED"""
+    if (rate > 0):
+        return [(i / rate) for i in range(len(entries))]
+    start = entries[0]["time"] if entries else 0
+    return [((entry["time"] - start) / speed) for entry in entries]
+
+
+class TrafficReplayer(object):
+    """Sends requests from capture log entries to server at BASE_URL and collects the latencies"""
+
+    def __init__(self, base_url, num_threads=REPLAY_THREADS, timeout=REPLAY_TIMEOUT):
+        """Class constructor: uses NUM_THREADS connections with TIMEOUT seconds per request"""
+        debug.trace_fmtd(5, "TrafficReplayer.__init__({u}, {n}, {t})", u=base_url, n=num_threads, t=timeout)
+        host = urlparse(base_url).hostname
+        if host not in LOCAL_HOSTS:
+            raise ValueError("Only local servers can be used for replay: {h}".format(h=host))
+        self.base_url = base_url.rstrip("/")
+        self.num_threads = num_threads
+        self.timeout = timeout
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        # note: list of (route, latency in seconds, success)
+        self.results = []
+        return
+
+    def send_requests(self):
+        """Worker thread: sends queued (scheduled time, route, text) requests until None received"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (scheduled_time, route, text) = item
+            url = self.base_url + "/" + route + "?" + urlencode({"text": system.to_utf8(text)})
+            success = True
+            try:
+                response = urlopen(url, timeout=self.timeout)
+                response.read()
+                response.close()
+            except:
+                debug.trace_fmtd(4, "Request error: {exc}", exc=sys.exc_info())
+                success = False
+            latency = time.time() - scheduled_time
+            with self.lock:
+                self.results.append((route, latency, success))
+        return
+
+    def replay(self, entries, texts):
+        """Send requests for ENTRIES with TEXTS per schedule, returning elapsed seconds"""
+        workers = [threading.Thread(target=self.send_requests) for _i in range(self.num_threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        start = time.time()
+        for (entry, text, offset) in zip(entries, texts, get_schedule(entries)):
+            delay = (start + offset) - time.time()
+            if (delay > 0):
+                time.sleep(delay)
+            self.queue.put(((start + offset), entry.get("route", "categorize"), text))
+        for _worker in workers:
+            self.queue.put(None)
+        for worker in workers:
+            worker.join()
+        return (time.time() - start)
+
+    def report(self, elapsed, stream=sys.stdout):
+        """Output summary of the results to STREAM given ELAPSED seconds for replay"""
+        num_requests = len(self.results)
+        num_errors = sum(1 for (_route, _latency, success) in self.results if not success)
+        stream.write("Requests: {n}\n".format(n=num_requests))
+        stream.write("Errors: {e} ({p}%)\n".format(e=num_errors,
+                                                  p=system.round_num(100.0 * num_errors / max(1, num_requests), 2)))
+        stream.write("Elapsed: {t} seconds\n".format(t=system.round_num(elapsed, 3)))
+        stream.write("Throughput: {r} requests/second\n".format(r=system.round_num(num_requests / max(elapsed, 1e-6), 1)))
+        stream.write("\nRoute\tRequests\tP50 (msec)\tP90 (msec)\tP99 (msec)\tMax (msec)\n")
+        routes = sorted(set(route for (route, _latency, _success) in self.results))
+        for route in (routes + ["all"]):
+            latencies = [(1000.0 * latency) for (r, latency, _success) in self.results
+                         if (route in ["all", r])]
+            if not latencies:
+                continue
+            (p50, p90, p99) = numpy.percentile(latencies, [50, 90, 99])
+            stream.write("{r}\t{n}\t{p50}\t{p90}\t{p99}\t{m}\n".format(
+                r=route, n=len(latencies), p50=system.round_num(p50, 3), p90=system.round_num(p90, 3),
+                p99=system.round_num(p99, 3), m=system.round_num(max(latencies), 3)))
+        return
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} capture-log [server-url]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- The server URL defaults to http://localhost:{p} (must be local).".format(p=SERVER_PORT))
+        system.print_stderr("- REPLAY_SPEED scales the recorded timing (e.g., 10 for 10x).")
+        system.print_stderr("- REPLAY_RATE gives fixed requests per second instead (open-loop).")
+        system.print_stderr("- REPLAY_THREADS gives number of concurrent connections ({n} by default).".
+                            format(n=REPLAY_THREADS))
+        return
+    base_url = args[2] if (len(args) > 2) else "http://localhost:{p}".format(p=SERVER_PORT)
+    entries = read_capture_log(args[1])
+    source_text = None
+    if REPLAY_TEXT_FILE:
+        # note: categorization data has label<TAB>text
+        source_text = " ".join(line.split("\t", 1)[-1].strip()
+                               for line in system.read_entire_file(REPLAY_TEXT_FILE).split("\n"))
+    texts = [(entry["text"] if ("text" in entry) else make_text(entry.get("length", 0), source_text))
+             for entry in entries]
+    replayer = TrafficReplayer(base_url)
+    elapsed = replayer.replay(entries, texts)
+    replayer.report(elapsed)
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+#
+# Samples tabular categorization data (i.e., label<TAB>text) in a single pass to
+# produce balanced training sets, as in the README's recipe of taking a random
+# sample of articles for each category. There are two modes, which can be combined:
+# - fixed cap: per-category reservoir sampling keeps up to N articles per category;
+# - proportional: each article is kept with a given probability (e.g., 0.1), so
+#   category proportions are preserved.
+#
+# Notes:
+# - The output is in the original order of the input.
+# - Memory usage is bounded by the number of categories times the cap (and is
+#   constant for just proportional sampling, which writes the output directly).
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Per-category reservoir sampling of categorization data"""
+
+# Standard packages
+import random
+import sys
+from collections import defaultdict
+
+# Local packages
+import debug
+import system
+
+SAMPLE_MAX_PER_CATEGORY = system.getenv_int("SAMPLE_MAX_PER_CATEGORY", 0)
+SAMPLE_RATE = system.getenv_float("SAMPLE_RATE", 1.0)
+SAMPLE_SEED = system.getenv_int("SAMPLE_SEED", 13)
+
+
+def sample_categorization_data(input_filename, output_filename, max_per_category=SAMPLE_MAX_PER_CATEGORY,
+                               rate=SAMPLE_RATE, seed=SAMPLE_SEED):
+    """Write sample of INPUT_FILENAME to OUTPUT_FILENAME, keeping each article with probability RATE and
+    at most MAX_PER_CATEGORY per category (if positive). Returns hash from label to (num_seen, num_kept)."""
+    debug.trace_fmtd(4, "sample_categorization_data({i}, {o}, m={m}, r={r})",
+                     i=input_filename, o=output_filename, m=max_per_category, r=rate)
+    rand = random.Random(seed)
+    num_seen = defaultdict(int)
+    num_candidates = defaultdict(int)
+    reservoirs = defaultdict(list)
+    num_kept = defaultdict(int)
+    with open(input_filename) as input_file, open(output_filename, "w") as output_file:
+        for (i, line) in enumerate(input_file):
+            items = system.from_utf8(line).split("\t")
+            if len(items) != 2:
+                debug.trace_fmtd(4, "Warning: Ignoring item w/ unexpected format at line {num}",
+                                 num=(i + 1))
+                continue
+            label = items[0].lower()
+            num_seen[label] += 1
+            if (rate < 1.0) and (rand.random() >= rate):
+                continue
+            if (max_per_category <= 0):
+                output_file.write(line)
+                num_kept[label] += 1
+                continue
+            # Reservoir sampling (Algorithm R) over the candidates for the category
+            num_candidates[label] += 1
+            reservoir = reservoirs[label]
+            if (len(reservoir) < max_per_category):
+                reservoir.append((i, line))
+            else:
+                pos = rand.randint(0, (num_candidates[label] - 1))
+                if (pos < max_per_category):
+                    reservoir[pos] = (i, line)
+
+        # Output the reservoirs in the original order
+        if (max_per_category > 0):
+            sample = []
+            for (label, reservoir) in reservoirs.items():
+                num_kept[label] = len(reservoir)
+                sample += reservoir
+            for (_i, line) in sorted(sample):
+                output_file.write(line)
+    return dict((label, (num_seen[label], num_kept[label])) for label in num_seen)
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} input-file output-file".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- SAMPLE_MAX_PER_CATEGORY gives the cap per category (0 for none).")
+        system.print_stderr("- SAMPLE_RATE gives the probability of keeping an article (for proportional sampling).")
+        system.print_stderr("- SAMPLE_SEED gives the random seed (for reproducible samples).")
+        return
+    counts = sample_categorization_data(args[1], args[2])
+    print("Category\tSeen\tKept")
+    for label in sorted(counts):
+        print("{l}\t{s}\t{k}".format(l=label, s=counts[label][0], k=counts[label][1]))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,244 @@
+#! /usr/bin/env python
+#
+# Support for categorization data split over many shard files (e.g., from the extraction
+# jobs), given either a manifest file listing the shards or a glob pattern. The shards are
+# read concurrently, each by its own reader thread (see system.read_line_batches), and the
+# batches of lines are merged round-robin into a single stream, so that the shards don't
+# need to be concatenated beforehand. The number of rows and the MD5 checksum are recorded
+# for each shard, and these are checked against the manifest if given there.
+#
+# The manifest has one shard per line, optionally followed by the expected row count and
+# checksum (tab-separated). Relative paths are resolved against the manifest directory.
+# Blank lines and comments starting with # are ignored. For example,
+#    shard-00000.tsv.gz	10000	3f2b5c6d1a...
+#    shard-00001.tsv.gz
+#
+# Usage:
+#    train_text_categorizer.py 'shards/*.tsv.gz' model.pkl
+#    SHARD_REPORT=train.manifest train_text_categorizer.py train.manifest model.pkl
+#    sharded_corpus.py 'shards/*.tsv.gz' > train.manifest
+#
+# Notes:
+# - Up to SHARD_READERS shards are read at a time, with the next shard started as each
+#   finishes. The merged order is deterministic for a given list of shards.
+# - Each reader buffers up to SHARD_READ_AHEAD_BATCHES batches of READ_AHEAD_LINES lines (see
+#   system.py), so up to SHARD_READERS x SHARD_READ_AHEAD_BATCHES x READ_AHEAD_LINES lines overall.
+# - The checksum is over the lines as read (i.e., after decompression).
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Concurrent reading of sharded categorization data"""
+
+# Standard packages
+import glob
+import hashlib
+import os
+import sys
+import threading
+import time
+if sys.version_info.major < 3:
+    from Queue import Queue, Empty
+else:
+    from queue import Queue, Empty
+
+# Local packages
+import debug
+import system
+
+SHARD_READERS = system.getenv_int("SHARD_READERS", 8)
+# note: per-shard queue size, kept lower than READ_AHEAD_BATCHES given the number of readers
+SHARD_READ_AHEAD_BATCHES = system.getenv_int("SHARD_READ_AHEAD_BATCHES", 2)
+# note: if non-empty, the per-shard rows and checksums are written there in manifest format
+SHARD_REPORT = system.getenv_text("SHARD_REPORT", "")
+MANIFEST_EXTENSION = ".manifest"
+GLOB_CHARS = "*?["
+
+
+def is_sharded(filename):
+    """Whether FILENAME refers to a shard manifest or glob pattern rather than a single file"""
+    # EX: is_sharded("shards/*.tsv") => True
+    if filename.endswith(MANIFEST_EXTENSION):
+        return True
+    return (any((c in filename) for c in GLOB_CHARS) and (not os.path.exists(filename)))
+
+
+def get_base_name(spec):
+    """Return filename prefix for output derived from shard SPEC (e.g., for .bad file):
+    the manifest without extension or the part of the glob pattern before the wildcards"""
+    # EX: get_base_name("shards/train-*.tsv") => "shards/train"
+    # EX: get_base_name("data/train.manifest") => "data/train"
+    if spec.endswith(MANIFEST_EXTENSION):
+        return spec[:-len(MANIFEST_EXTENSION)]
+    prefix = spec
+    for c in GLOB_CHARS:
+        prefix = prefix.split(c)[0]
+    return (prefix.rstrip("/-_.") or "shards")
+
+
+class ShardInfo(object):
+    """Row count and checksum for a shard, along with those expected from the manifest (if any)"""
+
+    def __init__(self, filename, expected_rows=None, expected_checksum=None):
+        """Class constructor for shard FILENAME, optionally with EXPECTED_ROWS and EXPECTED_CHECKSUM"""
+        self.filename = filename
+        self.expected_rows = expected_rows
+        self.expected_checksum = expected_checksum
+        self.rows = 0
+        self.checksum = None
+        return
+
+    def check(self):
+        """Warn if the row count or checksum differs from the manifest, returning whether OK"""
+        ok = True
+        if (self.expected_rows is not None) and (self.rows != self.expected_rows):
+            debug.trace_fmtd(1, "Warning: shard {f} has {n} rows but {e} expected",
+                             f=self.filename, n=self.rows, e=self.expected_rows)
+            ok = False
+        if self.expected_checksum and (self.checksum != self.expected_checksum):
+            debug.trace_fmtd(1, "Warning: shard {f} has checksum {c} but {e} expected",
+                             f=self.filename, c=self.checksum, e=self.expected_checksum)
+            ok = False
+        return ok
+
+
+def read_manifest(filename):
+    """Return list of ShardInfo for shards in manifest FILENAME (see above for format)"""
+    debug.trace_fmtd(4, "read_manifest({f})", f=filename)
+    shards = []
+    directory = os.path.dirname(filename)
+    for (i, line) in enumerate(system.iterate_file_lines(filename)):
+        line = system.from_utf8(line).strip()
+        if ((not line) or line.startswith("#")):
+            continue
+        items = line.split("\t")
+        try:
+            expected_rows = int(items[1]) if ((len(items) > 1) and items[1]) else None
+        except ValueError:
+            debug.trace_fmtd(2, "Warning: Ignoring bad row count at line {n} of {f}", n=(i + 1), f=filename)
+            expected_rows = None
+        expected_checksum = items[2] if (len(items) > 2) else None
+        shards.append(ShardInfo(os.path.join(directory, items[0]), expected_rows, expected_checksum))
+    return shards
+
+
+def get_shards(spec):
+    """Return list of ShardInfo for SPEC, either a manifest file or a glob pattern"""
+    if spec.endswith(MANIFEST_EXTENSION):
+        shards = read_manifest(spec)
+    else:
+        shards = [ShardInfo(f) for f in sorted(glob.glob(spec))]
+    if not shards:
+        debug.trace_fmtd(1, "Warning: no shards for {s}", s=spec)
+    return shards
+
+
+class ShardedCorpus(object):
+    """Categorization data over shards given by manifest or glob pattern, read concurrently"""
+
+    def __init__(self, spec, num_readers=SHARD_READERS, report_filename=SHARD_REPORT):
+        """Class constructor: uses up to NUM_READERS reader threads at a time over shards for SPEC,
+        writing per-shard statistics to REPORT_FILENAME (if non-empty) when done"""
+        debug.trace_fmtd(5, "ShardedCorpus.__init__({s}, {n}, {r})", s=spec, n=num_readers, r=report_filename)
+        self.spec = spec
+        self.num_readers = max(1, num_readers)
+        self.report_filename = report_filename
+        self.shards = get_shards(spec)
+        return
+
+    def start_reader(self, shard, stop):
+        """Start reader thread for SHARD (stopping when STOP set), returning (shard, queue, thread, md5)"""
+        debug.trace_fmtd(5, "Starting reader for shard {f}", f=shard.filename)
+        queue = Queue(maxsize=max(1, SHARD_READ_AHEAD_BATCHES))
+        reader = threading.Thread(target=system.read_line_batches, args=(shard.filename, queue, stop))
+        reader.daemon = True
+        reader.start()
+        return (shard, queue, reader, hashlib.md5())
+
+    def get_batch(self, shard, queue, reader):
+        """Return next batch of lines from QUEUE for READER thread over SHARD, or None if done
+        Note: an error in the reader is re-raised as IOError naming the shard, with the reader's traceback"""
+        while True:
+            try:
+                batch = queue.get(timeout=system.QUEUE_WAIT_SECONDS)
+            except Empty:
+                if not reader.is_alive():
+                    return None
+                continue
+            if isinstance(batch, tuple):
+                (exc_type, value, traceback) = batch
+                error = IOError("Problem reading shard {f} after {n} lines: {t}: {v}".format(
+                    f=shard.filename, n=shard.rows, t=exc_type.__name__, v=value))
+                system.reraise((IOError, error, traceback))
+            return batch
+
+    def iterate_lines(self):
+        """Yields tuples (shard_filename, line_number, line) over the shards, with the line numbers relative to each shard"""
+        debug.trace_fmtd(4, "ShardedCorpus.iterate_lines(): {n} shards", n=len(self.shards))
+        start = time.time()
+        stop = threading.Event()
+        pending = list(self.shards)
+        active = []
+        turn = 0
+        try:
+            while (pending or active):
+                while (pending and (len(active) < self.num_readers)):
+                    active.append(self.start_reader(pending.pop(0), stop))
+                (shard, queue, reader, md5) = active[turn]
+                batch = self.get_batch(shard, queue, reader)
+                if batch is None:
+                    shard.checksum = md5.hexdigest()
+                    shard.check()
+                    active.pop(turn)
+                    if (turn >= len(active)):
+                        turn = 0
+                    continue
+                data = "".join(batch)
+                md5.update(data if isinstance(data, bytes) else data.encode("UTF-8"))
+                for line in batch:
+                    shard.rows += 1
+                    yield (shard.filename, shard.rows, line)
+                turn = (turn + 1) % len(active)
+        finally:
+            stop.set()
+        debug.trace_fmtd(3, "Read {n} rows from {s} shards in {t} seconds",
+                         n=sum(s.rows for s in self.shards), s=len(self.shards),
+                         t=system.round_num(time.time() - start, 3))
+        if self.report_filename:
+            with open(self.report_filename, "w") as f:
+                self.write_manifest(f, os.path.dirname(self.report_filename))
+        return
+
+    def write_manifest(self, stream=sys.stdout, directory=""):
+        """Output the shards with their row counts and checksums to STREAM in manifest format,
+        with paths relative to DIRECTORY (i.e., that of the manifest)"""
+        for shard in self.shards:
+            stream.write("{f}\t{n}\t{c}\n".format(f=os.path.relpath(shard.filename, (directory or ".")),
+                                                  n=shard.rows, c=(shard.checksum or "")))
+        return
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing: outputs manifest with rows and checksums"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} manifest-or-glob".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- Quote glob patterns to avoid shell expansion (e.g., 'shards/*.tsv.gz').")
+        system.print_stderr("- The output is a manifest with the row count and checksum for each shard.")
+        system.print_stderr("- SHARD_READERS gives number of shards read at a time ({n} by default).".
+                            format(n=SHARD_READERS))
+        system.print_stderr("- SHARD_READ_AHEAD_BATCHES gives batches buffered per shard ({n} by default).".
+                            format(n=SHARD_READ_AHEAD_BATCHES))
+        return
+    corpus = ShardedCorpus(args[1], report_filename="")
+    for _item in corpus.iterate_lines():
+        pass
+    corpus.write_manifest()
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+#
+# Approximate nearest-neighbor index over the TF/IDF vectors for the training articles,
+# used to find the articles most similar to a given text (e.g., for explaining the
+# categorization). This uses random-projection locality-sensitive hashing (LSH): each of
+# SIMILAR_TABLES hash tables has a SIMILAR_BITS signature given by the signs of random
+# projections, so vectors with high cosine similarity tend to share buckets. The
+# candidates from the matching buckets (at most SIMILAR_MAX_CANDIDATES, for bounded
+# latency) are then ranked by exact cosine similarity.
+#
+# Note: The projections are random +1/-1 weights for each feature, stored as int8 (i.e., one
+# byte per feature and bit). Sparse projections are not used, because most of the
+# projections for short documents would then be zero, which degrades the buckets.
+#
+# The index is built by TextCategorizer.train when SIMILAR_INDEX is set, and it is saved
+# alongside the model (i.e., <model>.similar).
+#
+# When run as a script, this benchmarks the recall and speed against exact search.
+#
+# Usage:
+#    SIMILAR_INDEX=1 train_text_categorizer.py train.tsv model.pkl
+#    similarity_index.py model.pkl test.tsv
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Approximate nearest-neighbor index for similar articles"""
+
+# Standard packages
+import sys
+import time
+
+# Installed packages
+import numpy
+from scipy import sparse
+
+# Local packages
+import debug
+import system
+
+SIMILAR_INDEX = system.getenv_bool("SIMILAR_INDEX", False)
+SIMILAR_BITS = system.getenv_int("SIMILAR_BITS", 8)
+SIMILAR_TABLES = system.getenv_int("SIMILAR_TABLES", 16)
+SIMILAR_MAX_CANDIDATES = system.getenv_int("SIMILAR_MAX_CANDIDATES", 2000)
+SIMILAR_SEED = system.getenv_int("SIMILAR_SEED", 13)
+SIMILAR_K = system.getenv_int("SIMILAR_K", 5)
+SIMILAR_SNIPPET_LEN = system.getenv_int("SIMILAR_SNIPPET_LEN", 200)
+SIMILAR_BENCHMARK_DOCS = system.getenv_int("SIMILAR_BENCHMARK_DOCS", 200)
+PROJECTION_CHUNK_SIZE = 1000
+
+
+class SimilarityIndex(object):
+    """Random-projection LSH index over rows of a TF/IDF matrix, with labels and text snippets for each"""
+
+    def __init__(self, num_bits=SIMILAR_BITS, num_tables=SIMILAR_TABLES, max_candidates=SIMILAR_MAX_CANDIDATES):
+        """Class constructor: uses NUM_TABLES hash tables with NUM_BITS signatures, ranking up to MAX_CANDIDATES"""
+        debug.trace_fmtd(5, "SimilarityIndex.__init__({b}, {t}, {m})", b=num_bits, t=num_tables, m=max_candidates)
+        self.num_bits = num_bits
+        self.num_tables = num_tables
+        self.max_candidates = max_candidates
+        self.signs = None
+        self.matrix = None
+        self.labels = []
+        self.snippets = []
+        # note: per table, sorted bucket keys and the row numbers in the same order
+        self.table_keys = []
+        self.table_rows = []
+        self.powers = (2 ** numpy.arange(num_bits)).astype(numpy.int64)
+        return
+
+    def project(self, matrix):
+        """Return dense random projections for rows of sparse MATRIX"""
+        # note: done in chunks using only the features present, to avoid converting all of signs to float
+        matrix = sparse.csr_matrix(matrix)
+        result = numpy.zeros((matrix.shape[0], self.signs.shape[1]), dtype=numpy.float32)
+        for start in range(0, matrix.shape[0], PROJECTION_CHUNK_SIZE):
+            chunk = matrix[start:(start + PROJECTION_CHUNK_SIZE)]
+            columns = numpy.unique(chunk.indices)
+            result[start:(start + chunk.shape[0])] = chunk[:, columns].dot(
+                self.signs[columns].astype(numpy.float32))
+        return result
+
+    def get_keys(self, matrix):
+        """Return array of bucket keys with shape (rows, tables) for MATRIX"""
+        bits = (self.project(matrix) > 0).reshape(matrix.shape[0], self.num_tables, self.num_bits)
+        return bits.dot(self.powers)
+
+    def build(self, matrix, labels, texts):
+        """Index rows of TF/IDF MATRIX, with LABELS and TEXTS for the rows"""
+        debug.trace_fmtd(4, "SimilarityIndex.build(): shape={s}", s=matrix.shape)
+        random = numpy.random.RandomState(SIMILAR_SEED)
+        self.signs = ((2 * random.randint(0, 2, size=(matrix.shape[1], (self.num_bits * self.num_tables))))
+                      - 1).astype(numpy.int8)
+        # note: rows normalized so that dot product is cosine (as with TfidfTransformer default)
+        norms = numpy.sqrt(numpy.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        self.matrix = sparse.csr_matrix(sparse.diags(1.0 / numpy.maximum(norms, 1e-12)).dot(matrix),
+                                        dtype=numpy.float32)
+        self.labels = list(labels)
+        self.snippets = [text[:SIMILAR_SNIPPET_LEN].strip() for text in texts]
+        keys = self.get_keys(matrix)
+        self.table_keys = []
+        self.table_rows = []
+        for table in range(self.num_tables):
+            order = numpy.argsort(keys[:, table], kind="mergesort")
+            self.table_keys.append(keys[order, table])
+            self.table_rows.append(order.astype(numpy.int32))
+        return
+
+    def get_candidates(self, keys, min_candidates):
+        """Return array of candidate rows for query with bucket KEYS (one per table)
+        Note: buckets differing by one bit are also checked if fewer than MIN_CANDIDATES, and at most
+        max_candidates are returned"""
+        def lookup(table, key):
+            """Return rows for KEY in TABLE"""
+            start = numpy.searchsorted(self.table_keys[table], key, side="left")
+            end = numpy.searchsorted(self.table_keys[table], key, side="right")
+            return self.table_rows[table][start:end]
+
+        matches = [lookup(t, keys[t]) for t in range(self.num_tables)]
+        if (len(numpy.unique(numpy.concatenate(matches))) < min_candidates):
+            matches += [lookup(t, (keys[t] ^ power)) for t in range(self.num_tables) for power in self.powers]
+        # note: if too many, those found in the most buckets are used
+        (candidates, counts) = numpy.unique(numpy.concatenate(matches), return_counts=True)
+        if (len(candidates) > self.max_candidates):
+            candidates = candidates[numpy.argsort(-counts, kind="mergesort")[:self.max_candidates]]
+        return candidates
+
+    def query(self, vector, k=SIMILAR_K):
+        """Return list of (row, cosine) for the approximate top K rows for 1-row TF/IDF VECTOR"""
+        candidates = self.get_candidates(self.get_keys(vector)[0], k)
+        if not len(candidates):
+            return []
+        scores = numpy.asarray(self.matrix[candidates].dot(vector.T).todense()).ravel()
+        top = numpy.argsort(-scores)[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def exact_query(self, vector, k=SIMILAR_K):
+        """Version of query using brute-force search over all rows (e.g., for benchmarking)"""
+        scores = numpy.asarray(self.matrix.dot(vector.T).todense()).ravel()
+        top = numpy.argsort(-scores)[:k]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, filename):
+        """Save index to FILENAME"""
+        system.save_object(filename, self)
+        return
+
+
+def load_similarity_index(filename):
+    """Return SimilarityIndex saved in FILENAME"""
+    return system.load_object(filename)
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing: benchmark against exact search"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 3):
+        system.print_stderr("Usage: {p} model-file testing-file".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- The model must have been trained with SIMILAR_INDEX set.")
+        system.print_stderr("- SIMILAR_BENCHMARK_DOCS gives the number of test documents used.")
+        return
+    # note: imported here to avoid circularity
+    from text_categorizer import TextCategorizer, read_categorization_data
+    text_cat = TextCategorizer()
+    text_cat.load(args[1])
+    if not text_cat.similar_index:
+        system.print_stderr("Error: no similarity index for model {m}".format(m=args[1]))
+        return
+    index = text_cat.similar_index
+    (_labels, values) = read_categorization_data(args[2])
+    values = values[:SIMILAR_BENCHMARK_DOCS]
+    k = SIMILAR_K
+    (overlap, approx_seconds, exact_seconds) = (0, 0.0, 0.0)
+    (approx_total, exact_total) = (0.0, 0.0)
+    for value in values:
+        vector = text_cat.get_features([value])
+        start = time.time()
+        approx = index.query(vector, k)
+        approx_seconds += (time.time() - start)
+        start = time.time()
+        exact = index.exact_query(vector, k)
+        exact_seconds += (time.time() - start)
+        overlap += len(set(r for (r, _s) in approx) & set(r for (r, _s) in exact))
+        approx_total += sum(score for (_r, score) in approx)
+        exact_total += sum(score for (_r, score) in exact)
+    num_docs = max(1, len(values))
+    print("Documents: {n}; indexed: {m}".format(n=len(values), m=index.matrix.shape[0]))
+    print("Recall@{k}: {r}".format(k=k, r=system.round_num(float(overlap) / (k * num_docs), 4)))
+    # note: ratio of average cosine for approximate vs. exact neighbors (i.e., near ties can lower recall)
+    print("Score ratio: {r}".format(r=system.round_num(approx_total / max(exact_total, 1e-12), 4)))
+    print("Approximate: {t} ms/query".format(t=system.round_num(1000.0 * approx_seconds / num_docs, 3)))
+    print("Exact: {t} ms/query".format(t=system.round_num(1000.0 * exact_seconds / num_docs, 3)))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+#
+# Splits tabular categorization data (i.e., label<TAB>text) into training, development
+# and test files in a single pass with constant memory. Each row is assigned based on a
+# stable hash of its key (the text by default), so the assignments don't depend on the
+# order or on the other rows. In particular, re-running over an appended corpus keeps
+# the prior assignments, so that cached features and evaluations remain valid.
+#
+# Notes:
+# - With stratification, the hash positions are compared against per-label thresholds,
+#   chosen so that each label is divided per the ratios. This requires an extra pass to
+#   get the positions for each label (i.e., memory proportional to the number of rows).
+#   The assignments still don't depend on the order, but the split is no longer fully
+#   append-stable: new data shifts the thresholds, so rows near them can change splits.
+# - The key field shouldn't be the label (i.e., field 0), because then all rows for a
+#   label would be assigned to the same split.
+# - A different split can be produced by changing SPLIT_SALT.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Deterministic streaming train/dev/test splitter"""
+
+# Standard packages
+import hashlib
+import sys
+from collections import defaultdict
+
+# Local packages
+import debug
+import system
+
+SPLIT_NAMES = ["train", "dev", "test"]
+SPLIT_RATIOS = system.getenv_text("SPLIT_RATIOS", "0.8,0.1,0.1")
+SPLIT_KEY_FIELD = system.getenv_int("SPLIT_KEY_FIELD", -1)
+SPLIT_STRATIFY = system.getenv_bool("SPLIT_STRATIFY", False)
+SPLIT_SALT = system.getenv_text("SPLIT_SALT", "")
+
+
+def parse_ratios(ratios_spec):
+    """Return list of ratios for train/dev/test from comma-separated RATIOS_SPEC, normalized to sum to 1
+    Note: raises ValueError unless the ratios are non-negative with a positive sum"""
+    # EX: parse_ratios("8,1,1") => [0.8, 0.1, 0.1]
+    ratios = [system.to_float(r) for r in ratios_spec.split(",")]
+    ratios += [0.0] * (len(SPLIT_NAMES) - len(ratios))
+    ratios = ratios[:len(SPLIT_NAMES)]
+    total = sum(ratios)
+    if (any((r < 0) for r in ratios) or (total <= 0)):
+        raise ValueError("Ratios must be non-negative with a positive sum: {s}".format(s=ratios_spec))
+    return [(r / total) for r in ratios]
+
+
+def hash_position(key, salt=SPLIT_SALT):
+    """Return stable position in [0, 1) for KEY, based on MD5 hash (with optional SALT)"""
+    digest = hashlib.md5((salt + key).encode("UTF-8")).hexdigest()
+    return (int(digest[:15], 16) / float(16 ** 15))
+
+
+def get_split(position, bounds, default):
+    """Return index of first split with upper bound in BOUNDS above POSITION, or DEFAULT if none"""
+    for (split, bound) in enumerate(bounds):
+        if (position < bound):
+            return split
+    return default
+
+
+def get_label_bounds(input_filename, cumulative, key_field=SPLIT_KEY_FIELD):
+    """Return dict from label to upper bounds for the hash positions of each split (see hash_position),
+    with CUMULATIVE giving the cumulative ratios for the splits"""
+    positions = defaultdict(list)
+    for line in system.iterate_file_lines(input_filename):
+        items = system.from_utf8(line).rstrip("\n").split("\t")
+        if len(items) >= 2:
+            positions[items[0].lower()].append(hash_position(items[key_field]))
+    label_bounds = {}
+    for (label, label_positions) in positions.items():
+        label_positions.sort()
+        num_rows = len(label_positions)
+        # note: the first round(ratio * num_rows) positions go to the split (cumulatively)
+        ends = [int(round(c * num_rows)) for c in cumulative]
+        label_bounds[label] = [(label_positions[end] if (end < num_rows) else float("inf")) for end in ends]
+    debug.trace_fmtd(5, "label_bounds={b}", b=label_bounds)
+    return label_bounds
+
+
+def split_categorization_data(input_filename, output_prefix, ratios, key_field=SPLIT_KEY_FIELD,
+                              stratify=SPLIT_STRATIFY):
+    """Split INPUT_FILENAME into OUTPUT_PREFIX.train, .dev and .test per RATIOS, using hash of KEY_FIELD or optionally with STRATIFY by label. Returns list of counts per split."""
+    debug.trace_fmtd(4, "split_categorization_data({i}, {o}, {r}, k={k}, s={s})",
+                     i=input_filename, o=output_prefix, r=ratios, k=key_field, s=stratify)
+    cumulative = [sum(ratios[:(i + 1)]) for i in range(len(ratios))]
+    # note: used if the position is above the last bound due to rounding
+    last_split = max(s for s in range(len(ratios)) if (ratios[s] > 0))
+    label_bounds = get_label_bounds(input_filename, cumulative, key_field) if stratify else None
+    # Note: the output files are all written concurrently (e.g., omitting splits with no data)
+    output_files = [(open(output_prefix + "." + name, "w") if (ratios[i] > 0) else None)
+                    for (i, name) in enumerate(SPLIT_NAMES)]
+    counts = [0] * len(SPLIT_NAMES)
+    try:
+        for (i, line) in enumerate(system.iterate_file_lines(input_filename)):
+            items = system.from_utf8(line).rstrip("\n").split("\t")
+            if len(items) < 2:
+                debug.trace_fmtd(4, "Warning: Ignoring item w/ unexpected format at line {num}",
+                                 num=(i + 1))
+                continue
+            bounds = label_bounds[items[0].lower()] if stratify else cumulative
+            split = get_split(hash_position(items[key_field]), bounds, last_split)
+            output_files[split].write(line)
+            counts[split] += 1
+    finally:
+        for output_file in output_files:
+            if output_file:
+                output_file.close()
+    debug.trace_fmtd(3, "split counts: {c}", c=counts)
+    return counts
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    problem = None
+    try:
+        ratios = parse_ratios(SPLIT_RATIOS)
+    except ValueError:
+        problem = "SPLIT_RATIOS must be non-negative with a positive sum: {r}".format(r=SPLIT_RATIOS)
+    if (SPLIT_KEY_FIELD == 0):
+        problem = "SPLIT_KEY_FIELD can't be 0, which is the label (i.e., each label would go to one split)"
+    if ((len(args) < 2) or problem):
+        if problem:
+            system.print_stderr("Error: " + problem)
+        system.print_stderr("Usage: {p} input-file [output-prefix]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- Output goes to prefix.train, prefix.dev and prefix.test (prefix defaults to input file).")
+        system.print_stderr("- SPLIT_RATIOS gives comma-separated ratios for train, dev and test ({r} by default).".
+                            format(r=SPLIT_RATIOS))
+        system.print_stderr("- SPLIT_KEY_FIELD gives the column hashed for the assignment (-1 by default for the text;")
+        system.print_stderr("  e.g., 2 for an article ID added after the text). Field 0 is the label, so it isn't allowed.")
+        system.print_stderr("- SPLIT_STRATIFY balances splits by label (via per-label hash thresholds).")
+        system.print_stderr("  This makes an extra pass with memory proportional to the number of rows, and")
+        system.print_stderr("  it isn't fully append-stable (i.e., new data can move rows near the thresholds).")
+        if problem:
+            sys.exit(1)
+        return
+    output_prefix = args[2] if (len(args) > 2) else args[1]
+    counts = split_categorization_data(args[1], output_prefix, ratios)
+    for (i, name) in enumerate(SPLIT_NAMES):
+        print("{n}\t{c}".format(n=name, c=counts[i]))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)
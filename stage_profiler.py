@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+#
+# Timing and memory instrumentation for the stages of text categorizer runs (e.g., reading
+# the data, UTF-8 decoding, vectorization, TF/IDF, classifier fitting, and reporting). For
+# each stage, the elapsed time, the number of documents and tokens processed, and the peak
+# memory allocated are recorded, with repeated uses of a stage accumulated (e.g., per chunk).
+#
+# Usage:
+#    PROFILE_STAGES=1 PROFILE_STAGE=train.clf train_text_categorizer.py train.tsv model.pkl test.tsv
+#
+#    from stage_profiler import profiler
+#    with profiler.stage("train.read") as stats:
+#        (labels, values) = read_categorization_data(filename)
+#        stats.num_docs += len(values)
+#
+# Notes:
+# - The memory is tracked via tracemalloc, which slows things down, so the profiling is
+#   only enabled via PROFILE_STAGES. (Under Python 2, the memory is not reported.)
+# - For the stage given by PROFILE_STAGE, cProfile output is dumped to PROFILE_OUTPUT
+#   (by default, <stage>.prof), which can be viewed via pstats.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Per-stage timing and profiling"""
+
+# Standard packages
+from contextlib import contextmanager
+import cProfile
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Local packages
+import debug
+import system
+
+PROFILE_STAGES = system.getenv_bool("PROFILE_STAGES", False)
+PROFILE_STAGE = system.getenv_text("PROFILE_STAGE", "")
+PROFILE_OUTPUT = system.getenv_text("PROFILE_OUTPUT", "")
+
+
+class StageStats(object):
+    """Accumulated statistics for a stage"""
+
+    def __init__(self, name):
+        """Class constructor for stage NAME"""
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.num_docs = 0
+        self.num_tokens = 0
+        self.peak_bytes = None
+        return
+
+
+class StageProfiler(object):
+    """Records time, documents, tokens and peak memory for named stages"""
+
+    def __init__(self, enabled=PROFILE_STAGES, profile_stage=PROFILE_STAGE, profile_output=PROFILE_OUTPUT):
+        """Class constructor: records stages if ENABLED, running cProfile for PROFILE_STAGE with output to PROFILE_OUTPUT"""
+        debug.trace_fmtd(5, "StageProfiler.__init__({e}, {s}, {o})", e=enabled, s=profile_stage, o=profile_output)
+        self.enabled = enabled
+        self.profile_stage = profile_stage
+        self.profile_output = (profile_output or (profile_stage + ".prof"))
+        self.stats = {}
+        self.order = []
+        # note: stack of [start_bytes, max_bytes] for the active stages (for nesting)
+        self.memory_stack = []
+        self.cprofile = None
+        if (self.enabled and tracemalloc and (not tracemalloc.is_tracing())):
+            tracemalloc.start()
+        return
+
+    def get_stats(self, name):
+        """Return StageStats for NAME, creating if needed"""
+        if name not in self.stats:
+            self.stats[name] = StageStats(name)
+            self.order.append(name)
+        return self.stats[name]
+
+    def update_peaks(self):
+        """Fold peak memory since last check into the active stages"""
+        if not tracemalloc:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self.memory_stack:
+            entry[1] = max(entry[1], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        return
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager for timing stage NAME, yielding StageStats for updating counts (e.g., num_docs)"""
+        if not self.enabled:
+            yield StageStats(name)
+            return
+        stats = self.get_stats(name)
+        self.update_peaks()
+        if tracemalloc:
+            current = tracemalloc.get_traced_memory()[0]
+            self.memory_stack.append([current, current])
+        profile = None
+        if ((name == self.profile_stage) and (not self.cprofile)):
+            profile = self.cprofile = cProfile.Profile()
+            profile.enable()
+        start = time.time()
+        try:
+            yield stats
+        finally:
+            stats.seconds += (time.time() - start)
+            stats.calls += 1
+            if profile:
+                profile.disable()
+                self.cprofile = None
+                profile.dump_stats(self.profile_output)
+                debug.trace_fmtd(3, "Profile for {s} written to {f}", s=name, f=self.profile_output)
+            if tracemalloc:
+                self.update_peaks()
+                (start_bytes, max_bytes) = self.memory_stack.pop()
+                stats.peak_bytes = max((stats.peak_bytes or 0), (max_bytes - start_bytes))
+        return
+
+    def iterate_stage(self, name, items, get_count=None):
+        """Return iterator over ITEMS with time to produce each counted for stage NAME.
+        Note: GET_COUNT gives number of documents for each item (e.g., len for chunks)"""
+        if not self.enabled:
+            return iter(items)
+        return self.generate_stage_items(name, items, get_count)
+
+    def generate_stage_items(self, name, items, get_count):
+        """Generator for iterate_stage"""
+        iterator = iter(items)
+        done = object()
+        while True:
+            with self.stage(name) as stats:
+                item = next(iterator, done)
+                if (item is not done):
+                    stats.num_docs += (get_count(item) if get_count else 1)
+            if (item is done):
+                break
+            yield item
+        return
+
+    def add_time(self, name, seconds, num_docs=0):
+        """Add SECONDS and NUM_DOCS to stage NAME without separate tracking (e.g., per-line decoding)"""
+        if self.enabled:
+            stats = self.get_stats(name)
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.num_docs += num_docs
+        return
+
+    def report(self, stream=sys.stderr):
+        """Output summary table for the stages to STREAM"""
+        if not self.enabled:
+            return
+        stream.write("Stage\tCalls\tSeconds\tDocs\tTokens\tPeak MB\n")
+        for name in self.order:
+            stats = self.stats[name]
+            peak = "n/a" if (stats.peak_bytes is None) else system.round_num(stats.peak_bytes / (1024.0 * 1024), 3)
+            stream.write("{n}\t{c}\t{s}\t{d}\t{t}\t{p}\n".format(
+                n=name, c=stats.calls, s=system.round_num(stats.seconds, 3),
+                d=stats.num_docs, t=stats.num_tokens, p=peak))
+        return
+
+
+# Profiler shared by the text categorizer modules
+profiler = StageProfiler()
@@ -17,13 +17,25 @@
 from __future__ import print_function
 
 # Standard packages
+import bz2
+import gzip
 import inspect
+import io
 import os
 import pickle
 import re
 import sys
+import threading
 import types
 import urllib
+if sys.version_info.major < 3:
+    from Queue import Queue, Empty, Full
+else:
+    from queue import Queue, Empty, Full
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 # Local packages
 import debug
@@ -193,11 +205,129 @@ def escape_html_text(text):
     return result
 
 
+# Support for compressed input files (e.g., training data)
+# note: The decompression for iterate_file_lines is done in a background thread, which
+# reads ahead up to READ_AHEAD_BATCHES batches of READ_AHEAD_LINES lines.
+COMPRESSION_EXTENSIONS = ["gz", "bz2", "xz"]
+COMPRESSION_MAGIC = [(b"\x1f\x8b", "gz"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "xz")]
+READ_AHEAD_LINES = getenv_int("READ_AHEAD_LINES", 1000)
+READ_AHEAD_BATCHES = getenv_int("READ_AHEAD_BATCHES", 16)
+QUEUE_WAIT_SECONDS = 0.1
+
+
+def get_compression(filename):
+    """Return compression type for FILENAME (gz, bz2 or xz) based on extension or magic bytes, or None if uncompressed"""
+    # EX: get_compression("train.tsv.gz") => "gz"
+    for extension in COMPRESSION_EXTENSIONS:
+        if filename.endswith("." + extension):
+            return extension
+    try:
+        with open(filename, "rb") as f:
+            header = f.read(6)
+    except IOError:
+        return None
+    for (magic, compression) in COMPRESSION_MAGIC:
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def open_file(filename):
+    """Open FILENAME for reading text, decompressing if needed (see get_compression)"""
+    compression = get_compression(filename)
+    debug.trace_fmtd(6, "open_file({f}): compression={c}", f=filename, c=compression)
+    if compression is None:
+        return open(filename)
+    if (compression == "gz"):
+        f = gzip.open(filename, "rb")
+    elif (compression == "bz2"):
+        f = bz2.BZ2File(filename, "rb")
+    elif lzma:
+        f = lzma.open(filename, "rb")
+    else:
+        raise IOError("The lzma module is needed for reading {f}".format(f=filename))
+    # note: lines are bytes under Python 2 as with open, but they need decoding under Python 3
+    if (sys.version_info.major > 2):
+        f = io.TextIOWrapper(f, encoding="UTF-8", errors="ignore")
+    return f
+
+
+def read_line_batches(filename, queue, stop):
+    """Thread function putting batches of lines from FILENAME into QUEUE until done or STOP set.
+    Note: None is put when done, or the exception info if an error occurs."""
+    def put(item):
+        """Put ITEM into queue, returning False if stopped while waiting"""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=QUEUE_WAIT_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+
+    try:
+        with open_file(filename) as f:
+            batch = []
+            for line in f:
+                batch.append(line)
+                if (len(batch) >= READ_AHEAD_LINES):
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and (not put(batch)):
+                return
+        put(None)
+    except:
+        put(sys.exc_info())
+    return
+
+
+def reraise(exc_info):
+    """Raise the exception in EXC_INFO (from sys.exc_info, e.g. in another thread) with its traceback"""
+    (_exc_type, value, traceback) = exc_info
+    if (sys.version_info.major < 3):
+        # note: exec used since the three-argument raise is a syntax error under Python 3
+        exec("raise _exc_type, value, traceback")
+    raise value.with_traceback(traceback)
+
+
+def iterate_file_lines(filename):
+    """Yields lines from FILENAME, decompressing in a background thread if compressed (so that it overlaps with processing)"""
+    if get_compression(filename) is None:
+        with open(filename) as f:
+            for line in f:
+                yield line
+        return
+    queue = Queue(maxsize=READ_AHEAD_BATCHES)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_line_batches, args=(filename, queue, stop))
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            try:
+                batch = queue.get(timeout=QUEUE_WAIT_SECONDS)
+            except Empty:
+                if not reader.is_alive():
+                    break
+                continue
+            if batch is None:
+                break
+            if isinstance(batch, tuple):
+                # note: re-raise exception from the reader thread
+                reraise(batch)
+            for line in batch:
+                yield line
+    finally:
+        stop.set()
+    return
+
+
 def read_entire_file(filename):
-    """Read all of FILENAME and return as a string"""
+    """Read all of FILENAME and return as a string (decompressing if needed)"""
     data = ""
     try:
-        with open(filename) as f:
+        with open_file(filename) as f:
             data = from_utf8(f.read())
     except IOError:
         debug.trace_fmtd(1, "Error: Unable to read file '{f}': {exc}",
@@ -210,12 +340,11 @@ def read_lookup_table(filename):
     """Reads FILENAME and returns as hash lookup"""
     hash_table = {}
     try:
-        with open(filename) as f:
-            for line in f:
-                line = from_utf8(line)
-                # TODO: trap exception and lowercase key
-                (key, value) = line.split("\t", 1)
-                hash_table[key] = value
+        for line in iterate_file_lines(filename):
+            line = from_utf8(line)
+            # TODO: trap exception and lowercase key
+            (key, value) = line.split("\t", 1)
+            hash_table[key] = value
             ## BAD: hash_table = from_utf8(f.read())
     except (IOError, ValueError):
         debug.trace_fmtd(1, "Error: Creating lookup from '{f}': {exc}",
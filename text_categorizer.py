@@ -14,30 +14,112 @@
 """Text categorization support"""
 
 # Standard packages
+import base64
+import codecs
+import copy
+from contextlib import contextmanager
+import hashlib
+import itertools
 import json
+import mimetypes
+import multiprocessing
 import os
 import re
 import sys
+import threading
+import time
 from collections import defaultdict
 
 # Installed packages
 import cherrypy
 import numpy
+from scipy import sparse
+from sklearn.cluster import KMeans
 from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.base import BaseEstimator, ClassifierMixin
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.linear_model import SGDClassifier
 from sklearn.svm import SVC
 from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import normalize
 from sklearn import metrics
 
 # Local packages
 import debug
 import system
+from parallel_vectorizer import FEATURE_WORKERS, ParallelCountVectorizer
+from sharded_corpus import ShardedCorpus, get_base_name, is_sharded
+from similarity_index import SIMILAR_INDEX, SIMILAR_K, SimilarityIndex, load_similarity_index
+from stage_profiler import profiler
 
 SERVER_PORT = system.getenv_integer("SERVER_PORT", 9440)
 OUTPUT_BAD = system.getenv_bool("OUTPUT_BAD", False)
 CONTEXT_LEN = system.getenv_int("CONTEXT_LEN", 512)
 VERBOSE = system.getenv_bool("VERBOSE", False)
+TEST_CHUNK_SIZE = system.getenv_int("TEST_CHUNK_SIZE", 10000)
+# note: format of per-instance export based on extension (.jsonl for JSON lines or TSV otherwise)
+PREDICTION_EXPORT = system.getenv_text("PREDICTION_EXPORT", "")
+EXPORT_TOP_K = system.getenv_int("EXPORT_TOP_K", 3)
+
+# Options for micro-batching of concurrent requests in the web server
+# note: The window is an upper bound (in seconds); the actual wait adapts to the load.
+MICRO_BATCH = system.getenv_bool("MICRO_BATCH", False)
+MICRO_BATCH_WINDOW = system.getenv_float("MICRO_BATCH_WINDOW", 0.005)
+MICRO_BATCH_MAX = system.getenv_int("MICRO_BATCH_MAX", 32)
+
+# Options for categorization of streamed documents (e.g., POST body)
+# note: The token budget is applied either to the start of the document (head) or
+# to a random sample of token windows (sample), so memory use is bounded.
+STREAM_CHUNK_SIZE = system.getenv_int("STREAM_CHUNK_SIZE", 65536)
+STREAM_MAX_BYTES = system.getenv_int("STREAM_MAX_BYTES", 64 * 1024 * 1024)
+STREAM_MAX_TOKENS = system.getenv_int("STREAM_MAX_TOKENS", 50000)
+STREAM_SAMPLING = system.getenv_text("STREAM_SAMPLING", "head")
+STREAM_WINDOW_TOKENS = system.getenv_int("STREAM_WINDOW_TOKENS", 1000)
+STREAM_AGGREGATE = system.getenv_bool("STREAM_AGGREGATE", False)
+STREAM_SEED = system.getenv_int("STREAM_SEED", 13)
+
+# Options for online updates from labeled feedback (i.e., via partial_fit for SGD and NB)
+# note: Each update is only used for categorization if accuracy over the held-out file
+# doesn't drop more than ONLINE_MAX_ACCURACY_DROP; the model in use is saved periodically
+# to the checkpoint file (by default, <model>.online).
+ONLINE_LEARNING = system.getenv_bool("ONLINE_LEARNING", False)
+ONLINE_BATCH_SIZE = system.getenv_int("ONLINE_BATCH_SIZE", 50)
+ONLINE_MAX_BUFFER = system.getenv_int("ONLINE_MAX_BUFFER", 10000)
+ONLINE_UPDATE_INTERVAL = system.getenv_float("ONLINE_UPDATE_INTERVAL", 30.0)
+ONLINE_CHECKPOINT_INTERVAL = system.getenv_float("ONLINE_CHECKPOINT_INTERVAL", 600.0)
+ONLINE_CHECKPOINT_FILE = system.getenv_text("ONLINE_CHECKPOINT_FILE", "")
+ONLINE_HOLDOUT_FILE = system.getenv_text("ONLINE_HOLDOUT_FILE", "")
+ONLINE_MAX_ACCURACY_DROP = system.getenv_float("ONLINE_MAX_ACCURACY_DROP", 0.01)
+
+# Options for in-memory cache of the category images (i.e., /static files)
+# note: Images no larger than INLINE_IMAGE_MAX bytes are returned by get_category_image as
+# data URIs, avoiding the separate image request (0 disables).
+IMAGE_CACHE = system.getenv_bool("IMAGE_CACHE", True)
+STATIC_DIR = system.getenv_text("STATIC_DIR", "static")
+IMAGE_MAX_AGE = system.getenv_int("IMAGE_MAX_AGE", 86400)
+INLINE_IMAGE_MAX = system.getenv_int("INLINE_IMAGE_MAX", 0)
+
+# Options for capturing requests to the web server (e.g., for replay_traffic.py)
+# note: The log has JSON lines with time, route, and text length, along with either the
+# text itself or a hash of it (unless CAPTURE_RAW_TEXT).
+CAPTURE_LOG = system.getenv_text("CAPTURE_LOG", "")
+CAPTURE_RAW_TEXT = system.getenv_bool("CAPTURE_RAW_TEXT", False)
+
+# Options for admission control in the web server (i.e., load shedding under bursts)
+# note: At most ADMISSION_MAX_CONCURRENT requests are processed at once, with up to
+# ADMISSION_MAX_QUEUE waiting for at most ADMISSION_DEADLINE seconds; otherwise, the
+# request gets a 503 status with Retry-After. When the queue is over the degraded fraction,
+# input text is truncated to DEGRADED_MAX_CHARS. The server thread pool is enlarged to hold
+# the queued requests, leaving ADMISSION_SPARE_THREADS for quick rejections.
+ADMISSION_CONTROL = system.getenv_bool("ADMISSION_CONTROL", False)
+ADMISSION_MAX_CONCURRENT = system.getenv_int("ADMISSION_MAX_CONCURRENT", 4)
+ADMISSION_MAX_QUEUE = system.getenv_int("ADMISSION_MAX_QUEUE", 32)
+ADMISSION_DEADLINE = system.getenv_float("ADMISSION_DEADLINE", 2.0)
+ADMISSION_RETRY_AFTER = system.getenv_int("ADMISSION_RETRY_AFTER", 1)
+ADMISSION_SPARE_THREADS = system.getenv_int("ADMISSION_SPARE_THREADS", 8)
+DEGRADED_QUEUE_FRACTION = system.getenv_float("DEGRADED_QUEUE_FRACTION", 0.5)
+DEGRADED_MAX_CHARS = system.getenv_int("DEGRADED_MAX_CHARS", 0)
+SERVER_THREADS = system.getenv_int("SERVER_THREADS", 10)
 
 # Options for Support Vector Machines (SVM)
 #
@@ -65,6 +147,33 @@ SGD_MAX_ITER = system.getenv_int("SGD_MAX_ITER", 5)
 SGD_TOLERANCE = system.getenv_float("SGD_TOLERANCE", None)
 SGD_VERBOSE = system.getenv_bool("SGD_VERBOSE", False)
 
+# Options for cascade of cheap and expensive classifiers (e.g., NB then SVM)
+# note: The cheap classifier's prediction is used unless its margin (i.e., difference of the
+# top two class scores) is below the threshold. A negative threshold indicates that it is
+# calibrated over a held-out fraction of the training data, choosing the lowest escalation
+# rate with accuracy within CASCADE_MAX_ACCURACY_LOSS of the best.
+USE_CASCADE = system.getenv_bool("USE_CASCADE", False)
+CASCADE_CHEAP = system.getenv_text("CASCADE_CHEAP", "nb")
+CASCADE_EXPENSIVE = system.getenv_text("CASCADE_EXPENSIVE", "svm")
+CASCADE_THRESHOLD = system.getenv_float("CASCADE_THRESHOLD", -1.0)
+CASCADE_CALIBRATION_FRACTION = system.getenv_float("CASCADE_CALIBRATION_FRACTION", 0.2)
+CASCADE_MAX_ACCURACY_LOSS = system.getenv_float("CASCADE_MAX_ACCURACY_LOSS", 0.005)
+CASCADE_SEED = system.getenv_int("CASCADE_SEED", 13)
+
+# Options for hierarchical categorization (i.e., top-level model picks group of categories)
+# note: The groups are from HIERARCHY_GROUPS file with category<TAB>group entries if given
+# (with unlisted categories in their own group), and otherwise by clustering the category
+# centroids into HIERARCHY_NUM_GROUPS groups (0 for square root of number of categories).
+# The group models are saved separately (<model>.group<N>) and loaded when first needed.
+USE_HIERARCHY = system.getenv_bool("USE_HIERARCHY", False)
+HIERARCHY_GROUPS = system.getenv_text("HIERARCHY_GROUPS", "")
+HIERARCHY_NUM_GROUPS = system.getenv_int("HIERARCHY_NUM_GROUPS", 0)
+HIERARCHY_TOP_CLASSIFIER = system.getenv_text("HIERARCHY_TOP_CLASSIFIER", "nb")
+HIERARCHY_GROUP_CLASSIFIER = system.getenv_text("HIERARCHY_GROUP_CLASSIFIER", "nb")
+HIERARCHY_WORKERS = system.getenv_int("HIERARCHY_WORKERS", multiprocessing.cpu_count())
+HIERARCHY_SEED = system.getenv_int("HIERARCHY_SEED", 13)
+LOW_SCORE = -1e6
+
 
 def sklearn_report(actual, predicted, labels, stream=sys.stdout):
     """Print classification analysis report for ACTUAL vs. PREDICTED indices with original LABELS and using STREAM"""
@@ -90,27 +199,407 @@ def create_tabular_file(filename, data):
     return
 
 
+def iterate_categorization_data(filename):
+    """Yields tuples (line_number, label, value) from table with (non-unique) label and tab-separated value.
+    Note: label made lowercase; FILENAME can also be a shard manifest or glob pattern (see sharded_corpus.py)"""
+    debug.trace_fmtd(4, "iterate_categorization_data({f})", f=filename)
+    if is_sharded(filename):
+        lines = ShardedCorpus(filename).iterate_lines()
+    else:
+        lines = ((filename, (i + 1), line) for (i, line) in enumerate(system.iterate_file_lines(filename)))
+    for (source, line_num, line) in lines:
+        if profiler.enabled:
+            start = time.time()
+            line = system.from_utf8(line)
+            profiler.add_time("read.decode", (time.time() - start), 1)
+        else:
+            line = system.from_utf8(line)
+        items = line.split("\t")
+        if len(items) == 2:
+            yield (line_num, items[0].lower(), items[1])
+        else:
+            debug.trace_fmtd(4, "Warning: Ignoring item w/ unexpected format at line {num} of {f}",
+                             num=line_num, f=source)
+    return
+
+
 def read_categorization_data(filename):
     """Reads table with (non-unique) label and tab-separated value. 
     Note: label made lowercase; result returned as tuple (labels, values)"""
     debug.trace_fmtd(4, "read_categorization_data({f})", f=filename)
     labels = []
     values = []
-    with open(filename) as f:
-        for (i, line) in enumerate(f):
-            line = system.from_utf8(line)
-            items = line.split("\t")
-            if len(items) == 2:
-                labels.append(items[0].lower())
-                values.append(items[1])
-            else:
-                debug.trace_fmtd(4, "Warning: Ignoring item w/ unexpected format at line {num}",
-                                 num=(i + 1))
+    for (_line_num, label, value) in iterate_categorization_data(filename):
+        labels.append(label)
+        values.append(value)
     ## OLD: debug.trace_fmtd(7, "table={t}", t=table)
     debug.trace_values(7, zip(labels, values), "table")
     return (labels, values)
 
 
+def iterate_chunks(items, chunk_size):
+    """Yields lists with up to CHUNK_SIZE elements from ITEMS iterator"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if (len(chunk) >= chunk_size):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    return
+
+
+def create_vectorizer():
+    """Return CountVectorizer for pipeline, using parallel fitting if FEATURE_WORKERS above 1"""
+    if (FEATURE_WORKERS > 1):
+        return ParallelCountVectorizer(num_workers=FEATURE_WORKERS)
+    return CountVectorizer()
+
+
+def create_classifier(kind):
+    """Return unfitted classifier of given KIND (nb, svm, or sgd) using the SVM_xyz or SGD_xyz options"""
+    if (kind == "svm"):
+        return SVC(kernel=SVM_KERNEL,
+                   C=SVM_PENALTY,
+                   max_iter=SVM_MAX_ITER,
+                   verbose=SVM_VERBOSE)
+    if (kind == "sgd"):
+        return SGDClassifier(loss=SGD_LOSS,
+                             penalty=SGD_PENALTY,
+                             alpha=SGD_ALPHA,
+                             random_state=SGD_SEED,
+                             ## TODO: max_iter=SGD_MAX_ITER,
+                             n_iter=SGD_MAX_ITER,
+                             ## tol=SGD_TOLERANCE
+                             verbose=SGD_VERBOSE)
+    if (kind == "nb"):
+        return MultinomialNB()
+    if (kind == "cascade"):
+        return CascadeClassifier(cheap=CASCADE_CHEAP, expensive=CASCADE_EXPENSIVE)
+    if (kind == "hierarchy"):
+        return HierarchicalClassifier(top=HIERARCHY_TOP_CLASSIFIER, group=HIERARCHY_GROUP_CLASSIFIER)
+    raise ValueError("Unknown classifier type: {k}".format(k=kind))
+
+
+def get_object_size(obj):
+    """Return approximate size in bytes of OBJ in memory, including contents of arrays and collections"""
+    # Note: estimators nested in OBJ are not included (see TextCategorizer.get_size_breakdown)
+    if isinstance(obj, numpy.ndarray):
+        size = obj.nbytes
+    elif sparse.issparse(obj):
+        size = sum(get_object_size(getattr(obj, a, None)) for a in ["data", "indices", "indptr", "row", "col"])
+    elif isinstance(obj, dict):
+        size = sys.getsizeof(obj) + sum((get_object_size(k) + get_object_size(v)) for (k, v) in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size = sys.getsizeof(obj) + sum(get_object_size(v) for v in obj)
+    elif obj is None:
+        size = 0
+    else:
+        size = sys.getsizeof(obj)
+    return size
+
+
+def get_class_scores(model, data):
+    """Return matrix of per-class scores from MODEL over DATA (e.g., probabilities or decision values)"""
+    # Note: MODEL can be either the pipeline (with DATA being texts) or the classifier proper (with feature matrix).
+    if hasattr(model, "predict_proba"):
+        scores = model.predict_proba(data)
+    else:
+        scores = model.decision_function(data)
+        if (len(scores.shape) == 1):
+            # Binary case: positive score favors second class
+            scores = numpy.column_stack([-scores, scores])
+    return scores
+
+
+def iterate_stream_tokens(stream, preprocess, tokenize, chunk_size=STREAM_CHUNK_SIZE,
+                          max_bytes=STREAM_MAX_BYTES):
+    """Yield tokens from binary STREAM read incrementally in CHUNK_SIZE pieces (up to MAX_BYTES).
+    Note: PREPROCESS and TOKENIZE are from the vectorizer (e.g., build_preprocessor); tokens
+    split across chunks are handled by carrying over text after the last whitespace."""
+    decoder = codecs.getincrementaldecoder("UTF-8")(errors="ignore")
+    carry = u""
+    num_bytes = 0
+    while (num_bytes < max_bytes):
+        data = stream.read(min(chunk_size, (max_bytes - num_bytes)))
+        if not data:
+            break
+        num_bytes += len(data)
+        text = carry + decoder.decode(data)
+        split_pos = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+        if (split_pos == -1):
+            carry = text
+            continue
+        carry = text[split_pos:]
+        for token in tokenize(preprocess(text[:split_pos])):
+            yield token
+    if (num_bytes >= max_bytes):
+        debug.trace_fmtd(3, "Warning: stream clipped at {n} bytes", n=num_bytes)
+    text = carry + decoder.decode(b"", final=True)
+    for token in tokenize(preprocess(text)):
+        yield token
+    return
+
+
+def get_margins(scores):
+    """Return difference between top two values in each row of SCORES (e.g., from get_class_scores)"""
+    if (scores.shape[1] < 2):
+        return numpy.full(scores.shape[0], numpy.inf)
+    top_two = numpy.sort(scores, axis=1)[:, -2:]
+    return (top_two[:, 1] - top_two[:, 0])
+
+
+class CascadeClassifier(BaseEstimator, ClassifierMixin):
+    """Classifier that escalates from CHEAP classifier to EXPENSIVE one when the cheap margin is below THRESHOLD.
+    Note: the number of predictions and escalations are tracked (e.g., for the server stats)."""
+
+    def __init__(self, cheap=CASCADE_CHEAP, expensive=CASCADE_EXPENSIVE, threshold=CASCADE_THRESHOLD,
+                 calibration_fraction=CASCADE_CALIBRATION_FRACTION):
+        """Class constructor: CHEAP and EXPENSIVE are classifier types for create_classifier (e.g., nb and svm)"""
+        debug.trace_fmtd(5, "CascadeClassifier.__init__({c}, {e}, {t})", c=cheap, e=expensive, t=threshold)
+        self.cheap = cheap
+        self.expensive = expensive
+        self.threshold = threshold
+        self.calibration_fraction = calibration_fraction
+        self.lock = threading.Lock()
+        self.num_predicted = 0
+        self.num_escalated = 0
+        return
+
+    def __getstate__(self):
+        """Return state for pickling (n.b., excluding lock and counts)"""
+        state = self.__dict__.copy()
+        del state["lock"]
+        state["num_predicted"] = state["num_escalated"] = 0
+        return state
+
+    def __setstate__(self, state):
+        """Restore pickled STATE"""
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        return
+
+    def fit(self, X, y):
+        """Train both classifiers over feature matrix X with labels Y, calibrating the threshold if negative"""
+        y = numpy.asarray(y)
+        self.calibration_ = []
+        self.threshold_ = self.threshold
+        if (self.threshold < 0):
+            self.calibrate(X, y)
+        self.cheap_model_ = create_classifier(self.cheap).fit(X, y)
+        self.expensive_model_ = create_classifier(self.expensive).fit(X, y)
+        self.classes_ = self.cheap_model_.classes_
+        return self
+
+    def calibrate(self, X, y):
+        """Set threshold_ using held-out portion of X and Y, recording (threshold, accuracy, escalation rate) in calibration_"""
+        # Note: the classifiers are trained over the remainder, and then retrained over all data by fit
+        random = numpy.random.RandomState(CASCADE_SEED)
+        held_out = (random.random_sample(X.shape[0]) < self.calibration_fraction)
+        if (held_out.all() or (not held_out.any())):
+            debug.trace_fmtd(2, "Warning: not enough data for calibration; escalating all")
+            self.threshold_ = numpy.inf
+            return
+        cheap_model = create_classifier(self.cheap).fit(X[~held_out], y[~held_out])
+        expensive_model = create_classifier(self.expensive).fit(X[~held_out], y[~held_out])
+        margins = get_margins(get_class_scores(cheap_model, X[held_out]))
+        cheap_correct = (cheap_model.predict(X[held_out]) == y[held_out])
+        expensive_correct = (expensive_model.predict(X[held_out]) == y[held_out])
+        candidates = numpy.unique(numpy.concatenate([[0.0, numpy.inf],
+                                                     numpy.percentile(margins, range(5, 100, 5))]))
+        for threshold in candidates:
+            escalate = (margins < threshold)
+            accuracy = numpy.where(escalate, expensive_correct, cheap_correct).mean()
+            self.calibration_.append((threshold, accuracy, escalate.mean()))
+        best_accuracy = max(accuracy for (_t, accuracy, _e) in self.calibration_)
+        self.threshold_ = min((escalation, threshold) for (threshold, accuracy, escalation) in self.calibration_
+                              if (accuracy >= (best_accuracy - CASCADE_MAX_ACCURACY_LOSS)))[1]
+        debug.trace_fmtd(3, "Cascade threshold: {t}", t=self.threshold_)
+        return
+
+    def report_calibration(self, stream=sys.stdout):
+        """Output accuracy vs. escalation rate for the calibration thresholds to STREAM"""
+        stream.write("Threshold\tAccuracy\tEscalation\n")
+        for (threshold, accuracy, escalation) in self.calibration_:
+            stream.write("{t}\t{a}\t{e}{sel}\n".format(t=system.round_num(threshold, 4), a=system.round_num(accuracy, 4),
+                                                       e=system.round_num(escalation, 4),
+                                                       sel=(" *" if (threshold == self.threshold_) else "")))
+        stream.write("Threshold used: {t}\n".format(t=system.round_num(self.threshold_, 4)))
+        return
+
+    def get_escalations(self, X):
+        """Return (cheap scores, boolean escalation mask) for feature matrix X, updating the counts"""
+        scores = get_class_scores(self.cheap_model_, X)
+        escalate = (get_margins(scores) < self.threshold_)
+        with self.lock:
+            self.num_predicted += X.shape[0]
+            self.num_escalated += int(escalate.sum())
+        return (scores, escalate)
+
+    def predict(self, X):
+        """Return predicted classes for feature matrix X"""
+        (scores, escalate) = self.get_escalations(X)
+        predicted = self.classes_[numpy.argmax(scores, axis=1)]
+        if escalate.any():
+            predicted[escalate] = self.expensive_model_.predict(X[escalate])
+        return predicted
+
+    def decision_function(self, X):
+        """Return per-class scores for X, from the expensive classifier for escalated cases
+        Note: the scales differ for the two classifiers, so only comparable within a row"""
+        (scores, escalate) = self.get_escalations(X)
+        scores = numpy.array(scores, dtype=numpy.float64)
+        if escalate.any():
+            scores[escalate] = get_class_scores(self.expensive_model_, X[escalate])
+        return scores
+
+    def get_stats(self):
+        """Return dict with number of predictions, escalations and escalation rate"""
+        with self.lock:
+            return {"predicted": self.num_predicted, "escalated": self.num_escalated,
+                    "escalation_rate": (float(self.num_escalated) / max(1, self.num_predicted)),
+                    "threshold": float(self.threshold_)}
+
+
+def fit_group_classifier(args):
+    """Worker function returning classifier of KIND fitted over X and Y given ARGS (kind, X, y)"""
+    (kind, X, y) = args
+    return create_classifier(kind).fit(X, y)
+
+
+class HierarchicalClassifier(BaseEstimator, ClassifierMixin):
+    """Classifier using TOP classifier to pick group of categories and then per-group classifier for the category.
+    Note: label_names should be set to the category names before fitting if HIERARCHY_GROUPS used."""
+
+    def __init__(self, top=HIERARCHY_TOP_CLASSIFIER, group=HIERARCHY_GROUP_CLASSIFIER,
+                 num_groups=HIERARCHY_NUM_GROUPS, groups_file=HIERARCHY_GROUPS):
+        """Class constructor: TOP and GROUP are classifier types for create_classifier (e.g., nb or sgd)"""
+        debug.trace_fmtd(5, "HierarchicalClassifier.__init__({t}, {g}, {n}, {f})",
+                         t=top, g=group, n=num_groups, f=groups_file)
+        self.top = top
+        self.group = group
+        self.num_groups = num_groups
+        self.groups_file = groups_file
+        self.label_names = None
+        self.model_filename = None
+        self.lock = threading.Lock()
+        return
+
+    def __getstate__(self):
+        """Return state for pickling, excluding the lock and group models (see save_groups)"""
+        state = self.__dict__.copy()
+        del state["lock"]
+        state["group_models_"] = {}
+        return state
+
+    def __setstate__(self, state):
+        """Restore pickled STATE"""
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        return
+
+    def assign_groups(self, X, y):
+        """Return list of group numbers for the classes_ using feature matrix X and labels Y"""
+        if self.groups_file:
+            # note: unlisted categories are put in their own group
+            category_group = {}
+            with open(self.groups_file) as f:
+                for line in f:
+                    items = system.from_utf8(line).strip().split("\t")
+                    if (len(items) == 2):
+                        category_group[items[0].lower()] = items[1]
+            names = [(self.label_names[c] if self.label_names else str(c)) for c in self.classes_]
+            group_names = [category_group.get(name, "_" + name) for name in names]
+            group_index = dict((g, i) for (i, g) in enumerate(sorted(set(group_names))))
+            return [group_index[g] for g in group_names]
+        num_groups = (self.num_groups or int(round(numpy.sqrt(len(self.classes_)))))
+        num_groups = max(1, min(num_groups, len(self.classes_)))
+        # note: the centroids are computed via sparse product of class indicator matrix and X
+        class_index = numpy.searchsorted(self.classes_, y)
+        indicator = sparse.csr_matrix((numpy.ones(len(y)), (class_index, numpy.arange(len(y)))),
+                                      shape=(len(self.classes_), len(y)))
+        centroids = normalize(indicator.dot(X))
+        kmeans = KMeans(n_clusters=num_groups, n_init=10, random_state=HIERARCHY_SEED)
+        return list(kmeans.fit_predict(centroids))
+
+    def fit(self, X, y):
+        """Train top-level and per-group classifiers over feature matrix X with labels Y"""
+        y = numpy.asarray(y)
+        self.classes_ = numpy.unique(y)
+        self.class_group_ = dict(zip(self.classes_, self.assign_groups(X, y)))
+        self.group_classes_ = defaultdict(list)
+        for (c, g) in sorted(self.class_group_.items()):
+            self.group_classes_[g].append(c)
+        self.group_classes_ = dict(self.group_classes_)
+        debug.trace_fmtd(3, "{n} groups for {c} categories", n=len(self.group_classes_), c=len(self.classes_))
+
+        # Train the group models in worker processes, while training the top model here
+        # note: groups with a single category don't need a model
+        groups = [g for g in sorted(self.group_classes_) if (len(self.group_classes_[g]) > 1)]
+        group_args = []
+        for g in groups:
+            rows = numpy.isin(y, self.group_classes_[g])
+            group_args.append((self.group, X[rows], y[rows]))
+        pool = multiprocessing.Pool(HIERARCHY_WORKERS) if ((HIERARCHY_WORKERS > 1) and (len(groups) > 1)) else None
+        try:
+            pending = pool.map_async(fit_group_classifier, group_args) if pool else None
+            group_y = numpy.array([self.class_group_[c] for c in y])
+            self.top_model_ = create_classifier(self.top).fit(X, group_y)
+            group_models = pending.get() if pool else [fit_group_classifier(args) for args in group_args]
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        self.group_models_ = dict(zip(groups, group_models))
+        return self
+
+    def get_group_model(self, group):
+        """Return classifier for GROUP, loading from the group file if needed (or None if single category)"""
+        if (len(self.group_classes_[group]) == 1):
+            return None
+        with self.lock:
+            if group not in self.group_models_:
+                filename = "{f}.group{g}".format(f=self.model_filename, g=group)
+                debug.trace_fmtd(4, "Loading group model from {f}", f=filename)
+                self.group_models_[group] = system.load_object(filename)
+            return self.group_models_[group]
+
+    def save_groups(self, filename):
+        """Save the group models to files based on FILENAME (i.e., FILENAME.group<N>)"""
+        for group in sorted(self.group_classes_):
+            model = self.get_group_model(group)
+            if model is not None:
+                system.save_object("{f}.group{g}".format(f=filename, g=group), model)
+        return
+
+    def predict(self, X):
+        """Return predicted classes for feature matrix X"""
+        groups = self.top_model_.predict(X)
+        predicted = numpy.zeros(X.shape[0], dtype=self.classes_.dtype)
+        for group in numpy.unique(groups):
+            rows = (groups == group)
+            model = self.get_group_model(group)
+            predicted[rows] = (model.predict(X[rows]) if model else self.group_classes_[group][0])
+        return predicted
+
+    def decision_function(self, X):
+        """Return per-class scores for X, with scores from the group model for the categories in the predicted group.
+        Note: other categories get LOW_SCORE, and single-category groups get 1"""
+        groups = self.top_model_.predict(X)
+        scores = numpy.full((X.shape[0], len(self.classes_)), LOW_SCORE)
+        class_index = dict((c, i) for (i, c) in enumerate(self.classes_))
+        for group in numpy.unique(groups):
+            rows = numpy.where(groups == group)[0]
+            model = self.get_group_model(group)
+            if model is None:
+                scores[rows, class_index[self.group_classes_[group][0]]] = 1.0
+                continue
+            columns = [class_index[c] for c in model.classes_]
+            scores[numpy.ix_(rows, columns)] = get_class_scores(model, X[rows])
+        return scores
+
+
 class TextCategorizer(object):
     """Class for building text categorization"""
     # TODO: add cross-fold validation support; make TF/IDF weighting optional
@@ -123,62 +612,133 @@ class TextCategorizer(object):
         debug.trace_fmtd(4, "tc.__init__(); self=={s}", s=self)
         self.keys = []
         self.classifier = None
-        if USE_SVM:
-            self.cat_pipeline = Pipeline(
-                [('vect', CountVectorizer()),
-                 ('tfidf', TfidfTransformer()),
-                 ('clf', SVC(kernel=SVM_KERNEL,
-                             C=SVM_PENALTY,
-                             max_iter=SVM_MAX_ITER,
-                             verbose=SVM_VERBOSE))])
-        if USE_SGD:
-            self.cat_pipeline = Pipeline(
-                [('vect', CountVectorizer()),
-                 ('tfidf', TfidfTransformer()),
-                 ('clf', SGDClassifier(loss=SGD_LOSS,
-                                       penalty=SGD_PENALTY,
-                                       alpha=SGD_ALPHA,
-                                       random_state=SGD_SEED,
-                                       ## TODO: max_iter=SGD_MAX_ITER,
-                                       n_iter=SGD_MAX_ITER,
-                                       ## tol=SGD_TOLERANCE
-                                       verbose=SGD_VERBOSE))])
-
+        self.load_seconds = None
+        self.similar_index = None
+        if (FEATURE_WORKERS > 1) or USE_SVM or USE_SGD or USE_CASCADE or USE_HIERARCHY:
+            kind = ("hierarchy" if USE_HIERARCHY else "cascade" if USE_CASCADE else "sgd" if USE_SGD
+                    else "svm" if USE_SVM else "nb")
+            # note: SGD takes precedence over SVM as originally (i.e., the SGD setup came last)
+            if (USE_SVM and USE_SGD):
+                debug.trace_fmtd(1, "Warning: both USE_SVM and USE_SGD set, so using SGD")
+            self.cat_pipeline = Pipeline([('vect', create_vectorizer()),
+                                          ('tfidf', TfidfTransformer()),
+                                          ('clf', create_classifier(kind))])
         return
 
     def train(self, filename):
         """Train classifier using tabular FILENAME with label and text"""
         debug.trace_fmtd(4, "tc.train({f})", f=filename)
-        (labels, values) = read_categorization_data(filename)
+        with profiler.stage("train.read") as stats:
+            (labels, values) = read_categorization_data(filename)
+            stats.num_docs += len(values)
         self.keys = sorted(numpy.unique(labels))
         label_indices = [self.keys.index(l) for l in labels]
-        self.classifier = self.cat_pipeline.fit(values, label_indices)
+        classifier = self.cat_pipeline.steps[-1][1]
+        if isinstance(classifier, HierarchicalClassifier):
+            classifier.label_names = self.keys
+        # note: same as pipeline fit, but with the features retained for the similarity index
+        if profiler.enabled:
+            (self.classifier, features) = self.fit_stages(values, label_indices)
+        else:
+            features = Pipeline(self.cat_pipeline.steps[:-1]).fit_transform(values, label_indices)
+            self.cat_pipeline.steps[-1][1].fit(features, label_indices)
+            self.classifier = self.cat_pipeline
         debug.trace_object(7, self.classifier, "classifier")
+        if SIMILAR_INDEX:
+            with profiler.stage("train.similar"):
+                self.similar_index = SimilarityIndex()
+                self.similar_index.build(features, labels, values)
         return
 
+    def fit_stages(self, values, label_indices):
+        """Version of pipeline fit over VALUES and LABEL_INDICES with each step timed separately (see stage_profiler.py).
+        Returns tuple with the pipeline and the features (i.e., input to the classifier)."""
+        data = values
+        for (name, step) in self.cat_pipeline.steps[:-1]:
+            with profiler.stage("train." + name) as stats:
+                data = step.fit_transform(data, label_indices)
+                stats.num_docs += data.shape[0]
+                if isinstance(step, CountVectorizer):
+                    stats.num_tokens += int(data.sum())
+        (name, classifier) = self.cat_pipeline.steps[-1]
+        with profiler.stage("train." + name) as stats:
+            classifier.fit(data, label_indices)
+            stats.num_docs += data.shape[0]
+        return (self.cat_pipeline, data)
+
+    def predict_stages(self, values, with_scores=False):
+        """Version of classifier predict over VALUES with each step timed separately, returning tuple
+        (predicted, scores). The per-class scores are only computed if WITH_SCORES, in which case the
+        predictions are taken from them (i.e., so that the two are consistent)."""
+        data = values
+        for (name, step) in self.classifier.steps[:-1]:
+            with profiler.stage("test." + name) as stats:
+                data = step.transform(data)
+                stats.num_docs += data.shape[0]
+                if isinstance(step, CountVectorizer):
+                    stats.num_tokens += int(data.sum())
+        (name, classifier) = self.classifier.steps[-1]
+        scores = None
+        with profiler.stage("test." + name) as stats:
+            if with_scores:
+                scores = get_class_scores(classifier, data)
+                predicted = classifier.classes_[numpy.argmax(scores, axis=1)]
+            else:
+                predicted = classifier.predict(data)
+            stats.num_docs += data.shape[0]
+        return (predicted, scores)
+
     def test(self, filename, report=False, stream=sys.stdout):
         """Test classifier over tabular data from FILENAME with label and text, returning accuracy. Optionally, a detailed performance REPORT is output to STREAM."""
+        # Note: The data is processed in chunks of TEST_CHUNK_SIZE, with the bad instances and
+        # per-instance predictions (see PREDICTION_EXPORT) written as each chunk is done.
         debug.trace_fmtd(4, "tc.test({f})", f=filename)
-        ## OLD: (labels, values) = read_categorization_data(filename)
-        (all_labels, all_values) = read_categorization_data(filename)
-
-        ## BAD: actual_indices = [self.keys.index(l) for l in labels]
-        # TODO: use hash of positions
+        key_index = dict((key, i) for (i, key) in enumerate(self.keys))
         actual_indices = []
-        values = []
-        labels = []
-        for (i, label) in enumerate(all_labels):
-            if label in self.keys:
-                values.append(all_values[i])
-                actual_indices.append(self.keys.index(label))
-                labels.append(label)
-            else:
-                debug.trace_fmtd(4, "Ignoring test label {l} not in training data (line {n})",
-                                 l=label, n=(i + 1))
-        predicted_indices = self.classifier.predict(values)
-        ## TODO: predicted_labels = [self.keys[i] for i in predicted_indices]
+        predicted_indices = []
+        bad_file = None
+        export_file = None
+        try:
+            if OUTPUT_BAD:
+                # note: for shards, the name is based on the manifest or glob pattern (e.g., shards/train.bad)
+                base_name = get_base_name(filename) if is_sharded(filename) else filename
+                bad_file = open(base_name + ".bad", "w")
+                bad_file.write("Actual\tBad\tText\n")
+            if PREDICTION_EXPORT:
+                export_file = open(PREDICTION_EXPORT, "w")
+                if not PREDICTION_EXPORT.endswith(".jsonl"):
+                    export_file.write("Actual\tPredict\tMargin\tScores\tText\n")
+            chunks = iterate_chunks(iterate_categorization_data(filename), TEST_CHUNK_SIZE)
+            for chunk in profiler.iterate_stage("test.read", chunks, get_count=len):
+                values = []
+                chunk_actual = []
+                for (line_num, label, value) in chunk:
+                    if label in key_index:
+                        values.append(value)
+                        chunk_actual.append(key_index[label])
+                    else:
+                        debug.trace_fmtd(4, "Ignoring test label {l} not in training data (line {n})",
+                                         l=label, n=line_num)
+                if not values:
+                    continue
+                # note: the scores for the export are computed along with the predictions (i.e., over the same features)
+                if (profiler.enabled or export_file):
+                    (chunk_predicted, chunk_scores) = self.predict_stages(values, with_scores=bool(export_file))
+                else:
+                    chunk_predicted = self.classifier.predict(values)
+                if bad_file:
+                    self.write_bad_instances(bad_file, chunk_actual, chunk_predicted, values)
+                if export_file:
+                    self.export_predictions(export_file, chunk_actual, chunk_predicted, values, chunk_scores)
+                actual_indices += chunk_actual
+                predicted_indices += list(chunk_predicted)
+        finally:
+            if bad_file:
+                bad_file.close()
+            if export_file:
+                export_file.close()
         num_ok = sum([(actual_indices[i] == predicted_indices[i]) for i in range(len(actual_indices))])
-        accuracy = float(num_ok) / len(values)
+        accuracy = float(num_ok) / len(actual_indices)
         if report:
             if VERBOSE:
                 stream.write("\n")
@@ -191,22 +751,52 @@ class TextCategorizer(object):
             ## BAD: sklearn_report(actual_indices, predicted_indices, self.keys, stream)
             ## OLD: keys = sorted(numpy.unique(labels))
             keys = self.keys
-            sklearn_report(actual_indices, predicted_indices, keys, stream)
-        if OUTPUT_BAD:
-            bad_instances = "Actual\tBad\tText\n"
-            # TODO: for (i, actual_index) in enumerate(actual_indices)
-            for i in range(len(actual_indices)):
-                if (actual_indices[i] != predicted_indices[i]):
-                    text = values[i]
-                    context = (text[:CONTEXT_LEN] + "...\n") if (len(text) > CONTEXT_LEN) else text
-                    # TODO: why is pylint flagging the format string as invalid?
-                    bad_instances += u"{g}\t{b}\t{t}".format(
-                        g=self.keys[actual_indices[i]],
-                        b=self.keys[predicted_indices[i]],
-                        t=context)
-            system.write_file(filename + ".bad", bad_instances)
+            with profiler.stage("test.report"):
+                sklearn_report(actual_indices, predicted_indices, keys, stream)
         return accuracy
 
+    def write_bad_instances(self, bad_file, actual_indices, predicted_indices, values):
+        """Write misclassified instances to BAD_FILE given ACTUAL_INDICES, PREDICTED_INDICES and text VALUES"""
+        for (i, actual_index) in enumerate(actual_indices):
+            if (actual_index != predicted_indices[i]):
+                text = values[i]
+                context = (text[:CONTEXT_LEN] + "...\n") if (len(text) > CONTEXT_LEN) else text
+                if not context.endswith("\n"):
+                    context += "\n"
+                bad_file.write(system.to_utf8(u"{g}\t{b}\t{t}".format(
+                    g=self.keys[actual_index],
+                    b=self.keys[predicted_indices[i]],
+                    t=context)))
+        return
+
+    def export_predictions(self, export_file, actual_indices, predicted_indices, values, scores):
+        """Write predictions for text VALUES to EXPORT_FILE as JSONL or TSV, along with ACTUAL_INDICES, top SCORES and margins"""
+        # Note: scores are probabilities for NB and decision values otherwise (see get_class_scores)
+        classes = self.classifier.steps[-1][1].classes_
+        top_k = max(1, min(EXPORT_TOP_K, scores.shape[1]))
+        for (i, text) in enumerate(values):
+            order = numpy.argsort(-scores[i])
+            margin = (scores[i][order[0]] - scores[i][order[1]]) if (len(order) > 1) else 0.0
+            top_scores = [(self.keys[classes[j]], system.round_num(float(scores[i][j])))
+                          for j in order[:top_k]]
+            context = text[:CONTEXT_LEN].rstrip("\n")
+            if (len(text) > CONTEXT_LEN):
+                context += "..."
+            if PREDICTION_EXPORT.endswith(".jsonl"):
+                row = json.dumps({"actual": self.keys[actual_indices[i]],
+                                  "predict": self.keys[predicted_indices[i]],
+                                  "margin": system.round_num(float(margin)),
+                                  "scores": top_scores,
+                                  "text": context})
+            else:
+                row = u"{a}\t{p}\t{m}\t{s}\t{t}".format(
+                    a=self.keys[actual_indices[i]], p=self.keys[predicted_indices[i]],
+                    m=system.round_num(float(margin)),
+                    s=",".join((u"{l}:{v}".format(l=l, v=v)) for (l, v) in top_scores),
+                    t=re.sub("[\t\n]", " ", context))
+            export_file.write(system.to_utf8(row) + "\n")
+        return
+
     def categorize(self, text):
         """Return category for TEXT"""
         # TODO: Add support for category distribution
@@ -217,20 +807,217 @@ class TextCategorizer(object):
         debug.trace_fmtd(5, "categorize() => {r}", r=label)
         return label
 
+    def get_features(self, texts):
+        """Return TF/IDF matrix for TEXTS (i.e., output of pipeline prior to classifier)"""
+        return Pipeline(self.classifier.steps[:-1]).transform(texts)
+
+    def find_similar(self, text, k=SIMILAR_K):
+        """Return list of dicts with label, score and text for K training articles most similar to TEXT
+        Note: requires model trained with SIMILAR_INDEX"""
+        if not self.similar_index:
+            return []
+        matches = self.similar_index.query(self.get_features([text]), k)
+        return [{"label": self.similar_index.labels[row], "score": system.round_num(score, 4),
+                 "text": self.similar_index.snippets[row]}
+                for (row, score) in matches]
+
+    def categorize_batch(self, texts):
+        """Return list of categories for TEXTS, using a single vectorized prediction"""
+        debug.trace_fmtd(4, "tc.categorize_batch(_); len={n}", n=len(texts))
+        indices = self.classifier.predict(texts)
+        labels = [self.keys[i] for i in indices]
+        debug.trace_fmtd(5, "categorize_batch() => {r}", r=labels)
+        return labels
+
+    def categorize_stream(self, stream, max_tokens=None, sampling=None, window_tokens=None,
+                          aggregate=None):
+        """Return category for document read incrementally from binary STREAM.
+        Term counts are accumulated in windows of WINDOW_TOKENS, keeping at most MAX_TOKENS
+        either from the start (SAMPLING=head) or via reservoir sampling of windows (SAMPLING=sample).
+        If AGGREGATE, each window is classified separately and the scores averaged.
+        Returns None if the document has no tokens (e.g., empty or just whitespace)."""
+        # Note: assumes the default unigram word analyzer for the vectorizer
+        debug.trace_fmtd(4, "tc.categorize_stream(_, m={m}, s={s}, w={w}, a={a})",
+                         m=max_tokens, s=sampling, w=window_tokens, a=aggregate)
+        if max_tokens is None:
+            max_tokens = STREAM_MAX_TOKENS
+        if sampling is None:
+            sampling = STREAM_SAMPLING
+        if window_tokens is None:
+            window_tokens = STREAM_WINDOW_TOKENS
+        if aggregate is None:
+            aggregate = STREAM_AGGREGATE
+        window_tokens = max(1, min(window_tokens, max_tokens))
+        max_windows = max(1, max_tokens // window_tokens)
+        vectorizer = self.classifier.named_steps['vect']
+        vocabulary = vectorizer.vocabulary_
+        stop_words = vectorizer.get_stop_words() or frozenset()
+        random = numpy.random.RandomState(STREAM_SEED)
+
+        # Accumulate term counts by window, keeping head or a random sample of the windows
+        windows = []
+        counts = defaultdict(int)
+        num_window_tokens = 0
+        num_windows = 0
+        num_tokens = 0
+        for token in iterate_stream_tokens(stream, vectorizer.build_preprocessor(),
+                                           vectorizer.build_tokenizer()):
+            num_tokens += 1
+            num_window_tokens += 1
+            if token not in stop_words:
+                index = vocabulary.get(token)
+                if index is not None:
+                    counts[index] += 1
+            if (num_window_tokens < window_tokens):
+                continue
+            num_windows += 1
+            if (len(windows) < max_windows):
+                windows.append(counts)
+            elif (sampling == "head"):
+                break
+            else:
+                pos = random.randint(num_windows)
+                if (pos < max_windows):
+                    windows[pos] = counts
+            counts = defaultdict(int)
+            num_window_tokens = 0
+        if ((num_window_tokens > 0) and (len(windows) < max_windows)):
+            windows.append(counts)
+        debug.trace_fmtd(5, "{n} windows seen; {k} kept", n=num_windows, k=len(windows))
+        if (num_tokens == 0):
+            debug.trace_fmtd(4, "categorize_stream() => None (no tokens)")
+            return None
+
+        # Classify the combined counts or the individual windows
+        if not aggregate:
+            combined = defaultdict(int)
+            for window in windows:
+                for (index, count) in window.items():
+                    combined[index] += count
+            windows = [combined]
+        rows = []
+        cols = []
+        data = []
+        for (i, window) in enumerate(windows):
+            for (index, count) in window.items():
+                rows.append(i)
+                cols.append(index)
+                data.append(count)
+        counts_matrix = sparse.csr_matrix((data, (rows, cols)),
+                                          shape=(max(1, len(windows)), len(vocabulary)),
+                                          dtype=vectorizer.dtype)
+        features = self.classifier.named_steps['tfidf'].transform(counts_matrix)
+        classifier = self.classifier.named_steps['clf']
+        if aggregate:
+            scores = get_class_scores(classifier, features).mean(axis=0)
+            index = classifier.classes_[numpy.argmax(scores)]
+        else:
+            index = classifier.predict(features)[0]
+        label = self.keys[index]
+        debug.trace_fmtd(5, "categorize_stream() => {r}", r=label)
+        return label
+
+    def partial_train(self, texts, labels):
+        """Update classifier incrementally using TEXTS with LABELS, returning number of instances used.
+        Note: The update is done over a copy that is swapped in at the end, so that
+        concurrent categorization is not affected (see get_updated_classifier)."""
+        debug.trace_fmtd(4, "tc.partial_train(_, _); len={n}", n=len(texts))
+        (classifier, num_used) = self.get_updated_classifier(self.classifier, texts, labels)
+        if classifier:
+            self.classifier = classifier
+        return num_used
+
+    def get_updated_classifier(self, current, texts, labels):
+        """Return tuple with copy of CURRENT classifier pipeline updated using TEXTS with LABELS
+        (or None if no update) and the number of instances used.
+        Note: The classifier must support partial_fit (e.g., SGD or NB), and labels not in the model
+        are ignored."""
+        values = []
+        label_indices = []
+        for (text, label) in zip(texts, labels):
+            label = label.lower()
+            if label in self.keys:
+                values.append(text)
+                label_indices.append(self.keys.index(label))
+            else:
+                debug.trace_fmtd(3, "Warning: Ignoring feedback label {l} not in model", l=label)
+        classifier = current.named_steps['clf']
+        if not hasattr(classifier, "partial_fit"):
+            debug.trace_fmtd(1, "Error: {c} does not support partial_fit",
+                             c=type(classifier).__name__)
+            return (None, 0)
+        if not values:
+            return (None, 0)
+        new_classifier = copy.deepcopy(classifier)
+        features = Pipeline(current.steps[:-1]).transform(values)
+        new_classifier.partial_fit(features, label_indices)
+        return (Pipeline(current.steps[:-1] + [('clf', new_classifier)]), len(values))
+
+    def get_size_breakdown(self):
+        """Return list of (component, bytes) for the in-memory size of the model (e.g., vect.vocabulary_)
+        Note: covers the fitted attributes of the pipeline steps, including nested estimators"""
+        breakdown = [("keys", get_object_size(self.keys))]
+
+        def add_components(prefix, estimator):
+            """Add sizes for fitted attributes of ESTIMATOR using PREFIX for the labels"""
+            for (name, value) in sorted(vars(estimator).items()):
+                if hasattr(value, "get_params"):
+                    add_components(prefix + name + ".", value)
+                elif isinstance(value, (list, tuple)) and value and all(hasattr(v, "get_params") for v in value):
+                    for (i, sub_estimator) in enumerate(value):
+                        add_components("{p}{n}[{i}].".format(p=prefix, n=name, i=i), sub_estimator)
+                elif isinstance(value, dict) and value and all(hasattr(v, "get_params") for v in value.values()):
+                    # note: keyed estimators (e.g., per-group models for the hierarchy)
+                    for key in sorted(value):
+                        add_components("{p}{n}[{k}].".format(p=prefix, n=name, k=key), value[key])
+                elif name.endswith("_") or name.startswith("_"):
+                    size = get_object_size(value)
+                    if (size > 0):
+                        breakdown.append((prefix + name, size))
+            return
+
+        if self.classifier is not None:
+            for (step_name, step) in self.classifier.steps:
+                add_components(step_name + ".", step)
+        debug.trace_fmtd(6, "get_size_breakdown() => {b}", b=breakdown)
+        return breakdown
+
+    def get_model_size(self):
+        """Return total in-memory size of model in bytes (see get_size_breakdown)"""
+        return sum(size for (_component, size) in self.get_size_breakdown())
+
     def save(self, filename):
         """Save classifier to FILENAME"""
+        # Note: for hierarchical models, the group models are saved in separate files
         debug.trace_fmtd(4, "tc.save({f})", f=filename)
+        classifier = self.classifier.steps[-1][1] if (self.classifier is not None) else None
+        if isinstance(classifier, HierarchicalClassifier):
+            classifier.save_groups(filename)
+        # note: an index from a previous model would no longer match
+        if self.similar_index:
+            self.similar_index.save(filename + ".similar")
+        elif os.path.exists(filename + ".similar"):
+            os.remove(filename + ".similar")
         system.save_object(filename, [self.keys, self.classifier])
         return
 
     def load(self, filename):
         """Load classifier from FILENAME"""
+        # Note: the time taken is recorded in load_seconds (e.g., for inspect_model.py)
         debug.trace_fmtd(4, "tc.load({f})", f=filename)
+        start = time.time()
         try:
             (self.keys, self.classifier) = system.load_object(filename)
+            classifier = self.classifier.steps[-1][1] if (self.classifier is not None) else None
+            if isinstance(classifier, HierarchicalClassifier):
+                classifier.model_filename = filename
+            if os.path.exists(filename + ".similar"):
+                self.similar_index = load_similarity_index(filename + ".similar")
         except (TypeError, ValueError):
             system.print_stderr("Problem loading classifier from {f}: {exc}".
                                 format(f=filename, exc=sys.exc_info()))
+        self.load_seconds = time.time() - start
+        debug.trace_fmtd(4, "Model loaded in {t} seconds", t=self.load_seconds)
         return
 
 #-------------------------------------------------------------------------------
@@ -305,6 +1092,336 @@ CATEGORY_IMAGE_HASH = {
     "weather": "/static/weather.png",
 }
 
+STATIC_URL_PREFIX = "/static/"
+
+
+class StaticAssetCache(object):
+    """Serves files from static directory (e.g., category images) out of memory, with ETag validation.
+    Note: the files are read once at startup, and the cache is shared by the server threads."""
+    _cp_config = {'tools.sessions.on': False}
+
+    def __init__(self, directory=STATIC_DIR, max_age=IMAGE_MAX_AGE):
+        """Class constructor: loads files in DIRECTORY to be cached by clients for MAX_AGE seconds"""
+        debug.trace_fmtd(5, "StaticAssetCache.__init__({d}, {m})", d=directory, m=max_age)
+        self.max_age = max_age
+        # note: maps file name to (contents, content-type, etag)
+        self.assets = {}
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if not os.path.isfile(path):
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+                content_type = (mimetypes.guess_type(name)[0] or "application/octet-stream")
+                etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+                self.assets[name] = (data, content_type, etag)
+        debug.trace_fmtd(4, "Cached {n} static files from {d}", n=len(self.assets), d=directory)
+        return
+
+    def get_data_uri(self, url, max_size=INLINE_IMAGE_MAX):
+        """Return data URI for static URL if cached and at most MAX_SIZE bytes, else None"""
+        if not url.startswith(STATIC_URL_PREFIX):
+            return None
+        asset = self.assets.get(url[len(STATIC_URL_PREFIX):])
+        if (not asset) or (len(asset[0]) > max_size):
+            return None
+        (data, content_type, _etag) = asset
+        return "data:" + content_type + ";base64," + base64.b64encode(data).decode("ascii")
+
+    @cherrypy.expose
+    def default(self, *path, **kwargs):
+        """Return cached file for PATH, or 304 status if the client's copy is current"""
+        debug.trace_fmtd(6, "StaticAssetCache.default({p}, kw:{kw})", p=path, kw=kwargs)
+        asset = self.assets.get("/".join(path))
+        if not asset:
+            raise cherrypy.NotFound()
+        (data, content_type, etag) = asset
+        headers = cherrypy.response.headers
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "public, max-age={m}".format(m=self.max_age)
+        if_none_match = cherrypy.request.headers.get("If-None-Match", "")
+        if ((if_none_match.strip() == "*")
+                or (etag in [tag.strip() for tag in if_none_match.split(",")])):
+            cherrypy.response.status = 304
+            return b""
+        headers["Content-Type"] = content_type
+        return data
+
+
+class MicroBatcher(object):
+    """Groups concurrent categorization requests so that a single predict call handles them.
+    Note: the wait window shrinks when batches are singletons (low load) and grows as requests pile up."""
+
+    def __init__(self, text_cat, max_window=MICRO_BATCH_WINDOW, max_size=MICRO_BATCH_MAX):
+        """Class constructor: TEXT_CAT is used for prediction over batches of at most MAX_SIZE collected within MAX_WINDOW seconds"""
+        debug.trace_fmtd(5, "MicroBatcher.__init__(_, w={w}, m={m})", w=max_window, m=max_size)
+        self.text_cat = text_cat
+        self.max_window = max_window
+        self.max_size = max(1, max_size)
+        self.window = 0.0
+        self.pending = []
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.process_batches, name="micro-batcher")
+        self.worker.daemon = True
+        self.worker.start()
+        return
+
+    def categorize(self, text):
+        """Return category for TEXT once its batch has been processed (blocking the calling thread)"""
+        request = {"text": text, "done": threading.Event(), "label": None, "error": None}
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["label"]
+
+    def next_batch(self):
+        """Wait for pending requests and return the next batch, waiting up to the current window for more to arrive"""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.time() + self.window
+            while (len(self.pending) < self.max_size):
+                remaining = deadline - time.time()
+                if (remaining <= 0):
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_size]
+            del self.pending[:self.max_size]
+        return batch
+
+    def adjust_window(self, batch_size):
+        """Adapt the wait window given size of last batch: halve for singletons and double otherwise"""
+        # Note: Even with a zero window, requests arriving during a predict call are batched together,
+        # so the window starts growing only once there is concurrent load.
+        if (batch_size <= 1):
+            self.window = self.window / 2 if (self.window > 0.0001) else 0.0
+        else:
+            self.window = min(self.max_window, max(2 * self.window, 0.0005))
+        debug.trace_fmtd(7, "batch size {n}; new window {w}", n=batch_size, w=self.window)
+        return
+
+    def process_batches(self):
+        """Worker thread loop: categorize each batch and wake up the waiting request threads"""
+        while True:
+            batch = self.next_batch()
+            try:
+                labels = self.text_cat.categorize_batch([r["text"] for r in batch])
+                for (request, label) in zip(batch, labels):
+                    request["label"] = label
+            except:
+                debug.trace_fmtd(2, "Warning: Problem categorizing batch: {exc}", exc=sys.exc_info())
+                for request in batch:
+                    request["error"] = sys.exc_info()[1]
+            for request in batch:
+                request["done"].set()
+            self.adjust_window(len(batch))
+        return
+
+
+class OnlineLearner(object):
+    """Buffers labeled feedback and applies it in the background via TextCategorizer.get_updated_classifier,
+    with each update checked against held-out accuracy before use, along with periodic checkpoints"""
+
+    def __init__(self, text_cat, checkpoint_file, holdout_file=ONLINE_HOLDOUT_FILE):
+        """Class constructor: updates for TEXT_CAT get saved to CHECKPOINT_FILE, provided accuracy over HOLDOUT_FILE holds up"""
+        debug.trace_fmtd(5, "OnlineLearner.__init__(_, {c}, {h})", c=checkpoint_file, h=holdout_file)
+        self.text_cat = text_cat
+        self.checkpoint_file = checkpoint_file
+        self.buffer = []
+        self.num_updates = 0
+        self.num_rejected = 0
+        self.num_dropped = 0
+        self.last_checkpoint = time.time()
+        self.condition = threading.Condition()
+        self.holdout = None
+        self.published_classifier = text_cat.classifier
+        self.published_accuracy = None
+        if holdout_file:
+            (labels, values) = read_categorization_data(holdout_file)
+            self.holdout = [(v, text_cat.keys.index(l)) for (l, v) in zip(labels, values)
+                            if l in text_cat.keys]
+            self.published_accuracy = self.holdout_accuracy(self.published_classifier)
+            debug.trace_fmtd(3, "Initial held-out accuracy: {a}", a=self.published_accuracy)
+        self.worker = threading.Thread(target=self.process_feedback, name="online-learner")
+        self.worker.daemon = True
+        self.worker.start()
+        return
+
+    def add_feedback(self, text, label):
+        """Queue TEXT with correct LABEL for the next update, returning number of pending instances"""
+        with self.condition:
+            if (len(self.buffer) >= ONLINE_MAX_BUFFER):
+                self.num_dropped += 1
+                debug.trace_fmtd(3, "Warning: feedback buffer full; dropping instance")
+            else:
+                self.buffer.append((text, label))
+            if (len(self.buffer) >= ONLINE_BATCH_SIZE):
+                self.condition.notify()
+            num_pending = len(self.buffer)
+        return num_pending
+
+    def holdout_accuracy(self, classifier):
+        """Return accuracy of CLASSIFIER pipeline over the held-out instances"""
+        if not self.holdout:
+            return None
+        predicted = classifier.predict([v for (v, _i) in self.holdout])
+        num_ok = sum([(predicted[j] == i) for (j, (_v, i)) in enumerate(self.holdout)])
+        return float(num_ok) / len(self.holdout)
+
+    def update(self, texts, labels):
+        """Update the classifier using TEXTS with LABELS, publishing the result for categorization
+        unless held-out accuracy drops too much (in which case the update is discarded)"""
+        (candidate, num_used) = self.text_cat.get_updated_classifier(self.published_classifier, texts, labels)
+        if not candidate:
+            return
+        accuracy = self.holdout_accuracy(candidate)
+        debug.trace_fmtd(4, "Update held-out accuracy: {new} (vs. {old})",
+                         new=accuracy, old=self.published_accuracy)
+        if ((accuracy is not None) and (self.published_accuracy is not None)
+                and (accuracy < (self.published_accuracy - ONLINE_MAX_ACCURACY_DROP))):
+            debug.trace_fmtd(2, "Warning: discarding online update due to held-out accuracy {new} vs. {old}",
+                             new=accuracy, old=self.published_accuracy)
+            self.num_rejected += num_used
+            return
+        self.text_cat.classifier = self.published_classifier = candidate
+        if accuracy is not None:
+            self.published_accuracy = accuracy
+        self.num_updates += num_used
+        return
+
+    def checkpoint(self):
+        """Save the model in use (i.e., with the accepted updates) to the checkpoint file"""
+        debug.trace_fmtd(4, "Checkpoint held-out accuracy: {a}", a=self.published_accuracy)
+        self.text_cat.save(self.checkpoint_file)
+        self.last_checkpoint = time.time()
+        return
+
+    def process_feedback(self):
+        """Worker thread loop: apply buffered feedback in batches and checkpoint periodically"""
+        while True:
+            with self.condition:
+                if (len(self.buffer) < ONLINE_BATCH_SIZE):
+                    self.condition.wait(ONLINE_UPDATE_INTERVAL)
+                batch = self.buffer
+                self.buffer = []
+            try:
+                if batch:
+                    texts = [text for (text, _label) in batch]
+                    labels = [label for (_text, label) in batch]
+                    self.update(texts, labels)
+                if ((time.time() - self.last_checkpoint) >= ONLINE_CHECKPOINT_INTERVAL):
+                    self.checkpoint()
+            except:
+                debug.trace_fmtd(2, "Warning: Problem during online update: {exc}", exc=sys.exc_info())
+        return
+
+
+class ServerBusyError(cherrypy.HTTPError):
+    """503 error including Retry-After header (n.b., HTTPError resets the response headers)"""
+
+    def __init__(self, retry_after=ADMISSION_RETRY_AFTER):
+        """Class constructor: RETRY_AFTER gives seconds for client to wait"""
+        super(ServerBusyError, self).__init__(503, "Server busy")
+        self.retry_after = retry_after
+        return
+
+    def set_response(self):
+        """Set response for the error, adding the Retry-After header"""
+        super(ServerBusyError, self).set_response()
+        cherrypy.response.headers["Retry-After"] = str(self.retry_after)
+        return
+
+
+class AdmissionController(object):
+    """Bounds the number of requests being processed and waiting, shedding the rest with 503 status"""
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 deadline=ADMISSION_DEADLINE, degraded_fraction=DEGRADED_QUEUE_FRACTION):
+        """Class constructor: allows MAX_CONCURRENT requests with MAX_QUEUE waiting up to DEADLINE seconds.
+        Note: requests are flagged as degraded when the queue is over DEGRADED_FRACTION full"""
+        debug.trace_fmtd(5, "AdmissionController.__init__({c}, {q}, {d})", c=max_concurrent, q=max_queue, d=deadline)
+        self.max_queue = max_queue
+        self.deadline = deadline
+        self.degraded_queue_size = (degraded_fraction * max_queue)
+        self.max_concurrent = max_concurrent
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.num_waiting = 0
+        self.num_active = 0
+        self.counts = {"served": 0, "shed_queue_full": 0, "shed_deadline": 0, "degraded": 0, "late": 0}
+        return
+
+    def count(self, key):
+        """Increment count for KEY"""
+        with self.lock:
+            self.counts[key] += 1
+        return
+
+    def reject(self, key):
+        """Count rejection for KEY and raise 503 error with Retry-After header"""
+        self.count(key)
+        raise ServerBusyError()
+
+    @contextmanager
+    def admit(self):
+        """Context manager that waits for processing slot, yielding whether request should be degraded
+        Note: raises 503 HTTPError if the queue is full or the deadline passes while waiting"""
+        start = time.time()
+        with self.condition:
+            queue_full = (self.num_waiting >= self.max_queue)
+            if not queue_full:
+                self.num_waiting += 1
+                degraded = (self.num_waiting > self.degraded_queue_size)
+                while (self.num_active >= self.max_concurrent):
+                    remaining = (start + self.deadline) - time.time()
+                    if (remaining <= 0):
+                        break
+                    self.condition.wait(remaining)
+                self.num_waiting -= 1
+                admitted = (self.num_active < self.max_concurrent)
+                if admitted:
+                    self.num_active += 1
+        if queue_full:
+            self.reject("shed_queue_full")
+        if not admitted:
+            self.reject("shed_deadline")
+        try:
+            if degraded:
+                self.count("degraded")
+            yield degraded
+        finally:
+            with self.condition:
+                self.num_active -= 1
+                self.counts["served"] += 1
+                if ((time.time() - start) > self.deadline):
+                    self.counts["late"] += 1
+                self.condition.notify()
+        return
+
+    def get_stats(self):
+        """Return dict with counts of served, shed and degraded requests, along with current load"""
+        with self.lock:
+            stats = dict(self.counts)
+            stats.update({"active": self.num_active, "waiting": self.num_waiting})
+        return stats
+
+
+# note: request IDs for the traces (e.g., with ASYNC_TRACE in debug.py)
+request_counter = itertools.count(1)
+
+
+def set_trace_request_id():
+    """Assign ID to current request for use in traces (see debug.set_request_id)"""
+    debug.set_request_id(next(request_counter))
+    return
+
+
+cherrypy.tools.trace_request = cherrypy.Tool('on_start_resource', set_trace_request_id)
+
 
 class web_controller(object):
     """Controller for CherryPy web server with embedded text categorizer"""
@@ -316,9 +1433,21 @@ class web_controller(object):
                          s=self, a=args, k=kwargs)
         self.text_cat = TextCategorizer()
         self.text_cat.load(model_filename)
+        self.batcher = MicroBatcher(self.text_cat) if MICRO_BATCH else None
+        self.learner = None
+        if ONLINE_LEARNING:
+            self.learner = OnlineLearner(self.text_cat,
+                                         (ONLINE_CHECKPOINT_FILE or (model_filename + ".online")))
         self.category_image = defaultdict(lambda: "/static/unknown-with-question-marks.png")
         # HACK: wikipedia categorization specific
         self.category_image.update(CATEGORY_IMAGE_HASH)
+        # note: exposed as /static, taking precedence over the staticdir tool
+        self.static = StaticAssetCache() if IMAGE_CACHE else None
+        self.admission = AdmissionController() if ADMISSION_CONTROL else None
+        self.capture_file = None
+        self.capture_lock = threading.Lock()
+        if CAPTURE_LOG:
+            self.capture_file = open(CAPTURE_LOG, "a")
         # Note: To avoid cross-origin type errrors, Access-Control-Allow-Origin
         # is made open. See following:
         # - http://cleanbugs.com/item/how-to-get-cross-origin-sharing-cors-post-request-working-a-resource-413656.html
@@ -334,19 +1463,93 @@ class web_controller(object):
         ## OLD: return "not much here excepting categorize and get_category_image"
         return (INDEX_HTML)
 
+    def capture_request(self, route, text):
+        """Record request for ROUTE with TEXT in the capture log, if enabled"""
+        if not self.capture_file:
+            return
+        entry = {"time": time.time(), "route": route, "length": len(text)}
+        if CAPTURE_RAW_TEXT:
+            entry["text"] = text
+        else:
+            entry["hash"] = hashlib.sha1(text.encode("UTF-8", "ignore")).hexdigest()
+        # note: the file is rechecked under the lock, since stop() might have closed it meanwhile
+        with self.capture_lock:
+            if self.capture_file:
+                self.capture_file.write(json.dumps(entry) + "\n")
+                self.capture_file.flush()
+        return
+
+    def categorize_text(self, text):
+        """Infer category for TEXT, using the micro-batcher if enabled
+        Note: with admission control, this might raise 503 HTTPError (see AdmissionController)"""
+        if self.admission:
+            with self.admission.admit() as degraded:
+                if (degraded and (DEGRADED_MAX_CHARS > 0)):
+                    text = text[:DEGRADED_MAX_CHARS]
+                return self.categorize_admitted_text(text)
+        return self.categorize_admitted_text(text)
+
+    def categorize_admitted_text(self, text):
+        """Version of categorize_text without admission control"""
+        if self.batcher:
+            return self.batcher.categorize(text)
+        return self.text_cat.categorize(text)
+
     @cherrypy.expose
     def categorize(self, text, **kwargs):
         """Infer category for TEXT"""
         debug.trace_fmtd(6, "wc.categorize(s:{s}, _, kw:{kw})", s=self, kw=kwargs)
-        return self.text_cat.categorize(text)
+        self.capture_request("categorize", text)
+        return self.categorize_text(text)
+
+    @cherrypy.expose
+    def categorize_stream(self, **kwargs):
+        """Infer category for text POSTed as the request body, which is read incrementally"""
+        # Note: optional max_tokens, sampling, window_tokens and aggregate parameters override the STREAM_xyz settings
+        debug.trace_fmtd(6, "wc.categorize_stream(s:{s}, kw:{kw})", s=self, kw=kwargs)
+        aggregate = kwargs.get("aggregate")
+
+        def categorize_body():
+            """Categorize the request body, which must have some text"""
+            label = self.text_cat.categorize_stream(
+                cherrypy.request.body.fp,
+                max_tokens=system.to_int(kwargs.get("max_tokens"), None),
+                sampling=kwargs.get("sampling"),
+                window_tokens=system.to_int(kwargs.get("window_tokens"), None),
+                aggregate=(system.to_bool(aggregate) if (aggregate is not None) else None))
+            # note: otherwise the result would just reflect the class priors
+            if label is None:
+                raise cherrypy.HTTPError(400, "No text in request body")
+            return label
+
+        if self.admission:
+            with self.admission.admit():
+                return categorize_body()
+        return categorize_body()
+    # note: the body is left unprocessed so that it can be read as it arrives
+    categorize_stream._cp_config = {'request.process_request_body': False}
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['POST'])
+    def feedback(self, text, label, **kwargs):
+        """Record correct LABEL for TEXT for use in online updates to the model (n.b., POST only)"""
+        debug.trace_fmtd(6, "wc.feedback(s:{s}, _, {l}, kw:{kw})", s=self, l=label, kw=kwargs)
+        if not self.learner:
+            return json.dumps({"status": "online learning not enabled"})
+        num_pending = self.learner.add_feedback(text, label)
+        return json.dumps({"status": "ok", "pending": num_pending,
+                           "updates": self.learner.num_updates, "rejected": self.learner.num_rejected})
 
     @cherrypy.expose
     ## @cherrypy.tools.json_out()
     def get_category_image(self, text, **kwargs):
         """Infer category for TEXT and return image"""
         debug.trace_fmtd(5, "wc.get_category_image(_, {kw}); self={s}", t=text, s=self, kw=kwargs)
-        cat = self.categorize(text, **kwargs)
+        self.capture_request("get_category_image", text)
+        cat = self.categorize_text(text)
         image = self.category_image[cat]
+        if self.static and (INLINE_IMAGE_MAX > 0):
+            image = (self.static.get_data_uri(image) or image)
         # for JSONP, need to add callback call and format the call
         # TODO: see if cherrypy handles this
         # see https://stackoverflow.com/questions/19456146/ajax-call-and-clean-json-but-syntax-error-missing-before-statement
@@ -362,12 +1565,49 @@ class web_controller(object):
         debug.trace_fmtd(6, "wc.get_category_image() => {r}", r=result)
         return result
 
+    @cherrypy.expose
+    def similar(self, text, k=SIMILAR_K, **kwargs):
+        """Return JSON with category for TEXT and the K most similar training articles"""
+        debug.trace_fmtd(6, "wc.similar(s:{s}, _, {k}, kw:{kw})", s=self, k=k, kw=kwargs)
+        if not (re.search(r"^\d+$", str(k)) and (int(k) > 0)):
+            raise cherrypy.HTTPError(400, "k must be a positive integer")
+        if self.admission:
+            with self.admission.admit() as degraded:
+                if (degraded and (DEGRADED_MAX_CHARS > 0)):
+                    text = text[:DEGRADED_MAX_CHARS]
+                return self.similar_admitted_text(text, int(k))
+        return self.similar_admitted_text(text, int(k))
+
+    def similar_admitted_text(self, text, k):
+        """Version of similar without admission control: returns JSON with category and K similar articles"""
+        return json.dumps({"category": self.categorize_admitted_text(text),
+                           "similar": self.text_cat.find_similar(text, k)})
+
+    @cherrypy.expose
+    def stats(self, **kwargs):
+        """Return JSON with server statistics (e.g., cascade escalation rate)"""
+        debug.trace_fmtd(6, "wc.stats(s:{s}, kw:{kw})", s=self, kw=kwargs)
+        result = {}
+        classifier = self.text_cat.classifier.steps[-1][1]
+        if isinstance(classifier, CascadeClassifier):
+            result["cascade"] = classifier.get_stats()
+        if self.learner:
+            result["online_updates"] = self.learner.num_updates
+            result["online_rejected"] = self.learner.num_rejected
+        if self.admission:
+            result["admission"] = self.admission.get_stats()
+        return json.dumps(result)
+
     @cherrypy.expose
     def stop(self, **kwargs):
         """Stops the web search server and saves cached data to disk"""
         debug.trace_fmtd(5, "wc.stop(s:{s}, kw:{kw})", s=self, kw=kwargs)
         if os.environ.get("HOST_NICKNAME") in ["hostwinds", "ec2-micro"]:
             return "Call security!"
+        with self.capture_lock:
+            if self.capture_file:
+                self.capture_file.close()
+                self.capture_file = None
         cherrypy.engine.stop()
         cherrypy.engine.exit()
         # TODO: use HTML so shutdown shown in title
@@ -385,9 +1625,14 @@ def start_web_controller(model_filename):
 
     # Load in CherryPy configuration
     # TODO: use external configuration file
+    # note: with admission control, there must be threads for the queued requests (see AdmissionController)
+    num_threads = SERVER_THREADS
+    if ADMISSION_CONTROL:
+        num_threads = max(num_threads, (ADMISSION_MAX_CONCURRENT + ADMISSION_MAX_QUEUE + ADMISSION_SPARE_THREADS))
     conf = {
         '/': {
             'tools.sessions.on': True,
+            'tools.trace_request.on': True,
             'tools.staticdir.root': os.path.abspath(os.getcwd()),
             ## take 2: on avoiding cross-origin type errrors
             'tools.response_headers.on': True,
@@ -399,7 +1644,7 @@ def start_web_controller(model_filename):
         'global': {
             'server.socket_host': "0.0.0.0",
             'server.socket_port': SERVER_PORT,
-            'server.thread_pool': 10,
+            'server.thread_pool': num_threads,
             }
         }
 
@@ -425,4 +1670,7 @@ def main(args):
     return
 
 if __name__ == '__main__':
-    main(sys.argv)
+    # note: runs via the module import, so that classes in loaded models (e.g., CascadeClassifier)
+    # are the same as the ones used here (i.e., not separate copies from __main__)
+    import text_categorizer
+    text_categorizer.main(sys.argv)
@@ -16,9 +16,12 @@ import sys
 import debug
 import system
 from text_categorizer import TextCategorizer
+from stage_profiler import profiler
 
 
 SHOW_REPORT = system.getenv_bool("SHOW_REPORT", False)
+# note: budget is in megabytes (0 for none); see inspect_model.py for a breakdown
+MODEL_SIZE_BUDGET = system.getenv_float("MODEL_SIZE_BUDGET", 0)
 
 
 def usage():
@@ -57,6 +60,15 @@ def main(args=None):
     if training_filename and (training_filename != "-"):
         text_cat.train(training_filename)
         new_model = True
+        classifier = text_cat.classifier.steps[-1][1]
+        if hasattr(classifier, "report_calibration"):
+            classifier.report_calibration()
+        model_size = text_cat.get_model_size()
+        debug.trace_fmtd(3, "Model size: {s} bytes", s=model_size)
+        if (MODEL_SIZE_BUDGET > 0) and (model_size > (MODEL_SIZE_BUDGET * 1024 * 1024)):
+            system.print_stderr("Warning: model size of {s}MB exceeds budget of {b}MB".
+                                format(s=system.round_num(model_size / (1024.0 * 1024), 3),
+                                       b=MODEL_SIZE_BUDGET))
     if model_filename and (model_filename != "-"):
         if new_model:
             text_cat.save(model_filename)
@@ -68,6 +80,8 @@ def main(args=None):
     # Show usage if nothing done (e.g., due to too many -'s for filenames)
     if (not (new_model or accuracy)):
         usage()
+    # Show the timing summary (see PROFILE_STAGES)
+    profiler.report()
               
     return
 
@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+#
+# Parser for Wikipedia category pages, which extracts the subcategory links, member page
+# links and continuation links (e.g., "next page") in a single pass over the HTML. This
+# replaces the line-by-line scanning formerly in download_wiki_category.py, so it doesn't
+# depend on how MediaWiki breaks up the lines.
+#
+# The div tags and links are matched via a single compiled pattern, with the section in
+# effect tracked as the matches are processed. Only links within the MediaWiki section
+# containers are used (i.e., <div id="mw-subcategories"> and <div id="mw-pages">), so
+# that links from the sidebar, footer and category links box are excluded. Links to
+# other namespaces (e.g., Help: or Portal:) are also excluded from the pages.
+#
+# When run as a script, this benchmarks the parser against the old line-based approach
+# over saved category pages (e.g., the .html files written by download_wiki_category.py).
+# With --self-test, the saved pages in FIXTURE_DIR are instead checked against the
+# expected links in the corresponding .json files.
+#
+# Copyright (c) 2018 Thomas P. O'Hara
+#
+
+"""Single-pass parser for Wikipedia category pages"""
+
+# Standard packages
+import json
+import os
+import re
+import sys
+import time
+
+# Local packages
+import debug
+import system
+
+PAGES_START = system.getenv_text("PAGES_START", "Pages in category")
+PAGES_END = system.getenv_text("PAGES_END", "Media in category")
+BENCHMARK_ITERATIONS = system.getenv_int("BENCHMARK_ITERATIONS", 100)
+FIXTURE_DIR = system.getenv_text("FIXTURE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             "fixtures"))
+
+SUBCATS_SECTION = "subcats"
+PAGES_SECTION = "pages"
+# note: maps container div IDs to sections
+SECTION_IDS = {"mw-subcategories": SUBCATS_SECTION, "mw-pages": PAGES_SECTION}
+
+TOKEN_REGEX = re.compile(
+    r"(?P<div_start><div\b[^>]*>)"
+    r"|(?P<div_end></div\s*>)"
+    r"|<a\s[^>]*?href=\"(?P<href>[^\"]+)\"[^>]*>(?P<anchor>.*?)</a>",
+    re.DOTALL)
+DIV_ID_REGEX = re.compile(r"\sid=\"([^\"]*)\"")
+NEXT_REGEX = re.compile(r"next (page|\d+)")
+# note: titles with other prefixes are regular articles (e.g., Star_Wars:_Episode_IV)
+NAMESPACE_REGEX = re.compile(r"^/wiki/(Book|Category|Draft|File|Help|Image|MediaWiki|Module|Portal|Special|"
+                             r"Talk|Template|TimedText|User|Wikipedia|WP)(_talk)?:", re.IGNORECASE)
+
+
+def unescape_href(href):
+    """Return HREF with HTML entities for URL delimiters resolved (e.g., &amp;)"""
+    return href.replace("&amp;", "&")
+
+
+def parse_category_page(html):
+    """Returns (subcategories, pages, continuations) with the links from category page HTML
+    Note: the links are relative to the site (e.g., /wiki/Category:Dogs), with duplicates removed"""
+    subcategories = []
+    pages = []
+    continuations = []
+    seen = set()
+    section = None
+    # note: div nesting depth, along with the depth at which the current section started
+    depth = 0
+    section_depth = None
+    for match in TOKEN_REGEX.finditer(html):
+        if match.group("div_start"):
+            depth += 1
+            if section is None:
+                id_match = DIV_ID_REGEX.search(match.group("div_start"))
+                if id_match and (id_match.group(1) in SECTION_IDS):
+                    section = SECTION_IDS[id_match.group(1)]
+                    section_depth = depth
+        elif match.group("div_end"):
+            if (section is not None) and (depth == section_depth):
+                section = None
+            depth -= 1
+        elif section is not None:
+            href = unescape_href(match.group("href"))
+            if href in seen:
+                continue
+            if NEXT_REGEX.search(match.group("anchor")):
+                continuations.append(href)
+            elif ((section == SUBCATS_SECTION) and href.startswith("/wiki/Category:")):
+                subcategories.append(href)
+            elif ((section == PAGES_SECTION) and href.startswith("/wiki/")
+                  and (not NAMESPACE_REGEX.search(href))):
+                pages.append(href)
+            else:
+                continue
+            seen.add(href)
+    debug.trace_fmtd(5, "parse_category_page() => {s} subcats, {p} pages, {c} continuations",
+                     s=len(subcategories), p=len(pages), c=len(continuations))
+    return (subcategories, pages, continuations)
+
+
+def line_based_parse(html):
+    """Version of parse_category_page using the old line-by-line scan (for benchmarking)"""
+    subcategories = []
+    pages = []
+    continuations = []
+    in_subcats_section = False
+    in_pages_section = False
+    for line in html.split("\n"):
+        if re.search(r"Subcategories", line):
+            in_subcats_section = True
+        elif re.search(PAGES_START, line):
+            in_subcats_section = False
+            in_pages_section = True
+        elif re.search(PAGES_END, line):
+            in_pages_section = False
+        else:
+            match = re.search(r'</table>.*href="([^"]+)".*>.*next (\d+).*</a>', line)
+            if match:
+                in_pages_section = False
+                continuations.append(match.group(1))
+        if in_subcats_section:
+            match = re.search(r'href="(/wiki/Category:[^"]+)"', line)
+            if match:
+                subcategories.append(match.group(1))
+        elif in_pages_section:
+            match = re.search(r'<li>.*href="(/wiki/([^"]+))"', line)
+            if match:
+                pages.append(match.group(1))
+    return (subcategories, pages, continuations)
+
+
+def check_fixtures(directory=FIXTURE_DIR, stream=sys.stdout):
+    """Check parse_category_page over saved pages in DIRECTORY against the expected links
+    in the .json file for each (i.e., with subcategories, pages and continuations lists).
+    Returns number of failed pages."""
+    num_failed = 0
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith(".html"))
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        with open(re.sub(r"\.html$", ".json", path)) as f:
+            expected = json.load(f)
+        (subcategories, pages, continuations) = parse_category_page(system.read_entire_file(path))
+        actual = {"subcategories": subcategories, "pages": pages, "continuations": continuations}
+        problems = [key for key in sorted(expected) if (expected[key] != actual[key])]
+        for key in problems:
+            stream.write("{f}: {k} differs: expected {e}; got {a}\n".format(f=filename, k=key,
+                                                                         e=expected[key], a=actual[key]))
+        stream.write("{f}: {r}\n".format(f=filename, r=("FAILED" if problems else "ok")))
+        num_failed += (1 if problems else 0)
+    if not filenames:
+        stream.write("Warning: no saved pages in {d}\n".format(d=directory))
+    return num_failed
+
+#-------------------------------------------------------------------------------
+
+def main(args):
+    """Supporting code for command-line processing: benchmark over saved category pages"""
+    debug.trace_fmtd(6, "main({a})", a=args)
+    if (len(args) < 2):
+        system.print_stderr("Usage: {p} [--self-test | category-page.html ...]".format(p=args[0]))
+        system.print_stderr("")
+        system.print_stderr("Notes:")
+        system.print_stderr("- BENCHMARK_ITERATIONS gives number of parses per page ({n} by default).".
+                            format(n=BENCHMARK_ITERATIONS))
+        system.print_stderr("- --self-test checks the saved pages in FIXTURE_DIR ({d} by default).".
+                            format(d=FIXTURE_DIR))
+        return
+    if (args[1] == "--self-test"):
+        sys.exit(1 if check_fixtures() else 0)
+    print("Page\tParser\tSubcats\tPages\tNext\tMsec")
+    for filename in args[1:]:
+        html = system.read_entire_file(filename)
+        for (name, parser) in [("single-pass", parse_category_page), ("line-based", line_based_parse)]:
+            start = time.time()
+            for _i in range(BENCHMARK_ITERATIONS):
+                (subcategories, pages, continuations) = parser(html)
+            msec = 1000.0 * (time.time() - start) / BENCHMARK_ITERATIONS
+            print("{f}\t{n}\t{s}\t{p}\t{c}\t{t}".format(f=filename, n=name, s=len(subcategories),
+                                                        p=len(pages), c=len(continuations),
+                                                        t=system.round_num(msec, 3)))
+    return
+
+
+if __name__ == '__main__':
+    main(sys.argv)